@@ -0,0 +1,325 @@
+import math
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple, cast
+
+import faiss
+import numpy as np
+
+import segmented_file
+from config import VECTOR_DB_SETTINGS
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+QUANTIZATIONS = ("none", "sq8", "fp16")
+VECTORS_FILE = "vectors.f32"
+
+_SQ_TYPES = {"sq8": faiss.ScalarQuantizer.QT_8bit, "fp16": faiss.ScalarQuantizer.QT_fp16}
+# SQ8 training only estimates per-dimension ranges; a sample this size is plenty.
+_SQ_TRAIN_POINTS = 65536
+# Read-only, with the vector codes of flat / HNSW storage / IVF lists mapped from the file
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# k-means wants a few dozen points per centroid; below this IVF falls back to flat.
+_MIN_POINTS_PER_CENTROID = 39
+
+_IVF = VECTOR_DB_SETTINGS.get("ivf") or {}
+_PQ = VECTOR_DB_SETTINGS.get("pq") or {}
+_HNSW = VECTOR_DB_SETTINGS.get("hnsw") or {}
+_AUTO = VECTOR_DB_SETTINGS.get("auto") or {}
+_RECALL = VECTOR_DB_SETTINGS.get("recall_eval") or {}
+# Upper bound on efSearch when widening HNSW search for a filter
+_MAX_FILTERED_EF = 1024
+
+
+def choose_index_type(ntotal: int) -> str:
+    """Resolve vector_db.index_type, picking by KB size when it is 'auto'."""
+    configured = VECTOR_DB_SETTINGS.get("index_type", "auto")
+    if configured != "auto":
+        if configured not in INDEX_TYPES:
+            raise ValueError(f"Unknown vector_db.index_type '{configured}'; expected auto or one of {INDEX_TYPES}.")
+        return configured
+    if ntotal <= int(_AUTO.get("flat_max", 20000)):
+        return "flat"
+    if ntotal <= int(_AUTO.get("hnsw_max", 500000)):
+        return "hnsw"
+    return "ivf_pq"
+
+
+def choose_quantization() -> str:
+    configured = VECTOR_DB_SETTINGS.get("quantization") or "none"
+    if configured not in QUANTIZATIONS:
+        raise ValueError(f"Unknown vector_db.quantization '{configured}'; expected one of {QUANTIZATIONS}.")
+    return configured
+
+
+def _buildable_type(index_type: str, ntotal: int) -> str:
+    """Step down to a simpler type when there are too few vectors to train the requested one."""
+    if index_type in ("ivf_flat", "ivf_pq") and ntotal < _MIN_POINTS_PER_CENTROID * 2:
+        return "flat"
+    if index_type == "ivf_pq" and ntotal < (1 << int(_PQ.get("nbits", 8))) * _MIN_POINTS_PER_CENTROID:
+        return "ivf_flat"
+    return index_type
+
+
+def _nlist(ntotal: int) -> int:
+    configured = _IVF.get("nlist")
+    nlist = int(configured) if configured else int(4 * math.sqrt(ntotal))
+    return max(1, min(nlist, ntotal // _MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m(dim: int) -> int:
+    m = int(_PQ.get("m", 16))
+    while m > 1 and dim % m:
+        m -= 1
+    return m
+
+
+def unwrap(index: faiss.Index) -> faiss.Index:
+    """Return the concrete index behind an ID map."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+def index_type_of(index: faiss.Index) -> str:
+    inner = unwrap(index)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def quantization_of(index: faiss.Index) -> str:
+    """How the index stores vectors: none (float32), sq8, fp16, or pq for IVF-PQ."""
+    inner = unwrap(index)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "pq"
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        for name, qtype in _SQ_TYPES.items():
+            if inner.sq.qtype == qtype:
+                return name
+    return "none"
+
+
+def is_exact(index: faiss.Index) -> bool:
+    """True for a flat index over full float32 vectors (exact search, vectors recoverable)."""
+    return index_type_of(index) == "flat" and quantization_of(index) == "none"
+
+
+def build_index(vectors: np.ndarray, index_type: Optional[str] = None, quantization: Optional[str] = None) -> Tuple[faiss.IndexIDMap2, Dict[str, Any]]:
+    """
+    Build and train an ID-mapped index over vectors whose IDs are their row numbers.
+    ``quantization`` (default vector_db.quantization) stores flat, HNSW and IVF-flat
+    vectors scalar-quantized: sq8 is a quarter of the float32 size, fp16 half.
+    IVF-PQ is already compressed and ignores it. Returns the index and a description
+    of how it was built.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dim = vectors.shape
+    index_type = _buildable_type(index_type or choose_index_type(ntotal), ntotal)
+    quantization = quantization or choose_quantization()
+    qtype = _SQ_TYPES.get(quantization)
+    params: Dict[str, Any] = {}
+
+    if index_type == "flat":
+        inner = faiss.IndexFlatL2(dim) if qtype is None else faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    elif index_type == "hnsw":
+        params = {"m": int(_HNSW.get("m", 32)), "ef_construction": int(_HNSW.get("ef_construction", 200))}
+        inner = faiss.IndexHNSWFlat(dim, params["m"]) if qtype is None else faiss.IndexHNSWSQ(dim, qtype, params["m"])
+        inner.hnsw.efConstruction = params["ef_construction"]
+        inner.hnsw.efSearch = int(_HNSW.get("ef_search", 64))
+    else:
+        params = {"nlist": _nlist(ntotal)}
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_pq":
+            params.update({"m": _pq_m(dim), "nbits": int(_PQ.get("nbits", 8))})
+            inner = faiss.IndexIVFPQ(quantizer, dim, params["nlist"], params["m"], params["nbits"])
+        elif qtype is None:
+            inner = faiss.IndexIVFFlat(quantizer, dim, params["nlist"])
+        else:
+            inner = faiss.IndexIVFScalarQuantizer(quantizer, dim, params["nlist"], qtype, faiss.METRIC_L2)
+        inner.nprobe = int(_IVF.get("nprobe", 16))
+
+    if not inner.is_trained:
+        if "nlist" in params:
+            max_train = int(_IVF.get("max_train_points_per_centroid", 256)) * params["nlist"]
+        else:
+            max_train = _SQ_TRAIN_POINTS
+        if ntotal > max_train:
+            sample = np.random.default_rng(0).choice(ntotal, size=max_train, replace=False)
+            train = vectors[np.sort(sample)]
+        else:
+            train = vectors
+        cast(Any, inner).train(train)
+
+    index = faiss.IndexIDMap2(inner)
+    cast(Any, index).add_with_ids(vectors, np.arange(ntotal, dtype=np.int64))
+    info = {
+        "type": index_type,
+        "quantization": quantization_of(index),
+        "params": params,
+        "trained_on": ntotal,
+        "built_at": datetime.now().isoformat(),
+    }
+    return index, info
+
+
+def needs_rebuild(index: faiss.Index, index_info: Dict[str, Any], ntotal: int) -> bool:
+    """True when the KB has outgrown its index type or its training, or its quantization setting changed."""
+    if index_type_of(index) != _buildable_type(choose_index_type(ntotal), ntotal):
+        return True
+    if quantization_of(index) not in ("pq", choose_quantization()):
+        return True
+    if index_type_of(index).startswith("ivf") or quantization_of(index) == "sq8":
+        # IVF centroids and SQ8 value ranges are fitted to the vectors seen at training time
+        return ntotal > float(_IVF.get("retrain_growth", 4.0)) * int(index_info.get("trained_on") or 1)
+    return False
+
+
+def id_selector(allowed: np.ndarray) -> faiss.IDSelector:
+    """
+    A FAISS selector admitting the chunk IDs set in a boolean mask indexed by chunk ID.
+    It is a bitmap, so membership is one bit test during search, whatever the mask's size.
+    """
+    bits = np.packbits(np.asarray(allowed, dtype=bool), bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bits))
+    selector.bits = bits  # the selector only points at the buffer; keep it alive with it
+    return selector
+
+
+def search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None, allowed: Optional[np.ndarray] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Per-request search knobs for the index's type, defaulting to vector_db config.
+    ``allowed`` (a boolean mask by chunk ID) restricts the search to those chunks
+    with an ID selector; an ID-mapped index translates its internal positions to
+    chunk IDs before asking it. The fewer chunks a filter admits, the fewer of
+    them the probed IVF lists or HNSW neighbourhood hold, so nprobe / efSearch are
+    widened in proportion (within the index's limits).
+    """
+    inner = unwrap(index)
+    widen = 1.0
+    if allowed is not None:
+        widen = 1.0 / max(float(np.count_nonzero(allowed)) / max(len(allowed), 1), 1e-6)
+    if isinstance(inner, faiss.IndexIVF):
+        probes = int(nprobe or _IVF.get("nprobe", 16))
+        params: faiss.SearchParameters = faiss.SearchParametersIVF(nprobe=min(inner.nlist, int(math.ceil(probes * widen))))
+    elif isinstance(inner, faiss.IndexHNSW):
+        ef = int(ef_search or _HNSW.get("ef_search", 64))
+        params = faiss.SearchParametersHNSW(efSearch=min(max(ef, _MAX_FILTERED_EF), int(math.ceil(ef * widen))))
+    elif allowed is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if allowed is not None:
+        params.sel = id_selector(allowed)
+        params.selector = params.sel  # the params only point at the selector; keep it alive with them
+    return params
+
+
+def measure_recall(index: faiss.Index, vectors: np.ndarray, k: Optional[int] = None, n_queries: Optional[int] = None) -> Dict[str, Any]:
+    """
+    recall@k of the index against exact search, using stored vectors as queries
+    and the index's default search parameters.
+    """
+    k = int(k or _RECALL.get("k", 10))
+    n_queries = int(n_queries or _RECALL.get("sample_queries", 200))
+    ntotal = len(vectors)
+    k = min(k, ntotal)
+    if is_exact(index) or ntotal == 0:
+        return {"recall_at_k": 1.0, "k": k, "queries": 0}
+    rng = np.random.default_rng(0)
+    sample = rng.choice(ntotal, size=min(n_queries, ntotal), replace=False)
+    queries = np.ascontiguousarray(vectors[np.sort(sample)], dtype=np.float32)
+
+    # Exact neighbours by brute force over blocks, so a large memory-mapped KB is never copied whole.
+    heap = faiss.ResultHeap(len(queries), k)
+    block = 65536
+    for start in range(0, ntotal, block):
+        D, I = faiss.knn(queries, np.ascontiguousarray(vectors[start:start + block], dtype=np.float32), k)
+        heap.add_result(D, np.where(I >= 0, I + start, -1))
+    heap.finalize()
+    truth = heap.I
+    _, found = cast(Any, index).search(queries, k, params=search_params(index))
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    return {"recall_at_k": round(hits / (len(queries) * k), 4), "k": k, "queries": len(queries)}
+
+
+def write_index(index: faiss.Index, path: str) -> None:
+    """
+    Write an index by replacing the file atomically. Readers may have the old file
+    memory-mapped; they keep its (unlinked) contents until they reload.
+    """
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_index(path: str, mmap: Optional[bool] = None) -> faiss.Index:
+    """
+    Open an index for searching. With vector_db.mmap (the default) the vector codes
+    are memory-mapped read-only rather than copied onto the heap, so every worker
+    process serving the KB shares one page-cached copy. Such an index must not be
+    modified; appends read the file afresh.
+    """
+    if mmap is None:
+        mmap = bool(VECTOR_DB_SETTINGS.get("mmap", True))
+    return faiss.read_index(path, _MMAP_FLAGS) if mmap else faiss.read_index(path)
+
+
+def resident_nbytes(index: faiss.Index, path: str, mmap: Optional[bool] = None) -> int:
+    """
+    Heap held by an index opened with read_index(). The serialized size is a close
+    proxy, less the vector codes when they are memory-mapped (page cache, not heap).
+    """
+    size = os.path.getsize(path)
+    if mmap is None:
+        mmap = bool(VECTOR_DB_SETTINGS.get("mmap", True))
+    if not mmap:
+        return size
+    inner = unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    return max(0, size - index.ntotal * int(getattr(inner, "code_size", 0)))
+
+
+def vectors_path(index_path: str) -> str:
+    return os.path.join(os.path.dirname(index_path), VECTORS_FILE)
+
+
+def append_vectors(path: str, vectors: np.ndarray) -> None:
+    """Append float32 rows to a KB's raw vector file (kept for rebuilds and recall checks)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    segmented_file.append(path, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+
+def open_vectors(path: str, dim: int) -> np.ndarray:
+    """Memory-map a KB's raw vectors as an (n, dim) float32 array."""
+    return segmented_file.open_array(path, np.float32, (dim,))
+
+
+def backfill_vectors(index: faiss.Index, path: str) -> bool:
+    """
+    Write the raw vector file for a KB built before it existed. Only exact (flat, unquantized)
+    indices hold the original vectors; returns False when they cannot be recovered.
+    """
+    if os.path.exists(path):
+        return True
+    if not is_exact(index):
+        return False
+    if index.ntotal:
+        vectors = unwrap(index).reconstruct_n(0, index.ntotal)
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            # Chunk IDs are dense 0..ntotal-1; put each vector at its ID's row.
+            ordered = np.empty_like(vectors)
+            ordered[faiss.vector_to_array(index.id_map)] = vectors
+            vectors = ordered
+        append_vectors(path, vectors)
+    else:
+        segmented_file.write(path, b"")
+    return True
@@ -0,0 +1,171 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    citations: List[dict]
+    top_k: int
+    response_time: float
+    search_params: Tuple = ()  # (nprobe, ef_search) the answer was retrieved with
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class _KBAnswers:
+    """One KB's cached answers, with their unit-length query vectors stacked for a single matmul."""
+
+    def __init__(self, signature: Tuple):
+        self.signature = signature
+        self.entries: List[CachedAnswer] = []
+        self.vectors: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors)
+        return self._matrix
+
+    def add(self, vector: np.ndarray, entry: CachedAnswer) -> None:
+        self.entries.append(entry)
+        self.vectors.append(vector)
+        self._matrix = None
+
+    def remove(self, positions: List[int]) -> None:
+        drop = set(positions)
+        self.entries = [e for i, e in enumerate(self.entries) if i not in drop]
+        self.vectors = [v for i, v in enumerate(self.vectors) if i not in drop]
+        self._matrix = None
+
+
+class AnswerCache:
+    """
+    Per-KB cache of generated answers keyed on query embeddings.
+
+    A lookup compares the query's embedding with every cached query of the same
+    KB, top_k and search parameters (nprobe/ef_search) by cosine similarity and returns the best answer at or above
+    ``threshold``. Each KB's entries are tied to the KB's file signature (see
+    KBCache), so any upload or rebuild drops them on the next lookup. Entries
+    expire after ``ttl_s``; beyond ``max_entries_per_kb`` or ``max_entries`` in
+    total, the least recently used are evicted.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl_s: float = 86400, max_entries_per_kb: int = 1000, max_entries: int = 10000):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries_per_kb = max_entries_per_kb
+        self.max_entries = max_entries
+        self._kbs: Dict[str, _KBAnswers] = {}
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _bucket(self, kb_id: str, signature: Tuple) -> Optional[_KBAnswers]:
+        bucket = self._kbs.get(kb_id)
+        if bucket is not None and bucket.signature != signature:
+            self._drop_kb(kb_id)
+            self.invalidations += 1
+            return None
+        return bucket
+
+    def _drop_kb(self, kb_id: str) -> None:
+        bucket = self._kbs.pop(kb_id, None)
+        if bucket is not None:
+            self._size -= len(bucket.entries)
+
+    def _expire(self, bucket: _KBAnswers, now: float) -> None:
+        expired = [i for i, e in enumerate(bucket.entries) if now - e.created_at > self.ttl_s]
+        if expired:
+            bucket.remove(expired)
+            self._size -= len(expired)
+            self.expirations += len(expired)
+
+    def lookup(self, kb_id: str, signature: Tuple, query_vector: np.ndarray, top_k: int, search_params: Tuple = ()) -> Optional[Tuple[CachedAnswer, float]]:
+        """Return (entry, similarity) for the closest cached answer above the threshold, if any."""
+        now = time.time()
+        with self._lock:
+            bucket = self._bucket(kb_id, signature)
+            if bucket is not None:
+                self._expire(bucket, now)
+            if bucket is None or not bucket.entries:
+                self.misses += 1
+                return None
+            sims = bucket.matrix() @ self._unit(query_vector)
+            sims[np.array([e.top_k != top_k or e.search_params != search_params for e in bucket.entries])] = -1.0
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            entry = bucket.entries[best]
+            entry.hits += 1
+            entry.last_used = now
+            self.hits += 1
+            self.seconds_saved += entry.response_time
+            return entry, similarity
+
+    def store(self, kb_id: str, signature: Tuple, query_vector: np.ndarray, entry: CachedAnswer) -> None:
+        with self._lock:
+            bucket = self._bucket(kb_id, signature)
+            if bucket is None:
+                bucket = self._kbs[kb_id] = _KBAnswers(signature)
+            bucket.add(self._unit(query_vector), entry)
+            self._size += 1
+            if len(bucket.entries) > self.max_entries_per_kb:
+                self._evict_lru([kb_id], len(bucket.entries) - self.max_entries_per_kb)
+            if self._size > self.max_entries:
+                self._evict_lru(list(self._kbs), self._size - self.max_entries)
+
+    def _evict_lru(self, kb_ids: List[str], count: int) -> None:
+        candidates = sorted(
+            ((e.last_used, kb_id, i) for kb_id in kb_ids for i, e in enumerate(self._kbs[kb_id].entries)),
+        )[:count]
+        by_kb: Dict[str, List[int]] = {}
+        for _, kb_id, i in candidates:
+            by_kb.setdefault(kb_id, []).append(i)
+        for kb_id, positions in by_kb.items():
+            self._kbs[kb_id].remove(positions)
+            self._size -= len(positions)
+            self.evictions += len(positions)
+
+    def invalidate(self, kb_id: str) -> None:
+        """Forget every cached answer of a KB, e.g. after it was modified or deleted."""
+        with self._lock:
+            if kb_id in self._kbs:
+                self._drop_kb(kb_id)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._size,
+                "kbs": {kb_id: len(b.entries) for kb_id, b in self._kbs.items()},
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "llm_seconds_saved": round(self.seconds_saved, 2),
+            }
@@ -1,38 +1,117 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
+import asyncio
+import json
 import os
 import shutil
 import time
 from contextlib import asynccontextmanager
 from starlette.middleware.base import BaseHTTPMiddleware
+import httpx
 import uvicorn
+import numpy as np
 
 from faiss_retriever import (
-    list_all_indices,
-    load_index_and_chunks,
     load_metadata,
-    search_faiss,
-    generate_answer,
+    hybrid_search,
+    hybrid_search_batch,
+    federated_search,
+    embed_query,
+    agenerate_answer,
+    astream_answer,
+    close_async_client,
 )
 import md_rag
-
+from config import ANSWER_CACHE_SETTINGS, KB_CACHE_SETTINGS, KB_CATALOG_SETTINGS, INGEST_JOB_SETTINGS, METRICS_SETTINGS, RETRIEVAL_SETTINGS
+from kb_cache import CachedKB, KBCache
+from kb_catalog import KBCatalog
+from query_batcher import get_query_batcher
+from answer_cache import AnswerCache, CachedAnswer
+from context_assembly import assemble_context
+from ingest_jobs import IngestJobManager
+from embedding_cache import get_embedding_cache
+from conversion_cache import copy_hashing, get_conversion_cache
+import dedup
+from snapshots import METADATA_FILE, current_generation, current_path, write_generation
+from embedding_providers import EmbeddingMismatchError, check_compatible, get_provider
+from metrics import COLD_START_SECONDS, HTTP_REQUEST_SECONDS, process_age, render as render_metrics, rounded, start_timings
+
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
 DATA_DIR = "data"
 UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+SPOOL_DIR = os.path.join(DATA_DIR, "spool")
 INDICES_DIR = "indices"
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 os.makedirs(INDICES_DIR, exist_ok=True)
 
+BATCH_EMBED_SIZE = int(RETRIEVAL_SETTINGS.get("batch_embed_size", 256))
+BATCH_MAX_QUERIES = int(RETRIEVAL_SETTINGS.get("batch_max_queries", 10000))
+BATCH_GENERATE_CONCURRENCY = int(RETRIEVAL_SETTINGS.get("batch_generate_concurrency", 4))
+FEDERATED_MAX_KBS = int(RETRIEVAL_SETTINGS.get("federated_max_kbs", 32))
+FEDERATED_WORKERS = int(RETRIEVAL_SETTINGS.get("federated_workers", 8))
+CITATION_MAX_ALIASES = 10
+
+kb_catalog = KBCatalog(KB_CATALOG_SETTINGS.get("path", "data/kb_catalog.sqlite"), INDICES_DIR)
+kb_cache = KBCache(INDICES_DIR, max_bytes=int(KB_CACHE_SETTINGS.get("max_memory_mb", 1024)) * 1024 * 1024)
+answer_cache = AnswerCache(
+    threshold=float(ANSWER_CACHE_SETTINGS.get("similarity_threshold", 0.95)),
+    ttl_s=float(ANSWER_CACHE_SETTINGS.get("ttl_s", 86400)),
+    max_entries_per_kb=int(ANSWER_CACHE_SETTINGS.get("max_entries_per_kb", 1000)),
+    max_entries=int(ANSWER_CACHE_SETTINGS.get("max_entries", 10000)),
+) if ANSWER_CACHE_SETTINGS.get("enabled", True) else None
+ingest_jobs = IngestJobManager(
+    convert_workers=int(INGEST_JOB_SETTINGS.get("convert_workers", 2)),
+    pipeline_workers=int(INGEST_JOB_SETTINGS.get("pipeline_workers", 4)),
+    max_finished_jobs=int(INGEST_JOB_SETTINGS.get("max_finished_jobs", 500)),
+    spool_dir=SPOOL_DIR,
+    prewarm_converters=bool(INGEST_JOB_SETTINGS.get("prewarm_converters", False)),
+)
+_cold_start: Dict[str, Any] = {"pid": os.getpid()}
+
+
+def _prewarm_converters() -> None:
+    try:
+        warmups = ingest_jobs.prewarm()
+    except Exception as e:
+        print(f"Converter prewarm failed (conversions will load docling on first use): {e}")
+        return
+    slowest = max(w["warmup_s"] for w in warmups)
+    _cold_start["converter_warmup_s"] = slowest
+    COLD_START_SECONDS.set(slowest, phase="converter_warmup")
+    print(f"Prewarmed docling converters: {warmups}")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting up...")
+    started = time.perf_counter()
+    # Everything this worker process did before start-up: interpreter, imports, app construction
+    imported = process_age()
+    prewarm = KB_CACHE_SETTINGS.get("prewarm") or []
+    if prewarm:
+        loaded = kb_cache.prewarm(prewarm)
+        print(f"Prewarmed KB cache: {loaded}")
+    if ingest_jobs.prewarm_converters:
+        # Off the start-up path: the worker serves requests while the convert workers load docling.
+        app.state.converter_prewarm = asyncio.get_running_loop().run_in_executor(None, _prewarm_converters)
+    startup = time.perf_counter() - started
+    _cold_start["startup_s"] = round(startup, 3)
+    COLD_START_SECONDS.set(startup, phase="startup")
+    if imported is None:
+        print(f"Worker {_cold_start['pid']} started up in {_cold_start['startup_s']}s")
+    else:
+        _cold_start.update({"import_s": round(imported, 3), "ready_s": round(imported + startup, 3)})
+        COLD_START_SECONDS.set(imported, phase="import")
+        print(f"Worker {_cold_start['pid']} ready in {_cold_start['ready_s']}s (imports {_cold_start['import_s']}s, start-up {_cold_start['startup_s']}s)")
     yield
     print("Shutting down...")
+    ingest_jobs.shutdown()
+    await close_async_client()
 
 app = FastAPI(title="Knowledge Assistant API", lifespan=lifespan)
 
@@ -60,6 +139,24 @@ class PreflightCorsMiddleware(BaseHTTPMiddleware):
         return response
 # --- END: Middleware to handle CORS preflight + Private Network Access ---
 
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Observe request latency (until the response starts) per route template, method and status."""
+
+    async def dispatch(self, request: Request, call_next):
+        started = time.perf_counter()
+        status = "500"
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=request.method, route=getattr(route, "path", "unmatched"), status=status,
+            )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -69,6 +166,9 @@ app.add_middleware(
 )
 print("CORS configured to allow all origins (wildcard '*') and all methods/headers")
 
+if METRICS_SETTINGS.get("enabled", True):
+    app.add_middleware(MetricsMiddleware)
+
 # Add preflight/Private Network middleware last so it's the outermost and can handle OPTIONS before CORS
 app.add_middleware(PreflightCorsMiddleware)
 
@@ -80,6 +180,36 @@ class CreateKBRequest(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     top_k: Optional[int] = 3
+    stream: Optional[bool] = False
+    nprobe: Optional[int] = None      # IVF lists to probe (IVF indices only)
+    ef_search: Optional[int] = None   # HNSW search breadth (HNSW indices only)
+    timings: Optional[bool] = False   # add a per-stage latency breakdown (ms) to the response
+    files: Optional[List[str]] = None  # only search chunks from these uploaded files
+    pages: Optional[List[int]] = None  # only search chunks overlapping [first, last] (1-based, inclusive)
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = 3
+    generate: Optional[bool] = False
+    concurrency: Optional[int] = None  # concurrent answer generations when generate is set
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    timings: Optional[bool] = False
+    files: Optional[List[str]] = None
+    pages: Optional[List[int]] = None
+
+
+class FederatedChatRequest(BaseModel):
+    kb_ids: List[str]
+    message: str
+    top_k: Optional[int] = 3
+    stream: Optional[bool] = False
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    timings: Optional[bool] = False
+    files: Optional[List[str]] = None
+    pages: Optional[List[int]] = None
 
 
 class DeleteKBResponse(BaseModel):
@@ -87,10 +217,21 @@ class DeleteKBResponse(BaseModel):
 
 
 @app.get("/api/kbs")
-def get_kbs():
-    """List all knowledge bases and basic metadata."""
-    indices = list_all_indices(INDICES_DIR)
-    return {"kbs": indices}
+def get_kbs(offset: int = 0, limit: Optional[int] = None, sort: str = "name", order: str = "asc"):
+    """List knowledge bases and basic metadata from the KB catalog, a page at a time (all of them without a limit)."""
+    if offset < 0 or (limit is not None and limit < 1) or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="offset must be >= 0, limit >= 1 and order 'asc' or 'desc'")
+    try:
+        kbs, total = kb_catalog.list(offset=offset, limit=limit, sort=sort, descending=order == "desc")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"kbs": kbs, "total": total, "offset": offset, "limit": limit}
+
+
+@app.post("/api/catalog/rebuild")
+def rebuild_catalog():
+    """Rescan indices/ into the KB catalog (after KB directories were changed by hand)."""
+    return {"rebuilt": kb_catalog.rebuild()}
 
 
 @app.get("/api/kbs/{kb_id}")
@@ -99,9 +240,8 @@ def get_kb(kb_id: str):
     path = os.path.join(INDICES_DIR, kb_id)
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="KB not found")
-    metadata_path = os.path.join(path, "metadata.json")
-    metadata = load_metadata(metadata_path)
-    return {"kb": {"name": kb_id, **metadata}}
+    metadata = load_metadata(current_path(path, METADATA_FILE))
+    return {"kb": {"name": kb_id, **metadata, "generation": current_generation(path)}}
 
 
 @app.post("/api/kbs", status_code=201)
@@ -110,106 +250,393 @@ def create_kb(req: CreateKBRequest):
     name = req.name.strip()
     if not name:
         raise HTTPException(status_code=400, detail="Name cannot be empty")
-    existing = [k["name"] for k in list_all_indices(INDICES_DIR)]
-    if name in existing:
-        raise HTTPException(status_code=400, detail="KB already exists")
     kb_path = os.path.join(INDICES_DIR, name)
-    os.makedirs(kb_path, exist_ok=True)
-    metadata_path = os.path.join(kb_path, "metadata.json")
+    # Creating the directory claims the name, also against other workers.
+    if kb_catalog.exists(name) or not _claim_dir(kb_path):
+        raise HTTPException(status_code=400, detail="KB already exists")
     metadata = {"ntotal": 0, "chunk_count": 0, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": []}
-    md_rag.persist_metadata(metadata_path, metadata)
+    with write_generation(kb_path) as staging:
+        md_rag.persist_metadata(os.path.join(staging, METADATA_FILE), metadata)
+    kb_catalog.refresh(name)
     return {"message": f"KB '{name}' created", "kb": {"name": name, **metadata}}
 
 
-@app.post("/api/kbs/{kb_id}/upload")
-def upload_file(kb_id: str, file: UploadFile = File(...)):
-    """Upload a PDF to a KB and ingest it into a FAISS index."""
+def _claim_dir(path: str) -> bool:
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        return False
+    return True
+
+
+def _upload_filename(file: UploadFile) -> str:
     filename = file.filename or f"upload_{int(time.time())}.pdf"
     if not filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    return filename
+
+
+def _kb_changed(kb_id: str) -> None:
+    kb_catalog.refresh(kb_id)
+    kb_cache.invalidate(kb_id)
+    if answer_cache is not None:
+        answer_cache.invalidate(kb_id)
+
+
+def _enqueue_upload(kb_id: str, kb_path: str, file: UploadFile, filename: str) -> dict:
+    metadata = load_metadata(current_path(kb_path, METADATA_FILE))
+    if metadata.get("chunk_count"):
+        _check_embeddings(metadata)
+    # One directory per job, so uploads of the same file name never overwrite each other.
+    job_id = ingest_jobs.new_job_id()
+    job_dir = os.path.join(UPLOADS_DIR, job_id)
+    os.makedirs(job_dir)
+    dest_path = os.path.join(job_dir, filename)
+    content_hash = copy_hashing(file.file, dest_path)
+    job = ingest_jobs.submit(kb_id, kb_path, dest_path, filename, on_complete=_kb_changed, content_hash=content_hash, job_id=job_id)
+    return job.to_dict()
+
+
+@app.post("/api/kbs/{kb_id}/upload", status_code=202)
+def upload_file(kb_id: str, file: UploadFile = File(...)):
+    """Upload a PDF to a KB and queue it for ingestion; poll /api/jobs/{id} for progress."""
+    filename = _upload_filename(file)
     kb_path = os.path.join(INDICES_DIR, kb_id)
     if not os.path.exists(kb_path):
         raise HTTPException(status_code=404, detail="KB not found")
 
-    dest_path = os.path.join(UPLOADS_DIR, filename)
-    with open(dest_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    job = _enqueue_upload(kb_id, kb_path, file, filename)
+    metadata = load_metadata(current_path(kb_path, METADATA_FILE))
+    return {"message": f"File '{file.filename}' queued for ingestion into KB '{kb_id}'", "job_id": job["id"], "job": job, "kb": {"name": kb_id, **metadata}}
 
-    # Ingest the file
-    try:
-        index, chunks, _ = md_rag.ingest_pdf_to_faiss(dest_path)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
 
-    index_file = os.path.join(kb_path, "index.faiss")
-    chunks_file = os.path.join(kb_path, "chunks.json")
-    metadata_file = os.path.join(kb_path, "metadata.json")
-    # Load existing metadata and append file
-    metadata = load_metadata(metadata_file)
-    files = metadata.get("files", [])
-    files.append(filename)
+@app.post("/api/kbs/{kb_id}/uploads", status_code=202)
+def upload_files(kb_id: str, files: List[UploadFile] = File(...)):
+    """Upload several PDFs at once; each becomes its own job and they ingest in parallel."""
+    filenames = [_upload_filename(f) for f in files]
+    kb_path = os.path.join(INDICES_DIR, kb_id)
+    if not os.path.exists(kb_path):
+        raise HTTPException(status_code=404, detail="KB not found")
 
-    # update chunk to file mapping if needed (optional)
-    old_chunk_count = metadata.get("chunk_count", 0)
-    for i, _ in enumerate(chunks):
-        # store mapping in metadata if desired
-        pass
+    jobs = [_enqueue_upload(kb_id, kb_path, f, name) for f, name in zip(files, filenames)]
+    return {"message": f"{len(jobs)} file(s) queued for ingestion into KB '{kb_id}'", "jobs": jobs}
 
-    # Persist index and chunks
-    md_rag.persist_index_and_chunks(index, chunks, index_path=index_file, chunks_path=chunks_file, metadata_path=metadata_file, files=files)
 
-    # Reload metadata to return updated state
-    new_meta = load_metadata(metadata_file)
-    return {"message": f"File '{file.filename}' ingested into KB '{kb_id}'", "kb": {"name": kb_id, **new_meta}}
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Report an ingestion job's status with per-stage progress and timings."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job": job.to_dict()}
 
 
-@app.post("/api/kbs/{kb_id}/chat")
-def kb_chat(kb_id: str, payload: ChatRequest):
-    """Query a KB and return an answer with citations."""
+@app.get("/api/kbs/{kb_id}/jobs")
+def list_kb_jobs(kb_id: str):
+    """List known ingestion jobs for a KB."""
+    return {"jobs": [j.to_dict() for j in ingest_jobs.list(kb_id)]}
+
+
+def _load_kb(kb_id: str) -> CachedKB:
     kb_path = os.path.join(INDICES_DIR, kb_id)
     if not os.path.exists(kb_path):
         raise HTTPException(status_code=404, detail="KB not found")
-    index_file = os.path.join(kb_path, "index.faiss")
-    chunks_file = os.path.join(kb_path, "chunks.json")
-    if not os.path.exists(index_file) or not os.path.exists(chunks_file):
+    try:
+        kb = kb_cache.get(kb_id)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="KB index is empty")
+    _check_embeddings(kb.metadata, kb.index.d)
+    return kb
 
-    index, chunks = load_index_and_chunks(index_file, chunks_file)
-    top_k = int(payload.top_k or 3)
-    D, I = search_faiss(index, payload.message, top_k)
-    retrieved = []
+
+def _check_embeddings(metadata: Dict[str, Any], dim: Optional[int] = None) -> None:
+    """Reject (409) KBs whose vectors the configured embedding provider cannot be compared with."""
+    try:
+        check_compatible(metadata, dim)
+    except EmbeddingMismatchError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+def _page_range(pages: Optional[List[int]]) -> Optional[Tuple[int, int]]:
+    if pages is None:
+        return None
+    if len(pages) != 2 or pages[0] > pages[1]:
+        raise HTTPException(status_code=400, detail="pages must be [first, last] with first <= last")
+    return pages[0], pages[1]
+
+
+def _allowed(kb: CachedKB, files: Optional[List[str]], pages: Optional[List[int]]) -> Optional[np.ndarray]:
+    """Mask of the KB's chunks matching a request's file/page filters, or None when it has none."""
+    if files is None and pages is None:
+        return None
+    return kb.provenance.mask(files=files, pages=_page_range(pages))
+
+
+def _retrieve(kb_id: str, message: str, top_k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, query_vector: Optional[np.ndarray] = None, files: Optional[List[str]] = None, pages: Optional[List[int]] = None) -> Tuple[List[str], List[dict], Dict[str, Any]]:
+    """
+    Search a KB, restricted to the chunks matching ``files`` / ``pages`` if given,
+    and pack the hits into the prompt's token budget.
+    Returns the chunks to send to the LLM, their citations and the packing stats.
+    """
+    kb = _load_kb(kb_id)
+    allowed = _allowed(kb, files, pages)
+    if query_vector is None:
+        query_vector = embed_query(message)
+    D, I = hybrid_search(kb.index, kb.lexical, message, top_k, nprobe=nprobe, ef_search=ef_search, query_vector=query_vector, allowed=allowed)
+    # Cast numpy scalars (e.g., numpy.int64) to native Python ints
+    ids = [int(i) for i in I[0] if 0 <= i < len(kb.chunks)] if I.size else []
+    context = assemble_context([kb.chunks[i] for i in ids], _stored_vectors(kb, ids), query_vector)
+    citations = [_citation(kb_id, kb, ids[pos]) for pos in context.kept]
+    return context.texts, citations, context.stats()
+
+
+def _stored_vectors(kb: CachedKB, ids: List[int]) -> Optional[np.ndarray]:
+    return kb.vectors[ids] if kb.vectors is not None and ids else None
+
+
+def _citation(kb_id: str, kb: CachedKB, idx: int) -> dict:
+    chunk = kb.chunks[idx]
+    source = kb.provenance.row(idx)
+    return {
+        **source,
+        "file": source["file"] or kb_id,
+        # Where the same text also occurred (near-duplicates dropped at ingest)
+        "also_in": kb.provenance.duplicates(idx, limit=CITATION_MAX_ALIASES),
+        "chunk": idx,
+        "preview": chunk[:80].replace("\n", " "),
+        "content": chunk.replace("\n", " "),
+    }
+
+
+def _federated_retrieve(kb_ids: List[str], message: str, top_k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, files: Optional[List[str]] = None, pages: Optional[List[int]] = None) -> Tuple[List[str], List[dict], Dict[str, Any], List[dict]]:
+    """
+    Search several KBs with one query embedding and pack the global top-k into the context budget.
+    File/page filters apply in every KB (a file name matches in whichever KBs hold it).
+    KBs that cannot be loaded (missing, empty, other embeddings) are skipped and returned with the reason;
+    only when none can be loaded does the request fail.
+    """
+    kbs: Dict[str, CachedKB] = {}
+    skipped: List[dict] = []
+    for kb_id in kb_ids:
+        try:
+            kbs[kb_id] = _load_kb(kb_id)
+        except HTTPException as e:
+            skipped.append({"kb": kb_id, "status": e.status_code, "detail": e.detail})
+    if not kbs:
+        statuses = {s["status"] for s in skipped}
+        raise HTTPException(
+            status_code=statuses.pop() if len(statuses) == 1 else 404,
+            detail="None of the requested KBs could be loaded: " + ", ".join(f"{s['kb']} ({s['detail']})" for s in skipped),
+        )
+    allowed = {kb_id: _allowed(kb, files, pages) for kb_id, kb in kbs.items()} if files is not None or pages is not None else None
+    query_vector = embed_query(message)
+    hits = federated_search(
+        [(kb_id, kb.index, kb.lexical) for kb_id, kb in kbs.items()],
+        message, top_k, nprobe=nprobe, ef_search=ef_search, max_workers=FEDERATED_WORKERS, query_vector=query_vector,
+        allowed=cast(Optional[Dict[str, np.ndarray]], allowed),
+    )
+    hits = [(kb_id, idx, score) for kb_id, idx, score in hits if idx < len(kbs[kb_id].chunks)]
+    candidates = []
     citations = []
-    chunk_indices = []
-    if I.size and len(I[0]):
-        for idx in I[0]:
-            # Cast numpy scalar (e.g., numpy.int64) to native Python int
-            idx_int = int(idx)
-            if idx_int < 0 or idx_int >= len(chunks):
-                continue
-            retrieved.append(chunks[idx_int])
-            chunk_indices.append(idx_int)
-            preview = chunks[idx_int][:80].replace("\n", " ")
-            content = chunks[idx_int].replace("\n", " ")
-            # try to get mapping from metadata if present
-            metadata = load_metadata(os.path.join(kb_path, "metadata.json"))
-            files = metadata.get("files", [])
-            file_name = files[0] if files else kb_id
-            citations.append({"file": file_name, "chunk": idx_int, "preview": preview, "content": content})
+    for kb_id, idx, score in hits:
+        kb = kbs[kb_id]
+        citation = {"kb": kb_id, **_citation(kb_id, kb, idx), "score": round(score, 4)}
+        # Label each context with its source so the answer can say which KB it came from.
+        candidates.append(f"[Source: {kb_id} / {citation['file']}]\n{kb.chunks[idx]}")
+        citations.append(citation)
+    # All KBs share the embedding model, so their stored vectors compare directly.
+    vectors = None
+    if hits and all(kbs[kb_id].vectors is not None for kb_id, _, _ in hits):
+        vectors = np.vstack([cast(np.ndarray, kbs[kb_id].vectors)[idx] for kb_id, idx, _ in hits])
+    context = assemble_context(candidates, vectors, query_vector)
+    return context.texts, [citations[pos] for pos in context.kept], context.stats(), skipped
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/kbs/{kb_id}/chat")
+async def kb_chat(kb_id: str, payload: ChatRequest):
+    """
+    Query a KB and return an answer with citations.
+    With ``stream`` set, the answer is sent as server-sent events: one ``citations``
+    event, then ``token`` events as the LLM produces them, then ``done``.
+    Answers to queries close enough to an earlier one on the same KB are served
+    from the answer cache and flagged with ``cache_hit``. With ``timings`` set, the
+    response (or ``done`` event) carries the time spent per pipeline stage. ``files``
+    and ``pages`` restrict retrieval to matching chunks (such answers are not cached).
+    """
+    top_k = int(payload.top_k or 3)
+    timings = start_timings() if payload.timings else None
+    if answer_cache is None or payload.files is not None or payload.pages is not None:
+        retrieved, citations, context = await run_in_threadpool(
+            _retrieve, kb_id, payload.message, top_k, payload.nprobe, payload.ef_search, None, payload.files, payload.pages,
+        )
+        return await _answer_response(payload.message, retrieved, citations, bool(payload.stream), extra={"context": context}, timings=timings)
+
+    kb = await run_in_threadpool(_load_kb, kb_id)
+    query_vector = await run_in_threadpool(embed_query, payload.message)
+    # A higher-recall search must not be served an answer retrieved with lower recall.
+    search_params = (payload.nprobe, payload.ef_search)
+    cached = answer_cache.lookup(kb_id, kb.signature, query_vector, top_k, search_params)
+    if cached is not None:
+        entry, similarity = cached
+        return _cached_response(entry, similarity, bool(payload.stream), timings)
+
+    retrieved, citations, context = await run_in_threadpool(
+        _retrieve, kb_id, payload.message, top_k, payload.nprobe, payload.ef_search, query_vector,
+    )
+
+    def remember(answer: str, response_time: float) -> None:
+        answer_cache.store(kb_id, kb.signature, query_vector, CachedAnswer(
+            query=payload.message, answer=answer, citations=citations, top_k=top_k, response_time=response_time,
+            search_params=search_params,
+        ))
+
+    return await _answer_response(
+        payload.message, retrieved, citations, bool(payload.stream),
+        on_answer=remember if retrieved else None, extra={"context": context}, timings=timings,
+    )
+
+
+def _cached_response(entry: CachedAnswer, similarity: float, stream: bool, timings: Optional[Dict[str, float]] = None):
+    cache_info = {"cache_hit": True, "cache_similarity": round(similarity, 4), "cached_query": entry.query}
+    if timings is not None:
+        cache_info["timings_ms"] = rounded(timings)
+    if stream:
+        async def event_stream():
+            yield _sse("citations", entry.citations)
+            yield _sse("token", entry.answer)
+            yield _sse("done", {"response_time": 0.0, **cache_info})
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    return {"answer": entry.answer, "citations": entry.citations, "response_time": 0.0, **cache_info}
+
+
+@app.post("/api/federated/chat")
+async def federated_chat(payload: FederatedChatRequest):
+    """
+    Query several KBs at once and return one answer whose citations name their source KB.
+    The query is embedded once, each KB is searched in parallel, and results are merged
+    into a global top-k after normalizing scores per KB. Supports ``stream`` like KB chat.
+    KBs that cannot be searched are left out and listed in ``skipped_kbs``.
+    """
+    kb_ids = list(dict.fromkeys(payload.kb_ids))
+    if not kb_ids:
+        raise HTTPException(status_code=400, detail="kb_ids must name at least one KB")
+    if len(kb_ids) > FEDERATED_MAX_KBS:
+        raise HTTPException(status_code=400, detail=f"At most {FEDERATED_MAX_KBS} KBs per request")
+    top_k = int(payload.top_k or 3)
+    timings = start_timings() if payload.timings else None
+    retrieved, citations, context, skipped = await run_in_threadpool(
+        _federated_retrieve, kb_ids, payload.message, top_k, payload.nprobe, payload.ef_search, payload.files, payload.pages,
+    )
+    return await _answer_response(payload.message, retrieved, citations, bool(payload.stream), extra={"context": context, "skipped_kbs": skipped}, timings=timings)
+
+
+async def _answer_response(message: str, retrieved: List[str], citations: List[dict], stream: bool, on_answer: Optional[Callable[[str, float], None]] = None, extra: Optional[Dict[str, Any]] = None, timings: Optional[Dict[str, float]] = None):
+    """
+    Generate the answer (streamed or not); ``on_answer`` receives each completed LLM answer
+    and its latency, and ``extra`` is added to the response (or the stream's ``done`` event),
+    as is the request's stage breakdown when ``timings`` is collected.
+    """
+    extra = extra or {}
+
+    def finished() -> Dict[str, Any]:
+        return {**extra, "timings_ms": rounded(timings)} if timings is not None else extra
+    if stream:
+        async def event_stream():
+            yield _sse("citations", citations)
+            start = time.time()
+            if retrieved:
+                tokens = []
+                try:
+                    async for token in astream_answer(message, retrieved):
+                        tokens.append(token)
+                        yield _sse("token", token)
+                except httpx.HTTPError as e:
+                    yield _sse("error", {"detail": str(e)})
+                    return
+                if on_answer is not None:
+                    on_answer("".join(tokens), time.time() - start)
+            else:
+                yield _sse("token", "No relevant information found in the index.")
+            yield _sse("done", {"response_time": round(time.time() - start, 2), "cache_hit": False, **finished()})
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
     if retrieved:
         start = time.time()
-        answer = generate_answer(payload.message, retrieved)
+        answer = await agenerate_answer(message, retrieved)
         response_time = round(time.time() - start, 2)
+        if on_answer is not None:
+            on_answer(answer, response_time)
     else:
         answer = "No relevant information found in the index."
         response_time = 0.0
 
-    return {"answer": answer, "citations": citations, "response_time": response_time}
+    return {"answer": answer, "citations": citations, "response_time": response_time, "cache_hit": False, **finished()}
+
+
+@app.post("/api/kbs/{kb_id}/search/batch")
+async def kb_search_batch(kb_id: str, payload: BatchSearchRequest):
+    """
+    Retrieval-only search for many queries at once (evaluation and bulk QA).
+    Queries are embedded in large batches and searched with one matrix FAISS search per batch;
+    answers are generated only when requested, with bounded concurrency.
+    """
+    if len(payload.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per request")
+    timings = start_timings() if payload.timings else None
+    kb = await run_in_threadpool(_load_kb, kb_id)
+    allowed = _allowed(kb, payload.files, payload.pages)
+    top_k = int(payload.top_k or 3)
+    start = time.time()
+    scores, ids, score_type = await run_in_threadpool(
+        hybrid_search_batch, kb.index, kb.lexical, payload.queries, top_k,
+        payload.nprobe, payload.ef_search, BATCH_EMBED_SIZE, allowed,
+    )
+    search_time = round(time.time() - start, 3)
+
+    chunks = kb.chunks
+    results = []
+    for query, row_scores, row_ids in zip(payload.queries, scores, ids):
+        valid = [(float(sc), int(i)) for sc, i in zip(row_scores, row_ids) if 0 <= i < len(chunks)]
+        results.append({
+            "query": query,
+            "ids": [i for _, i in valid],
+            "scores": [sc for sc, _ in valid],
+            "files": [kb.provenance.file_name(i) for _, i in valid],
+            "previews": [chunks[i][:80].replace("\n", " ") for _, i in valid],
+        })
+
+    if payload.generate:
+        semaphore = asyncio.Semaphore(max(1, int(payload.concurrency or BATCH_GENERATE_CONCURRENCY)))
+
+        async def answer(result: dict) -> None:
+            retrieved = [chunks[i] for i in result["ids"]]
+            if not retrieved:
+                result["answer"] = "No relevant information found in the index."
+                return
+            async with semaphore:
+                try:
+                    result["answer"] = await agenerate_answer(result["query"], retrieved)
+                except httpx.HTTPError as e:
+                    result["answer"] = None
+                    result["error"] = str(e)
+
+        await asyncio.gather(*(answer(r) for r in results))
+
+    response = {"results": results, "score_type": score_type, "search_time": search_time, "response_time": round(time.time() - start, 3)}
+    if timings is not None:
+        response["timings_ms"] = rounded(timings)
+    return response
 
 
 @app.delete("/api/kbs/{kb_id}", response_model=DeleteKBResponse)
 def delete_kb(kb_id: str):
-    """Delete an existing KB (its directory and all stored index files)."""
+    """Delete an existing KB (its directory, with every generation of its index files)."""
     kb_path = os.path.join(INDICES_DIR, kb_id)
     if not os.path.exists(kb_path):
         raise HTTPException(status_code=404, detail="KB not found")
@@ -219,9 +646,50 @@ def delete_kb(kb_id: str):
         shutil.rmtree(kb_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete KB: {e}")
+    _kb_changed(kb_id)
 
     return DeleteKBResponse(message=f"KB '{kb_id}' deleted")
 
 
+@app.get("/api/embeddings/stats")
+def embedding_stats():
+    """Report the embedding provider, its ingestion throughput (texts/s; tokens/s and retries on Azure) and query batching."""
+    provider = get_provider()
+    batcher = get_query_batcher()
+    return {
+        "provider": provider.identity(),
+        "embedding_executor": provider.stats(),
+        "query_batching": batcher.stats() if batcher is not None else None,
+    }
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Stage latency histograms, API request latency and upstream request/retry/failure counters (Prometheus text format)."""
+    if not METRICS_SETTINGS.get("enabled", True):
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/worker/stats")
+def worker_stats():
+    """Report this worker's cold start (import and start-up seconds) and its docling convert workers."""
+    return {"cold_start": _cold_start, "converters": ingest_jobs.converter_stats()}
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    """Report KB, embedding, answer, conversion and dedup LSH cache occupancy and hit/miss/eviction counters."""
+    embedding_cache = get_embedding_cache()
+    conversion_cache = get_conversion_cache()
+    return {
+        "kb_cache": kb_cache.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "conversion_cache": conversion_cache.stats() if conversion_cache is not None else None,
+        "dedup_lsh_cache": dedup.get_lsh_cache().stats() if dedup.ENABLED else None,
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,512 @@
+"""
+Offline end-to-end benchmarks.
+
+Starts the local stub model server (bench/stub_server.py), points the backend at
+it through a generated config (RAG_CONFIG) in a scratch directory, and measures:
+
+  ingest   ingest_pdf_to_faiss over the bundled PDFs in docs/, plus the
+           chunk / embed / index stages on the converted text
+  convert  docling conversion of each PDF in docs/: whole-file in one process, split
+           by page range across a pool of --convert-workers processes, and from the
+           conversion cache, with the speedups over the whole-file run
+  search   index build and search_faiss latency at several index sizes, with and
+           without the query-embedding round trip
+  storage  each vector_db.quantization (none, sq8, fp16) opened with faiss.read_index
+           and memory-mapped: file size, load time, resident memory (private heap vs
+           shared page cache), query latency and recall, each probe in a fresh process
+  api      the FastAPI app under concurrent load (chat, streamed chat, batch search),
+           run under uvicorn in a subprocess
+
+Latencies are reported as p50/p95/p99 (ms) with throughput, and written to JSON so
+runs can be compared between versions:
+
+    python bench/run.py --output bench-results.json
+    python bench/run.py --suites search --sizes 1000,10000,100000
+    python bench/run.py --suites storage --storage-sizes 200000 --storage-index-type hnsw
+    python bench/run.py --output new.json --compare bench-results.json
+
+Caches (embedding, answer and conversion caches) are off unless --with-caches is given, so
+repeated runs measure the uncached path.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stub_server  # noqa: E402
+
+
+def summarize(samples_s: List[float], wall_s: Optional[float] = None, errors: int = 0) -> Dict[str, Any]:
+    """Latency percentiles in milliseconds and throughput per second."""
+    if not samples_s:
+        return {"count": 0, "errors": errors}
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    wall_s = wall_s if wall_s is not None else float(np.sum(samples_s))
+    return {
+        "count": len(samples_s),
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(len(samples_s) / wall_s, 3) if wall_s > 0 else None,
+    }
+
+
+def timed(fn: Callable[[], Any]) -> tuple:
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_config(workdir: str, stub_url: str, with_caches: bool) -> str:
+    with open(os.path.join(BACKEND_DIR, "config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    openai = config["azure"]["openai"]
+    openai.update({"api_base": stub_url, "api_key": "bench", "api_version": "2024-06-01"})
+    openai["llm"].update({"deployment_name": "bench-chat", "model": "bench-chat"})
+    openai["embedding"].update({"deployment_name": "bench-embed", "model": "bench-embed", "api_version": "2024-06-01"})
+    config["embedding_cache"]["enabled"] = with_caches
+    config["answer_cache"]["enabled"] = with_caches
+    config["conversion_cache"]["enabled"] = with_caches
+    config["kb_cache"]["prewarm"] = []
+    path = os.path.join(workdir, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def _synthetic_chunks(n: int) -> List[str]:
+    rng = np.random.default_rng(0)
+    vocab = [f"term{i}" for i in range(5000)]
+    return [f"Section {i}. " + " ".join(rng.choice(vocab, size=120)) for i in range(n)]
+
+
+def bench_ingest(args: argparse.Namespace) -> Dict[str, Any]:
+    import md_rag
+
+    pdfs = sorted(glob.glob(os.path.join(args.docs, "*.pdf")))
+    if not pdfs:
+        return {"error": f"no PDFs under {args.docs}"}
+    files = {}
+    e2e: List[float] = []
+    for pdf in pdfs:
+        runs = []
+        chunks: List[str] = []
+        for _ in range(args.ingest_repeats):
+            (index, chunks, _), seconds = timed(lambda: md_rag.ingest_pdf_to_faiss(pdf))
+            runs.append(seconds)
+        e2e.extend(runs)
+        # Stages after conversion, on the converted text
+        markdown, convert_s = timed(lambda: md_rag.pdf_to_markdown_with_docling(pdf))
+        chunks, chunk_s = timed(lambda: md_rag.chunk_text(markdown))
+        embeddings, embed_s = timed(lambda: md_rag.get_embedding(chunks))
+        _, index_s = timed(lambda: md_rag.build_faiss_index(embeddings))
+        files[os.path.basename(pdf)] = {
+            "ingest_pdf_to_faiss": summarize(runs),
+            "chunks": len(chunks),
+            "stages_s": {k: round(v, 3) for k, v in (("convert", convert_s), ("chunk", chunk_s), ("embed", embed_s), ("index", index_s))},
+            "chunks_per_s": round(len(chunks) / max(sum(runs) / len(runs), 1e-9), 2),
+        }
+    return {"ingest_pdf_to_faiss": summarize(e2e), "files": files}
+
+
+def bench_convert(args: argparse.Namespace) -> Dict[str, Any]:
+    import md_rag
+    from conversion_cache import ConversionCache, sha256_file
+
+    pdfs = sorted(glob.glob(os.path.join(args.docs, "*.pdf")))
+    if not pdfs:
+        return {"error": f"no PDFs under {args.docs}"}
+    cache = ConversionCache(os.path.abspath("bench-converted"), max_bytes=1 << 40)
+    spawn = multiprocessing.get_context("spawn")
+    files = {}
+    with ProcessPoolExecutor(max_workers=args.convert_workers, mp_context=spawn) as pool:
+        # Load docling everywhere first so no run pays for model loading.
+        md_rag.prewarm_converters()
+        for f in [pool.submit(md_rag.prewarm_converters) for _ in range(args.convert_workers)]:
+            f.result()
+        for pdf in pdfs:
+            _, serial_s = timed(lambda: md_rag.convert_pdf(pdf, use_cache=False))
+            markdown, parallel_s = timed(lambda: md_rag.convert_pdf(pdf, pool=pool, use_cache=False))
+            content_hash, hash_s = timed(lambda: sha256_file(pdf))
+            cache.put(content_hash, markdown)
+            _, cached_s = timed(lambda: cache.get(content_hash))
+            ranges = md_rag.page_ranges(md_rag.pdf_page_count(pdf))
+            files[os.path.basename(pdf)] = {
+                "pages": md_rag.pdf_page_count(pdf),
+                "page_ranges": len(ranges) if ranges != [None] else 1,
+                "whole_file_s": round(serial_s, 3),
+                "page_parallel_s": round(parallel_s, 3),
+                "cached_ms": round((hash_s + cached_s) * 1000.0, 3),
+                "page_parallel_speedup": round(serial_s / parallel_s, 2) if parallel_s else None,
+                "cached_speedup": round(serial_s / (hash_s + cached_s), 1) if hash_s + cached_s else None,
+            }
+            print(f"  convert {os.path.basename(pdf)}: {files[os.path.basename(pdf)]}")
+    return {"workers": args.convert_workers, "files": files}
+
+
+def bench_search(args: argparse.Namespace) -> Dict[str, Any]:
+    from ann_index import build_index, measure_recall
+    from faiss_retriever import search_faiss
+
+    rng = np.random.default_rng(0)
+    queries = [f"benchmark question {i} about term{i % 97}" for i in range(args.queries)]
+    query_vectors = [np.asarray([stub_server.stub_vector(q, args.dim)], dtype=np.float32) for q in queries]
+    results = {}
+    for n in args.sizes:
+        vectors = rng.standard_normal((n, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        (index, info), build_s = timed(lambda: build_index(vectors))
+        recall = measure_recall(index, vectors)
+        with_embed, faiss_only = [], []
+        for q, qv in zip(queries, query_vectors):
+            _, s = timed(lambda: search_faiss(index, q, args.top_k))
+            with_embed.append(s)
+            _, s = timed(lambda: search_faiss(index, q, args.top_k, query_vector=qv))
+            faiss_only.append(s)
+        results[str(n)] = {
+            "index_type": info["type"],
+            "build_s": round(build_s, 3),
+            "recall_at_k": recall["recall_at_k"],
+            "search_faiss": summarize(with_embed),
+            "faiss_only": summarize(faiss_only),
+        }
+        print(f"  search ntotal={n} ({info['type']}): p50 {results[str(n)]['search_faiss']['p50_ms']} ms")
+    return results
+
+
+def _rss_mb() -> Dict[str, float]:
+    """This process's resident memory (Linux): private anonymous pages and file-backed (shareable) pages."""
+    rss = {"private": 0.0, "shared": 0.0}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("RssAnon", "RssFile"):
+                    rss["private" if key == "RssAnon" else "shared"] = int(value.split()[0]) / 1024.0
+    except OSError:
+        pass
+    return rss
+
+
+def _probe_index(path: str, mmap: bool, queries: np.ndarray, k: int) -> Dict[str, Any]:
+    """Open an index the way the API does and search it; run in a fresh process so memory is its own."""
+    from ann_index import read_index, search_params
+
+    before = _rss_mb()
+    index, load_s = timed(lambda: read_index(path, mmap=mmap))
+    params = search_params(index)
+    latencies, found = [], []
+    for q in queries:
+        (_, I), seconds = timed(lambda: index.search(q[None, :], k, params=params))
+        latencies.append(seconds)
+        found.append(I[0])
+    after = _rss_mb()
+    return {
+        "load_ms": round(load_s * 1000.0, 3),
+        "rss_private_mb": round(after["private"] - before["private"], 1),
+        "rss_shared_mb": round(after["shared"] - before["shared"], 1),
+        "search": summarize(latencies),
+        "ids": np.stack(found),
+    }
+
+
+def bench_storage(args: argparse.Namespace) -> Dict[str, Any]:
+    import faiss
+    from ann_index import QUANTIZATIONS, build_index, write_index
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    spawn = multiprocessing.get_context("spawn")
+    results = {}
+    for n in args.storage_sizes:
+        vectors = rng.standard_normal((n, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        _, truth = faiss.knn(queries, vectors, args.top_k)
+        by_mode: Dict[str, Any] = {}
+        for quantization in QUANTIZATIONS:
+            index, info = build_index(vectors, index_type=args.storage_index_type, quantization=quantization)
+            path = os.path.abspath(f"storage-{n}-{quantization}.faiss")
+            write_index(index, path)
+            del index
+            for mode, mmap in (("read_index", False), ("mmap", True)):
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    probe = pool.submit(_probe_index, path, mmap, queries, args.top_k).result()
+                found = probe.pop("ids")
+                hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+                by_mode[f"{quantization}/{mode}"] = {
+                    "index_type": info["type"],
+                    "file_mb": round(os.path.getsize(path) / 2**20, 1),
+                    "recall_at_k": round(hits / truth.size, 4),
+                    **probe,
+                }
+                print(f"  storage ntotal={n} {quantization}/{mode}: private {probe['rss_private_mb']} MB, "
+                      f"shared {probe['rss_shared_mb']} MB, p50 {probe['search']['p50_ms']} ms")
+            os.remove(path)
+        results[str(n)] = by_mode
+    return results
+
+
+async def _load(client, method: str, url: str, payloads: List[dict], concurrency: int, stream: bool = False) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    first_token: List[float] = []
+    errors = 0
+
+    async def one(payload: dict) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if stream:
+                    async with client.stream(method, url, json=payload) as resp:
+                        resp.raise_for_status()
+                        seen = False
+                        async for line in resp.aiter_lines():
+                            if not seen and line.startswith("event: token"):
+                                first_token.append(time.perf_counter() - start)
+                                seen = True
+                else:
+                    resp = await client.request(method, url, json=payload)
+                    resp.raise_for_status()
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in payloads))
+    wall = time.perf_counter() - start
+    result = summarize(latencies, wall, errors)
+    if stream:
+        result["first_token"] = summarize(first_token)
+    return result
+
+
+async def _run_api_load(base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    results: Dict[str, Any] = {}
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        chat_url = "/api/kbs/bench/chat"
+        for c in args.concurrency:
+            payloads = [{"message": f"what does section {i} say about term{i % 97}?", "top_k": 5} for i in range(args.requests)]
+            results[f"chat_c{c}"] = await _load(client, "POST", chat_url, payloads, c)
+            payloads = [{"message": f"summarize section {i}", "top_k": 5, "stream": True} for i in range(args.requests)]
+            results[f"chat_stream_c{c}"] = await _load(client, "POST", chat_url, payloads, c, stream=True)
+            print(f"  api concurrency={c}: chat p50 {results[f'chat_c{c}'].get('p50_ms')} ms")
+        batch = {"queries": [f"batch query {i} term{i % 97}" for i in range(args.batch_queries)], "top_k": 5}
+        results["search_batch"] = await _load(client, "POST", "/api/kbs/bench/search/batch", [batch] * 3, 1)
+        results["search_batch"]["queries_per_request"] = args.batch_queries
+    return results
+
+
+def bench_api(args: argparse.Namespace, workdir: str, config_path: str) -> Dict[str, Any]:
+    import httpx
+    import md_rag
+    from snapshots import INDEX_FILE, METADATA_FILE, write_generation
+
+    kb_path = os.path.join(workdir, "indices", "bench")
+    os.makedirs(kb_path, exist_ok=True)
+    chunks = _synthetic_chunks(args.api_chunks)
+    embeddings = md_rag.get_embedding(chunks)
+    with write_generation(kb_path) as staging:
+        md_rag.append_chunks_to_index(
+            chunks, embeddings,
+            index_path=os.path.join(staging, INDEX_FILE),
+            chunks_path=os.path.join(staging, md_rag.CHUNKS_FILE),
+            metadata_path=os.path.join(staging, METADATA_FILE),
+            file_name="synthetic.pdf",
+        )
+
+    port = _free_port()
+    env = {**os.environ, "RAG_CONFIG": config_path, "PYTHONPATH": os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")]))}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        startup_start = time.perf_counter()
+        while True:
+            if server.poll() is not None:
+                return {"error": f"app exited with code {server.returncode}"}
+            try:
+                if httpx.get(f"{base_url}/api/kbs", timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.perf_counter() - startup_start > 120:
+                return {"error": "app did not start within 120s"}
+            time.sleep(0.2)
+        results = {"startup_s": round(time.perf_counter() - startup_start, 3), "kb_chunks": len(chunks)}
+        # One warm-up request loads the KB into the cache outside the measured runs
+        httpx.post(f"{base_url}/api/kbs/bench/chat", json={"message": "warm up"}, timeout=120.0)
+        results.update(asyncio.run(_run_api_load(base_url, args)))
+        return results
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif key in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "rss_private_mb") and isinstance(value, (int, float)):
+            flat[path] = float(value)
+    return flat
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[str]:
+    """Print metric changes between two result files; returns the regressions beyond threshold (fraction)."""
+    before, after = _flatten(old.get("suites", {})), _flatten(new.get("suites", {}))
+    regressions = []
+    print(f"\n{'metric':70} {'before':>12} {'after':>12} {'change':>8}")
+    for path in sorted(before.keys() & after.keys()):
+        a, b = before[path], after[path]
+        change = (b - a) / a if a else 0.0
+        # Latency should not go up; throughput should not go down.
+        worse = change < -threshold if path.endswith("throughput_per_s") else change > threshold
+        flag = "  <-- regression" if worse else ""
+        if worse:
+            regressions.append(path)
+        print(f"{path:70} {a:12.3f} {b:12.3f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local stub model server")
+    parser.add_argument("--suites", default="ingest,convert,search,storage,api", help="Comma-separated: ingest, convert, search, storage, api")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--regression-threshold", type=float, default=0.10, help="Relative change flagged as a regression")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the embedding and answer caches enabled")
+    parser.add_argument("--dim", type=int, default=1536, help="Stub embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--embed-latency-per-item-ms", type=float, default=0.05)
+    parser.add_argument("--chat-latency-ms", type=float, default=200.0)
+    parser.add_argument("--token-latency-ms", type=float, default=5.0)
+    parser.add_argument("--docs", default=os.path.join(REPO_DIR, "docs"), help="Directory of PDFs for the ingest suite")
+    parser.add_argument("--ingest-repeats", type=int, default=1)
+    parser.add_argument("--convert-workers", type=int, default=os.cpu_count() or 2, help="Processes for page-parallel conversion")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Index sizes (ntotal) for the search suite")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per index size")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--storage-sizes", default="50000", help="Index sizes (ntotal) for the storage suite")
+    parser.add_argument("--storage-index-type", default="flat", help="Index type for the storage suite (flat, hnsw, ivf_flat)")
+    parser.add_argument("--api-chunks", type=int, default=5000, help="Chunks in the KB served by the api suite")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per load level")
+    parser.add_argument("--concurrency", default="1,8,32", help="Concurrent clients per load level")
+    parser.add_argument("--batch-queries", type=int, default=1000)
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    args.storage_sizes = [int(s) for s in args.storage_sizes.split(",") if s]
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c]
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    output = os.path.abspath(args.output)
+    args.docs = os.path.abspath(args.docs)
+
+    stub = stub_server.start(stub_server.StubConfig(
+        dim=args.dim,
+        embed_latency_ms=args.embed_latency_ms,
+        embed_latency_per_item_ms=args.embed_latency_per_item_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms,
+    ))
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    config_path = write_config(workdir, f"http://127.0.0.1:{stub.server_port}", args.with_caches)
+    # The backend reads its config and relative data paths at import time.
+    os.environ["RAG_CONFIG"] = config_path
+    os.environ["AZURE_OPENAI_API_KEY"] = "bench"
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "workdir": workdir,
+            "stub": {k: getattr(args, k) for k in ("dim", "embed_latency_ms", "embed_latency_per_item_ms", "chat_latency_ms", "token_latency_ms")},
+            "with_caches": args.with_caches,
+        },
+        "suites": {},
+    }
+    runners = {
+        "ingest": lambda: bench_ingest(args),
+        "convert": lambda: bench_convert(args),
+        "search": lambda: bench_search(args),
+        "storage": lambda: bench_storage(args),
+        "api": lambda: bench_api(args, workdir, config_path),
+    }
+    for name in suites:
+        if name not in runners:
+            parser.error(f"unknown suite '{name}'")
+        print(f"Running {name} benchmarks...")
+        try:
+            report["suites"][name], seconds = timed(runners[name])
+            print(f"  {name} done in {seconds:.1f}s")
+        except Exception as e:
+            # A suite that cannot run here (e.g. docling missing) should not sink the others.
+            print(f"  {name} failed: {e!r}")
+            report["suites"][name] = {"error": repr(e)}
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+    stub.shutdown()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.regression_threshold)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.regression_threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Local stand-in for the Azure OpenAI embeddings and chat-completions endpoints.
+
+Embeddings are deterministic unit vectors seeded from a hash of each input, so
+identical text always maps to the same vector and runs are repeatable. Chat
+completions return a fixed answer, streamed token by token when ``stream`` is
+set. Latency is configurable per request (and per streamed token) so the
+benchmarks can model a remote deployment without one, and the next N embedding
+requests can be throttled (429 with Retry-After) to exercise client retries.
+Embedding requests and inputs served are counted for the tests.
+
+    python bench/stub_server.py --port 18999 --dim 1536 --embed-latency-ms 40
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+
+ANSWER = "This is a benchmark answer generated by the local stub chat model from the supplied context."
+
+
+class StubConfig:
+    def __init__(self, dim: int = 1536, embed_latency_ms: float = 0.0, embed_latency_per_item_ms: float = 0.0,
+                 chat_latency_ms: float = 0.0, token_latency_ms: float = 0.0,
+                 throttle_embeddings: int = 0, retry_after_s: float = 1.0):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_latency_per_item_ms = embed_latency_per_item_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.throttle_embeddings = throttle_embeddings  # answer this many embedding requests with 429
+        self.retry_after_s = retry_after_s
+        self.embed_requests = 0
+        self.embed_inputs = 0
+        self.lock = threading.Lock()
+
+    def take_throttle(self, inputs: int) -> bool:
+        """Count an embedding request; True if it should be throttled."""
+        with self.lock:
+            self.embed_requests += 1
+            if self.throttle_embeddings > 0:
+                self.throttle_embeddings -= 1
+                return True
+            self.embed_inputs += inputs
+            return False
+
+
+def stub_vector(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # keep benchmark output clean
+            pass
+
+        def _send_json(self, payload: dict) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_throttled(self) -> None:
+            body = json.dumps({"error": {"code": "429", "message": "Rate limit exceeded (stub)."}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", f"{config.retry_after_s:g}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, text: str) -> None:
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if "/embeddings" in self.path:
+                texts = body.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+                if config.take_throttle(len(texts)):
+                    self._send_throttled()
+                    return
+                time.sleep((config.embed_latency_ms + config.embed_latency_per_item_ms * len(texts)) / 1000.0)
+                self._send_json({
+                    "object": "list",
+                    "model": body.get("model", "stub"),
+                    "data": [{"object": "embedding", "index": i, "embedding": stub_vector(t, config.dim)} for i, t in enumerate(texts)],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                })
+                return
+
+            time.sleep(config.chat_latency_ms / 1000.0)
+            if not body.get("stream"):
+                self._send_json({"object": "chat.completion", "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}]})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in ANSWER.split(" "):
+                time.sleep(config.token_latency_ms / 1000.0)
+                self._write_chunk("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": word + " "}}]}) + "\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def start(config: StubConfig, port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the stub on a background thread; port 0 picks a free port (see server.server_port)."""
+    server = ThreadingHTTPServer((host, port), _handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-model-server").start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local stub for the Azure OpenAI embeddings and chat endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18999)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-latency-per-item-ms", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-embeddings", type=int, default=0, help="Answer the first N embedding requests with 429")
+    parser.add_argument("--retry-after-s", type=float, default=1.0, help="Retry-After sent with throttled responses")
+    args = parser.parse_args(argv)
+    config = StubConfig(args.dim, args.embed_latency_ms, args.embed_latency_per_item_ms, args.chat_latency_ms, args.token_latency_ms,
+                        args.throttle_embeddings, args.retry_after_s)
+    server = start(config, args.port, args.host)
+    print(f"Stub model server on http://{args.host}:{server.server_port} (dim={args.dim})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
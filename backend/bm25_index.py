@@ -0,0 +1,222 @@
+import math
+import os
+import re
+import shutil
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import BM25_SETTINGS
+
+
+BM25_DIR = "bm25"
+_SEGMENT_FILES = ("terms", "indptr", "doc_ids", "tfs", "doc_len")
+_MAX_TERM_LEN = 64  # longer tokens are truncated
+
+# Keep codes and acronyms such as "ABC-123", "v2.1" or "scope_3" as single tokens.
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+
+# Near-universal terms carry almost no BM25 signal but have the longest postings.
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the their "
+    "this to was were which will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t[:_MAX_TERM_LEN] for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class Segment:
+    """
+    Postings for one batch of chunks in CSR layout: the postings of ``terms[t]`` are
+    ``doc_ids[indptr[t]:indptr[t+1]]`` with matching term frequencies in ``tfs``.
+    ``doc_len`` holds token counts for chunk IDs ``first_id .. first_id + len - 1``.
+    """
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray, first_id: int):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.first_id = first_id
+
+    @classmethod
+    def build(cls, chunks: Iterable[str], first_id: int) -> "Segment":
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        docs: List[int] = []
+        tfs: List[int] = []
+        lengths: List[int] = []
+        for i, text in enumerate(chunks):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                docs.append(first_id + i)
+                tfs.append(tf)
+        return cls._from_postings(list(vocab), np.array(term_ids, dtype=np.int64), np.array(docs, dtype=np.int32),
+                                  np.array(tfs, dtype=np.float32), np.array(lengths, dtype=np.int32), first_id)
+
+    @classmethod
+    def _from_postings(cls, vocab: List[str], term_ids: np.ndarray, docs: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray, first_id: int) -> "Segment":
+        terms = np.array(vocab, dtype=str) if vocab else np.zeros(0, dtype="<U1")
+        order = np.argsort(terms, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        sorted_term_ids = rank[term_ids] if len(term_ids) else term_ids
+        perm = np.lexsort((docs, sorted_term_ids))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sorted_term_ids, minlength=len(terms)), out=indptr[1:])
+        return cls(terms[order], indptr, docs[perm], tfs[perm], doc_len, first_id)
+
+    @classmethod
+    def merge(cls, segments: List["Segment"]) -> "Segment":
+        """Combine contiguous segments into one."""
+        vocab = np.unique(np.concatenate([s.terms for s in segments]))
+        term_ids = np.concatenate([
+            np.repeat(np.searchsorted(vocab, s.terms), np.diff(s.indptr)) for s in segments
+        ])
+        docs = np.concatenate([s.doc_ids for s in segments])
+        tfs = np.concatenate([s.tfs for s in segments])
+        doc_len = np.concatenate([s.doc_len for s in segments])
+        return cls._from_postings(vocab.tolist(), term_ids, docs, tfs, doc_len, segments[0].first_id)
+
+    def save(self, path: str) -> None:
+        tmp, old = path + ".tmp", path + ".old"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in _SEGMENT_FILES:
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> "Segment":
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in _SEGMENT_FILES}
+        first_id = int(os.path.basename(path))
+        return cls(first_id=first_id, **arrays)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        t = int(np.searchsorted(self.terms, term))
+        if t >= len(self.terms) or self.terms[t] != term:
+            return self.doc_ids[:0], self.tfs[:0]
+        start, end = self.indptr[t], self.indptr[t + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+
+class BM25Index:
+    """
+    A KB's lexical index: one segment per ingested batch, stored under ``bm25/``
+    as memory-mapped .npy arrays and named by the first chunk ID it covers.
+    Scoring uses collection statistics across all segments and accumulates
+    per-term BM25 contributions into a dense score vector, so a query costs
+    O(postings of its terms).
+    """
+
+    def __init__(self, segments: List[Segment], k1: float = 1.5, b: float = 0.75):
+        self.segments = sorted(segments, key=lambda s: s.first_id)
+        self.k1 = k1
+        self.b = b
+        self.doc_len = (np.concatenate([s.doc_len for s in self.segments]).astype(np.float32)
+                        if self.segments else np.zeros(0, dtype=np.float32))
+        self.ntotal = len(self.doc_len)
+        self.avgdl = float(self.doc_len.mean()) if self.ntotal else 0.0
+        self._norm = self.k1 * (1.0 - self.b + self.b * self.doc_len / max(self.avgdl, 1e-9))
+
+    @classmethod
+    def load(cls, kb_path: str) -> Optional["BM25Index"]:
+        bm25_dir = os.path.join(kb_path, BM25_DIR)
+        if not os.path.isdir(bm25_dir):
+            return None
+        segments = [Segment.load(os.path.join(bm25_dir, n)) for n in _segment_names(bm25_dir)]
+        expected = 0
+        for segment in segments:
+            if segment.first_id != expected:
+                print(f"BM25 index in {bm25_dir} has a gap at chunk {expected}; lexical search disabled until rebuilt")
+                return None
+            expected += len(segment.doc_len)
+        return cls(segments, k1=float(BM25_SETTINGS.get("k1", 1.5)), b=float(BM25_SETTINGS.get("b", 0.75)))
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (scores, chunk_ids) of the top-k chunks by BM25, best first; with
+        ``allowed`` (a boolean mask by chunk ID), only among those chunks. Chunk IDs
+        past the end of a shorter mask are not allowed.
+        """
+        if not self.ntotal:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        scores = np.zeros(self.ntotal, dtype=np.float32)
+        norm = self._norm
+        for term in set(tokenize(query)):
+            postings = [s.postings(term) for s in self.segments]
+            df = sum(len(d) for d, _ in postings)
+            if not df:
+                continue
+            idf = math.log(1.0 + (self.ntotal - df + 0.5) / (df + 0.5))
+            for doc_ids, tfs in postings:
+                if len(doc_ids):
+                    # doc_ids are unique within a term's postings, so fancy-index += is exact.
+                    scores[doc_ids] += idf * tfs * (self.k1 + 1.0) / (tfs + norm[doc_ids])
+        if allowed is not None:
+            mask = np.zeros(self.ntotal, dtype=bool)
+            n = min(len(allowed), self.ntotal)
+            mask[:n] = np.asarray(allowed[:n], dtype=bool)
+            scores[~mask] = 0.0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind="stable")
+        return scores[candidates[order]], candidates[order].astype(np.int64)
+
+
+def _segment_names(bm25_dir: str) -> List[str]:
+    return sorted(n for n in os.listdir(bm25_dir) if n.isdigit())
+
+
+def indexed_count(kb_path: str) -> int:
+    """Number of chunks covered by a KB's lexical index (0 if it has none)."""
+    bm25_dir = os.path.join(kb_path, BM25_DIR)
+    if not os.path.isdir(bm25_dir):
+        return 0
+    return sum(
+        len(np.load(os.path.join(bm25_dir, n, "doc_len.npy"), mmap_mode="r"))
+        for n in _segment_names(bm25_dir)
+    )
+
+
+def add_segment(kb_path: str, chunks: Iterable[str], first_id: int) -> None:
+    """Index a batch of newly appended chunks, merging segments once there are too many."""
+    bm25_dir = os.path.join(kb_path, BM25_DIR)
+    os.makedirs(bm25_dir, exist_ok=True)
+    Segment.build(chunks, first_id).save(os.path.join(bm25_dir, f"{first_id:012d}"))
+    names = _segment_names(bm25_dir)
+    if len(names) > int(BM25_SETTINGS.get("max_segments", 16)):
+        paths = [os.path.join(bm25_dir, n) for n in names]
+        merged = Segment.merge([Segment.load(p) for p in paths])
+        for p in paths[1:]:
+            shutil.rmtree(p)
+        merged.save(paths[0])
+
+
+def rebuild(kb_path: str, chunks: Iterable[str]) -> None:
+    """Index an existing KB's chunks from scratch (for KBs built before lexical indexing)."""
+    bm25_dir = os.path.join(kb_path, BM25_DIR)
+    shutil.rmtree(bm25_dir, ignore_errors=True)
+    os.makedirs(bm25_dir)
+    Segment.build(chunks, 0).save(os.path.join(bm25_dir, f"{0:012d}"))
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], weights: List[float], k: int, rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked chunk-ID lists with weighted RRF. Returns (fused scores, chunk_ids), best first."""
+    fused: Dict[int, float] = {}
+    for ids, weight in zip(rankings, weights):
+        for rank, chunk_id in enumerate(int(i) for i in ids if i >= 0):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (rrf_k + rank + 1)
+    best = sorted(fused.items(), key=lambda kv: -kv[1])[:k]
+    return (np.array([s for _, s in best], dtype=np.float32),
+            np.array([i for i, _ in best], dtype=np.int64))
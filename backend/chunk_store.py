@@ -0,0 +1,230 @@
+"""
+Compact on-disk chunk store.
+
+Chunks are stored as concatenated UTF-8 in ``chunks.bin`` with a sibling
+``chunks.idx`` holding ``count + 1`` little-endian uint64 byte offsets. Both are
+segmented files (see segmented_file) and are memory-mapped on open, so fetching
+chunk ``i`` is a slice and a decode, with no parse of the rest of the store.
+Appends only write the new chunks' bytes and offsets, as new parts.
+
+    python chunk_store.py migrate indices/          # convert every chunks.json
+    python chunk_store.py bench indices/<kb>/chunks.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Iterator, List, Sequence
+
+import numpy as np
+
+import segmented_file
+
+
+CHUNKS_FILE = "chunks.bin"
+LEGACY_CHUNKS_FILE = "chunks.json"
+_OFFSET_DTYPE = np.dtype("<u8")
+
+
+def offsets_path(data_path: str) -> str:
+    return os.path.splitext(data_path)[0] + ".idx"
+
+
+def _legacy_json_path(data_path: str) -> str:
+    return os.path.splitext(data_path)[0] + ".json"
+
+
+def _store_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".bin" if path.endswith(".json") else path
+
+
+class ChunkStore(Sequence[str]):
+    """Read-only, memory-mapped view of a chunk store."""
+
+    def __init__(self, data_path: str):
+        self.path = data_path
+        self._data = segmented_file.open_array(data_path, np.uint8)
+        self._offsets = segmented_file.open_array(offsets_path(data_path), _OFFSET_DTYPE)
+        if not len(self._offsets):
+            self._offsets = np.zeros(1, dtype=_OFFSET_DTYPE)
+        # A concurrent append may have grown the data file past the offsets we mapped;
+        # only the chunks those offsets describe are visible through this view.
+        self._count = len(self._offsets) - 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i):  # type: ignore[override]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._data[start:end]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield self[i]
+
+    @property
+    def nbytes_resident(self) -> int:
+        """Heap memory held by this view; mapped pages live in the shared page cache."""
+        return 0 if segmented_file.is_mapped(self._offsets) else self._offsets.nbytes
+
+    def close(self) -> None:
+        # The mappings are released with the last reference to them.
+        self._data = np.zeros(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=_OFFSET_DTYPE)
+        self._count = 0
+
+
+def _encode(chunks: Sequence[str], base: int) -> tuple[bytes, np.ndarray]:
+    encoded = [c.encode("utf-8") for c in chunks]
+    offsets = np.cumsum([0] + [len(b) for b in encoded], dtype=np.uint64) + np.uint64(base)
+    return b"".join(encoded), offsets.astype(_OFFSET_DTYPE)
+
+
+def write_chunk_store(data_path: str, chunks: Sequence[str]) -> None:
+    """Write a fresh chunk store, replacing any existing one."""
+    os.makedirs(os.path.dirname(data_path) or ".", exist_ok=True)
+    payload, offsets = _encode(chunks, 0)
+    segmented_file.write(data_path, payload)
+    segmented_file.write(offsets_path(data_path), offsets.tobytes())
+
+
+def append_chunks(data_path: str, chunks: Sequence[str]) -> int:
+    """Append chunks to a store (creating it if needed). Returns the new chunk count."""
+    if not os.path.exists(data_path):
+        write_chunk_store(data_path, chunks)
+        return len(chunks)
+    idx_path = offsets_path(data_path)
+    count = segmented_file.size(idx_path) // _OFFSET_DTYPE.itemsize - 1
+    base = int(segmented_file.open_array(idx_path, _OFFSET_DTYPE)[count])
+    payload, new_offsets = _encode(chunks, base)
+    # Drop any bytes a previously interrupted append left past the last offset.
+    segmented_file.truncate(data_path, base)
+    segmented_file.append(data_path, payload)
+    # Data first, offsets second: readers never see an offset past written data.
+    segmented_file.append(idx_path, new_offsets[1:].tobytes())
+    return count + len(chunks)
+
+
+def truncate_chunks(data_path: str, count: int) -> None:
+    """Drop every chunk past the first ``count``, e.g. to roll back a failed append."""
+    idx_path = offsets_path(data_path)
+    if segmented_file.size(idx_path) < (count + 1) * _OFFSET_DTYPE.itemsize:
+        raise ValueError(f"Chunk store {data_path} has fewer than {count} chunks.")
+    end = int(segmented_file.open_array(idx_path, _OFFSET_DTYPE)[count])
+    # Offsets first, data second: readers never see an offset past written data.
+    segmented_file.truncate(idx_path, (count + 1) * _OFFSET_DTYPE.itemsize)
+    segmented_file.truncate(data_path, end)
+
+
+def chunks_exist(path: str) -> bool:
+    """True if a chunk store (or a legacy chunks.json) exists for this path."""
+    return os.path.exists(_store_path(path)) or os.path.exists(_legacy_json_path(path))
+
+
+def open_chunks(path: str) -> Sequence[str]:
+    """
+    Open the chunks for a KB. ``path`` may name the store or a legacy chunks.json;
+    KBs not yet migrated are read from their JSON file.
+    """
+    store = _store_path(path)
+    if os.path.exists(store) and os.path.exists(offsets_path(store)):
+        return ChunkStore(store)
+    legacy = _legacy_json_path(path)
+    if os.path.exists(legacy):
+        with open(legacy, "r", encoding="utf-8") as f:
+            chunks: List[str] = json.load(f)
+        return chunks
+    raise FileNotFoundError(f"No chunk store at {store}")
+
+
+def migrate_json(json_path: str, remove: bool = False) -> str:
+    """Convert a chunks.json file into a chunk store next to it. Returns the store path."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        chunks: List[str] = json.load(f)
+    store = _store_path(json_path)
+    write_chunk_store(store, chunks)
+    if remove:
+        os.remove(json_path)
+    return store
+
+
+def ensure_migrated(data_path: str) -> None:
+    """Migrate a legacy chunks.json in place before the store is written to."""
+    legacy = _legacy_json_path(data_path)
+    if not os.path.exists(data_path) and os.path.exists(legacy):
+        migrate_json(legacy, remove=True)
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _bench_child(mode: str, path: str, reads: int) -> None:
+    base_rss = _rss_bytes()
+    t0 = time.perf_counter()
+    if mode == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+    else:
+        chunks = ChunkStore(path)
+    load_s = time.perf_counter() - t0
+    rng = np.random.default_rng(0)
+    ids = rng.integers(0, len(chunks), size=reads)
+    t0 = time.perf_counter()
+    for i in ids:
+        chunks[int(i)]
+    fetch_s = time.perf_counter() - t0
+    print(json.dumps({
+        "mode": mode,
+        "chunks": len(chunks),
+        "load_ms": round(load_s * 1000, 3),
+        "fetch_us": round(fetch_s / max(1, reads) * 1e6, 3),
+        "rss_delta_mb": round((_rss_bytes() - base_rss) / 2**20, 2),
+    }))
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Chunk store tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    m = sub.add_parser("migrate", help="Convert chunks.json files under a directory into chunk stores")
+    m.add_argument("root", help="An indices directory, a KB directory or a chunks.json file")
+    m.add_argument("--remove-json", action="store_true", help="Delete chunks.json after converting")
+    b = sub.add_parser("bench", help="Compare load time and RSS of a chunks.json against its chunk store")
+    b.add_argument("json_path")
+    b.add_argument("--reads", type=int, default=10)
+    c = sub.add_parser("_child")
+    c.add_argument("mode")
+    c.add_argument("path")
+    c.add_argument("reads", type=int)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        if os.path.isfile(args.root):
+            targets = [args.root]
+        else:
+            targets = [os.path.join(d, f) for d, _, files in os.walk(args.root) for f in files if f == LEGACY_CHUNKS_FILE]
+        for path in targets:
+            store = migrate_json(path, remove=args.remove_json)
+            print(f"Migrated {path} -> {store}")
+        print(f"Migrated {len(targets)} chunk file(s).")
+    elif args.command == "bench":
+        store = _store_path(args.json_path)
+        if not os.path.exists(store):
+            migrate_json(args.json_path)
+        for mode, path in (("json", args.json_path), ("store", store)):
+            subprocess.run([sys.executable, __file__, "_child", mode, path, str(args.reads)], check=True)
+    else:
+        _bench_child(args.mode, args.path, args.reads)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,192 @@
+"""
+Structure-aware, token-bounded chunking of converted Markdown.
+
+The document is walked line by line and split into sections at Markdown
+headings, and sections into blocks at blank lines (a paragraph, list or table).
+Blocks are packed into chunks of at most ``max_tokens`` tokens; a block that is
+too large on its own is cut at line, then sentence, then token boundaries.
+Consecutive chunks of a section share up to ``overlap_tokens`` of trailing
+text, and continuation chunks repeat their section heading. Short sections are
+packed together rather than emitted as tiny chunks.
+
+Everything is a generator, so chunks can be embedded and indexed while the rest
+of the document is still being chunked. Each chunk is a Chunk: its text, plus the
+page range (from the converter's PAGE_BREAK markers) and character offsets it
+was cut from.
+"""
+import io
+import re
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from config import EMBEDDING_SETTINGS
+from embedding_executor import TokenCounter, default_token_counter
+
+
+CHUNK_TOKENS = int(EMBEDDING_SETTINGS.get("chunk_size") or 1024)
+CHUNK_OVERLAP = int(EMBEDDING_SETTINGS.get("chunk_overlap") or 0)
+
+_HEADING_RE = re.compile(r"^#{1,6}\s+\S")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Placeholder the converter writes between pages (see md_rag.pdf_to_markdown_with_docling).
+PAGE_BREAK = "<!-- page-break -->"
+
+T = TypeVar("T")
+
+# (page, char_start, char_end) of a piece of text in the converted document
+Span = Tuple[int, int, int]
+
+
+class Chunk(str):
+    """
+    A chunk's text with where it came from: 1-based page range (-1 when the document
+    has no page markers) and [char_start, char_end) offsets into the converted Markdown.
+    It is a str, so it flows through embedding and the chunk store unchanged.
+    """
+
+    def __new__(cls, text: str, page_start: int = -1, page_end: int = -1, char_start: int = -1, char_end: int = -1):
+        chunk = super().__new__(cls, text)
+        chunk.page_start, chunk.page_end = page_start, page_end
+        chunk.char_start, chunk.char_end = char_start, char_end
+        return chunk
+
+
+def iter_blocks(text: str) -> Iterator[Tuple[bool, str, Span]]:
+    """
+    Yield (is_heading, block, span) for each heading line and blank-line separated block.
+    Lines inside fenced code blocks are never treated as headings or separators.
+    PAGE_BREAK lines advance the page and are dropped.
+    """
+    lines: List[str] = []
+    in_fence = False
+    page = 1 if PAGE_BREAK in text else -1
+    pos = start = end = 0
+    for raw in io.StringIO(text):
+        line = raw.rstrip("\n")
+        line_start, pos = pos, pos + len(raw)
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and (not line.strip() or _HEADING_RE.match(line) or line.strip() == PAGE_BREAK):
+            if lines:
+                yield False, "\n".join(lines), (page, start, end)
+                lines = []
+            if line.strip() == PAGE_BREAK:
+                page += 1
+            elif line.strip():
+                yield True, line.strip(), (page, line_start, line_start + len(line))
+            continue
+        if not lines:
+            start = line_start
+        lines.append(line)
+        end = line_start + len(line)
+    if lines:
+        yield False, "\n".join(lines), (page, start, end)
+
+
+def _split_block(block: str, max_tokens: int, counter: TokenCounter, sep: str = "\n\n") -> Iterator[Tuple[str, str, int]]:
+    """
+    Cut an oversized block at the coarsest boundary that makes its pieces fit.
+    Yields (separator, piece, tokens); the separator is what joined the piece to
+    the text before it, so tables and lists keep their line structure.
+    """
+    for piece_sep, parts in (("\n", block.split("\n")), (" ", _SENTENCE_RE.split(block))):
+        parts = [p for p in parts if p.strip()]
+        if len(parts) > 1:
+            for i, part in enumerate(parts):
+                part_sep = sep if i == 0 else piece_sep
+                n = counter.count(part_sep + part)
+                if n <= max_tokens:
+                    yield part_sep, part, n
+                else:
+                    yield from _split_block(part, max_tokens, counter, part_sep)
+            return
+    for i, piece in enumerate(counter.split(block, max_tokens)):
+        yield (sep if i == 0 else ""), piece, counter.count(piece)
+
+
+def _chunk(text: str, spans: List[Span]) -> Chunk:
+    pages = [page for page, _, _ in spans if page >= 0]
+    return Chunk(
+        text,
+        page_start=min(pages) if pages else -1,
+        page_end=max(pages) if pages else -1,
+        char_start=min(start for _, start, _ in spans) if spans else -1,
+        char_end=max(end for _, _, end in spans) if spans else -1,
+    )
+
+
+def iter_chunks(text: str, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> Iterator[Chunk]:
+    """Yield chunks of ``text`` bounded by ``max_tokens`` (defaults: embedding.chunk_size / chunk_overlap)."""
+    max_tokens = int(max_tokens or CHUNK_TOKENS)
+    overlap_tokens = min(int(CHUNK_OVERLAP if overlap_tokens is None else overlap_tokens), max_tokens // 2)
+    counter = default_token_counter()
+    heading, heading_tokens = "", 0
+    # (separator, text, tokens, span); a heading repeated on a continuation chunk has no span
+    parts: List[Tuple[str, str, int, Optional[Span]]] = []
+    size = 0
+
+    def emit() -> Chunk:
+        # A piece carried or split onto the heading still starts its own paragraph.
+        body = "".join(
+            (sep if i == 0 or parts[i - 1][1] != heading else "\n\n") + text
+            for i, (sep, text, _, _) in enumerate(parts)
+        ).strip()
+        return _chunk(body, [span for _, _, _, span in parts if span is not None])
+
+    for is_heading, block, (page, block_start, _) in iter_blocks(text):
+        if is_heading:
+            # Prefer to cut at a section boundary, but keep packing small sections together.
+            if parts and size >= max_tokens // 4:
+                yield emit()
+                parts, size = [], 0
+            heading, heading_tokens = block, counter.count("\n\n" + block)
+            parts.append(("\n\n", block, heading_tokens, (page, block_start, block_start + len(block))))
+            size += heading_tokens
+            continue
+
+        n = counter.count("\n\n" + block)
+        budget = max(1, max_tokens - heading_tokens)
+        pieces = [("\n\n", block, n)] if n <= budget else _split_block(block, budget, counter)
+        cursor = 0
+        for sep, piece, n in pieces:
+            found = block.find(piece, cursor)
+            at = found if found >= 0 else cursor
+            cursor = at + len(piece)
+            span = (page, block_start + at, block_start + cursor)
+            if parts and size + n > max_tokens:
+                yield emit()
+                # Carry trailing pieces into the next chunk as overlap, never the whole chunk.
+                carried: List[Tuple[str, str, int, Optional[Span]]] = []
+                carried_size = 0
+                for prev in reversed(parts[1:]):
+                    if prev[1] == heading or carried_size + prev[2] > overlap_tokens:
+                        break
+                    carried.insert(0, prev)
+                    carried_size += prev[2]
+                parts = ([("\n\n", heading, heading_tokens, None)] if heading else []) + carried
+                size = (heading_tokens if heading else 0) + carried_size
+                if size + n > max_tokens:
+                    parts = parts[:1] if heading else []
+                    size = heading_tokens if heading else 0
+            parts.append((sep, piece, n, span))
+            size += n
+
+    if any(text != heading for _, text, _, _ in parts):
+        yield emit()
+
+
+def chunk_text(text: str, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[Chunk]:
+    """All chunks of ``text`` as a list; prefer iter_chunks for large documents."""
+    return list(iter_chunks(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens))
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of at most ``size`` items."""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
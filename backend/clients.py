@@ -0,0 +1,34 @@
+"""
+Azure OpenAI SDK clients shared by the whole process.
+
+Clients are built on first use, one per API version, and the openai package is
+only imported then; a worker that never calls the SDK never pays for it.
+"""
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+
+from config import CONFIG
+
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
+
+
+API_BASE = CONFIG["azure"]["openai"]["api_base"].rstrip("/")
+API_KEY = os.getenv("AZURE_OPENAI_API_KEY", CONFIG["azure"]["openai"]["api_key"])
+API_VERSION = CONFIG["azure"]["openai"]["api_version"]
+
+_clients: Dict[str, "AzureOpenAI"] = {}
+_lock = threading.Lock()
+
+
+def azure_openai_client(api_version: Optional[str] = None) -> "AzureOpenAI":
+    """The process's AzureOpenAI client for an API version (default azure.openai.api_version)."""
+    version = api_version or API_VERSION
+    with _lock:
+        client = _clients.get(version)
+        if client is None:
+            from openai import AzureOpenAI
+
+            client = _clients[version] = AzureOpenAI(azure_endpoint=API_BASE, api_key=API_KEY, api_version=version)
+        return client
@@ -4,7 +4,8 @@ import os
 
 def load_config(path: str = None):
     if path is None:
-        path = os.path.join(os.path.dirname(__file__), 'config.yaml')
+        # RAG_CONFIG points the backend at another config file (e.g. the offline benchmarks)
+        path = os.getenv("RAG_CONFIG") or os.path.join(os.path.dirname(__file__), 'config.yaml')
     with open(path, 'r') as f:
         return yaml.safe_load(f)
 
@@ -17,6 +18,18 @@ EMBEDDING_SETTINGS = CONFIG["azure"]["openai"]["embedding"]
 VECTOR_DB_SETTINGS = CONFIG["vector_db"]
 BM25_SETTINGS = CONFIG["bm25"]
 RETRIEVAL_SETTINGS = CONFIG["retrieval"]
+CONTEXT_SETTINGS = CONFIG["context"]
 DOCLING_SETTINGS = CONFIG["docling"]
+CONVERSION_CACHE_SETTINGS = CONFIG["conversion_cache"]
+SNAPSHOT_SETTINGS = CONFIG["snapshots"]
+DEDUP_SETTINGS = CONFIG["dedup"]
+KB_CACHE_SETTINGS = CONFIG["kb_cache"]
+KB_CATALOG_SETTINGS = CONFIG["kb_catalog"]
+EMBEDDING_CACHE_SETTINGS = CONFIG["embedding_cache"]
+ANSWER_CACHE_SETTINGS = CONFIG["answer_cache"]
+EMBEDDING_EXECUTOR_SETTINGS = CONFIG["embedding_executor"]
+QUERY_BATCHING_SETTINGS = CONFIG["query_batching"]
+INGEST_JOB_SETTINGS = CONFIG["ingest_jobs"]
+METRICS_SETTINGS = CONFIG["metrics"]
 FEEDBACK_SETTINGS = CONFIG["feedback"]
 LOGGING_SETTINGS = CONFIG["logging"]
\ No newline at end of file
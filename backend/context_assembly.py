@@ -0,0 +1,111 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import CONTEXT_SETTINGS
+from embedding_executor import default_token_counter
+
+
+_MMR = CONTEXT_SETTINGS.get("mmr") or {}
+
+
+@dataclass
+class AssembledContext:
+    """The chunks chosen for a prompt, as positions into the candidate list, plus what was left out."""
+    kept: List[int]
+    texts: List[str]
+    tokens_used: int
+    tokens_candidates: int
+    dropped_duplicates: List[int] = field(default_factory=list)
+    dropped_over_budget: List[int] = field(default_factory=list)
+    truncated: bool = False
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_candidates - self.tokens_used
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "candidates": len(self.kept) + len(self.dropped_duplicates) + len(self.dropped_over_budget),
+            "kept": len(self.kept),
+            "tokens_used": self.tokens_used,
+            "tokens_saved": self.tokens_saved,
+            "dropped_duplicates": len(self.dropped_duplicates),
+            "dropped_over_budget": len(self.dropped_over_budget),
+            "truncated": self.truncated,
+        }
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def assemble_context(
+    texts: Sequence[str],
+    vectors: Optional[np.ndarray] = None,
+    query_vector: Optional[np.ndarray] = None,
+    max_tokens: Optional[int] = None,
+    dedup_threshold: Optional[float] = None,
+    mmr_lambda: Optional[float] = None,
+) -> AssembledContext:
+    """
+    Choose which retrieved chunks go into the prompt.
+
+    Candidates are taken in rank order, or by maximal marginal relevance when
+    ``mmr_lambda`` is set and a query vector is given. A candidate whose cosine
+    similarity to an already chosen chunk reaches ``dedup_threshold`` is dropped as
+    a near-duplicate; one that no longer fits ``max_tokens`` is skipped in favour of
+    smaller ones further down. The best candidate is always kept, cut to the budget
+    if it alone exceeds it. Duplicate detection and MMR need the chunks' stored
+    vectors (rows aligned with ``texts``); without them only the budget applies.
+    Defaults come from the ``context`` config section.
+    """
+    max_tokens = int(max_tokens or CONTEXT_SETTINGS.get("max_tokens", 3000))
+    if dedup_threshold is None:
+        dedup_threshold = float(CONTEXT_SETTINGS.get("dedup_threshold", 0.95))
+    if mmr_lambda is None and _MMR.get("enabled", False):
+        mmr_lambda = float(_MMR.get("lambda", 0.7))
+
+    counter = default_token_counter()
+    token_counts = [counter.count(t) for t in texts]
+    result = AssembledContext(kept=[], texts=[], tokens_used=0, tokens_candidates=sum(token_counts))
+    if not texts:
+        return result
+
+    unit = _unit_rows(vectors) if vectors is not None and len(vectors) == len(texts) else None
+    lam = float(mmr_lambda or 0.0)
+    relevance = None
+    if unit is not None and query_vector is not None and mmr_lambda is not None:
+        relevance = unit @ _unit_rows(np.reshape(query_vector, (1, -1)))[0]
+    # Highest similarity of each candidate to anything chosen so far.
+    max_sim = np.full(len(texts), -1.0, dtype=np.float32)
+    remaining = list(range(len(texts)))
+
+    while remaining:
+        if relevance is not None and result.kept:
+            scores = [lam * relevance[i] - (1.0 - lam) * max_sim[i] for i in remaining]
+            pos = remaining.pop(int(np.argmax(scores)))
+        else:
+            pos = remaining.pop(0)
+
+        if unit is not None and max_sim[pos] >= dedup_threshold:
+            result.dropped_duplicates.append(pos)
+            continue
+        n = token_counts[pos]
+        text = texts[pos]
+        if result.tokens_used + n > max_tokens:
+            if result.kept:
+                result.dropped_over_budget.append(pos)
+                continue
+            text = counter.split(text, max_tokens)[0]
+            n = counter.count(text)
+            result.truncated = True
+        result.kept.append(pos)
+        result.texts.append(text)
+        result.tokens_used += n
+        if unit is not None:
+            np.maximum(max_sim, unit @ unit[pos], out=max_sim)
+    return result
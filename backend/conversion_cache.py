@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from typing import Any, BinaryIO, Dict, Optional
+
+from config import CONVERSION_CACHE_SETTINGS
+
+
+# Bump when the converted form changes (converter options, page markers), so old entries are not reused.
+FORMAT_VERSION = "docling-md-1"
+_READ_BLOCK = 1 << 20
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_hashing(src: BinaryIO, dest_path: str) -> str:
+    """Stream ``src`` to ``dest_path``, hashing it on the way; returns the SHA-256 hex digest."""
+    digest = hashlib.sha256()
+    with open(dest_path, "wb") as f:
+        for block in iter(lambda: src.read(_READ_BLOCK), b""):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """
+    Converted Markdown on disk, keyed by the SHA-256 of the source PDF.
+
+    Re-uploading a document, or rebuilding a KB with different chunking, reuses the
+    conversion instead of running docling again. Entries are plain files written
+    atomically, so several processes can share the directory. Once the entries
+    exceed ``max_bytes`` the least recently used (by mtime, refreshed on every hit)
+    are deleted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = os.path.join(directory, FORMAT_VERSION)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.md")
+
+    def get(self, content_hash: str) -> Optional[str]:
+        path = self._path(content_hash)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                markdown = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return markdown
+
+    def put(self, content_hash: str, markdown: str) -> None:
+        path = self._path(content_hash)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(markdown)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._evict_to_budget()
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".md"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_mtime, st.st_size
+
+    def _evict_to_budget(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        excess = sum(size for _, _, size in entries) - self.max_bytes
+        for path, _, size in entries:
+            if excess <= 0:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            excess -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = [size for _, _, size in self._entries()]
+            lookups = self.hits + self.misses
+            return {
+                "path": self.directory,
+                "entries": len(sizes),
+                "stored_bytes": sum(sizes),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_shared_cache: Optional[ConversionCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_conversion_cache() -> Optional[ConversionCache]:
+    """Return the process-wide conversion cache, or None when disabled in config."""
+    global _shared_cache
+    if not CONVERSION_CACHE_SETTINGS.get("enabled", True):
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ConversionCache(
+                CONVERSION_CACHE_SETTINGS.get("path", "data/converted"),
+                max_bytes=int(CONVERSION_CACHE_SETTINGS.get("max_size_mb", 2048)) * 1024 * 1024,
+            )
+        return _shared_cache
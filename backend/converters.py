@@ -0,0 +1,82 @@
+"""
+Reusable docling converters.
+
+A DocumentConverter loads its layout and table models the first time it
+converts, which takes seconds; building one per upload paid that on every
+document. ConverterPool keeps up to ``size`` converters for the life of the
+process and lends each to one conversion at a time. docling is imported only
+when the first converter is built, so processes that never convert (API
+workers serving chat) never load it.
+"""
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+
+class ConverterPool:
+    def __init__(self, size: int = 1):
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.warmup_s: Optional[float] = None
+
+    @staticmethod
+    def _new() -> Any:
+        from docling.document_converter import DocumentConverter
+
+        return DocumentConverter()
+
+    def _reserve(self) -> bool:
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+            return True
+
+    def _build(self) -> Any:
+        try:
+            return self._new()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def converter(self) -> Iterator[Any]:
+        """Borrow a converter, building one if the pool is not full yet, else waiting for one."""
+        try:
+            converter = self._idle.get_nowait()
+        except queue.Empty:
+            converter = self._build() if self._reserve() else self._idle.get()
+        try:
+            yield converter
+        finally:
+            self._idle.put(converter)
+
+    def prewarm(self) -> Dict[str, Any]:
+        """
+        Fill the pool and load each converter's PDF pipeline now rather than on the
+        first upload. Returns this process's pid and how long its converters took to load.
+        """
+        started = time.perf_counter()
+        built = 0
+        while self._reserve():
+            converter = self._build()
+            initialize = getattr(converter, "initialize_pipeline", None)
+            if initialize is not None:
+                from docling.datamodel.base_models import InputFormat
+
+                initialize(InputFormat.PDF)
+            self._idle.put(converter)
+            built += 1
+        if built:
+            self.warmup_s = time.perf_counter() - started
+        return {"pid": os.getpid(), "converters": self._created, "warmup_s": round(self.warmup_s or 0.0, 3)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": self.size, "created": self._created, "idle": self._idle.qsize(), "warmup_s": self.warmup_s}
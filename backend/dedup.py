@@ -0,0 +1,362 @@
+"""
+Near-duplicate chunk detection at ingest.
+
+Reports repeat boilerplate (disclaimers, headers, whole sections) across pages
+and across documents. Each chunk is reduced to a MinHash signature of its
+lowercased word shingles (``shingle_words`` consecutive words), and signatures
+are banded into an LSH table, so the chunks sharing a band with a new one are
+its only candidates; a candidate whose signatures agree on at least
+``threshold`` of their positions (the estimated Jaccard similarity of the two
+chunks' shingle sets) makes the new chunk a duplicate of it.
+
+A KB stores the signature of every chunk it holds (``dedup/minhash.u32``, one
+row per chunk ID), so a document is checked against the whole KB as well as
+against its own earlier chunks. The LSH table over a KB's stored signatures is
+built once per KB generation and shared by the jobs appending to it (see
+LSHCache). Duplicates are neither embedded nor indexed;
+the KB records each as an alias of the chunk it duplicates (see
+provenance.append_aliases), so file and page filters and citations still find
+the text where it occurred.
+"""
+import copy
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, cast
+
+import numpy as np
+
+import segmented_file
+from chunk_store import chunks_exist, open_chunks
+from config import DEDUP_SETTINGS
+from embedding_executor import default_token_counter
+from metrics import DEDUP_TOKENS_SAVED, INGEST_CHUNKS, observe_stage
+
+
+DEDUP_DIR = "dedup"
+SIGNATURES_FILE = "minhash.u32"
+ENABLED = bool(DEDUP_SETTINGS.get("enabled", True))
+THRESHOLD = float(DEDUP_SETTINGS.get("threshold", 0.9))
+NUM_PERM = int(DEDUP_SETTINGS.get("num_perm", 128))
+BANDS = int(DEDUP_SETTINGS.get("bands", 16))
+SHINGLE_WORDS = int(DEDUP_SETTINGS.get("shingle_words", 5))
+LSH_CACHE_ENTRIES = int(DEDUP_SETTINGS.get("lsh_cache_entries", 4))
+
+SPAN_FIELDS = ("page_start", "page_end", "char_start", "char_end")
+
+_WORD = re.compile(r"\w+")
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_EMPTY = np.uint32(0xFFFFFFFF)
+
+
+@lru_cache(maxsize=1 << 18)
+def _word_hash(word: str) -> int:
+    return zlib.crc32(word.encode("utf-8"))
+
+
+def shingle_hashes(text: str, shingle_words: int = SHINGLE_WORDS) -> np.ndarray:
+    """32-bit hashes of the distinct ``shingle_words``-word shingles of a text (the whole text if it is shorter)."""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    h = np.fromiter((_word_hash(w) for w in words), dtype=np.uint64, count=len(words))
+    n = max(1, len(h) - shingle_words + 1)
+    shingles = np.zeros(n, dtype=np.uint64)
+    for j in range(min(shingle_words, len(h))):
+        shingles = shingles * _MIX + h[j:j + n]  # wraps modulo 2**64
+    return np.unique((shingles ^ (shingles >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+
+class MinHasher:
+    """
+    MinHash over ``num_perm`` multiply-shift hash functions (the top 32 bits of
+    a*x + b modulo 2**64, a odd), seeded so signatures are stable across runs.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, shingle_words: int = SHINGLE_WORDS, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self._a = rng.integers(0, np.iinfo(np.uint64).max, size=(num_perm, 1), dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self._b = rng.integers(0, np.iinfo(np.uint64).max, size=(num_perm, 1), dtype=np.uint64, endpoint=True)
+
+    def signature(self, text: str) -> np.ndarray:
+        """uint32[num_perm]; all 0xFFFFFFFF for a text with no words, which never counts as a duplicate."""
+        shingles = shingle_hashes(text, self.shingle_words)
+        if not len(shingles):
+            return np.full(self.num_perm, _EMPTY, dtype=np.uint32)
+        hashed = np.multiply(self._a, shingles[None, :])
+        hashed += self._b
+        # The shift is monotonic, so it can follow the min over the full 64-bit values.
+        return (hashed.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+    def signatures(self, texts: Iterable[str]) -> np.ndarray:
+        rows = [self.signature(t) for t in texts]
+        return np.stack(rows) if rows else np.zeros((0, self.num_perm), dtype=np.uint32)
+
+
+def _band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """One uint64 key per (row, band) from the band's slice of each signature."""
+    rows = signatures.shape[1] // bands
+    banded = signatures[:, :bands * rows].reshape(len(signatures), bands, rows).astype(np.uint64)
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for r in range(rows):
+        keys = keys * _MIX + banded[:, :, r]
+    return keys
+
+
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures. The KB's stored signatures are indexed as
+    sorted band keys (a binary search per band per lookup); signatures added while a
+    document is checked go into per-band dicts and get IDs following the stored ones.
+    """
+
+    def __init__(self, signatures: np.ndarray, bands: int = BANDS):
+        self.bands = bands
+        self.base = signatures
+        keys = _band_keys(signatures, bands)
+        valid = ~(signatures == _EMPTY).all(axis=1) if len(signatures) else np.zeros(0, dtype=bool)
+        ids = np.flatnonzero(valid)
+        self._ids = [ids[np.argsort(keys[ids, b], kind="stable")] for b in range(bands)]
+        self._keys = [keys[order, b] for b, order in enumerate(self._ids)]
+        self._added: List[np.ndarray] = []
+        self._added_keys: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self._added)
+
+    def signature(self, id: int) -> np.ndarray:
+        return self.base[id] if id < len(self.base) else self._added[id - len(self.base)]
+
+    def candidates(self, signature: np.ndarray) -> Set[int]:
+        keys = _band_keys(signature[None, :], self.bands)[0]
+        found: Set[int] = set()
+        for b, key in enumerate(keys):
+            sorted_keys = self._keys[b]
+            lo = int(np.searchsorted(sorted_keys, key, side="left"))
+            hi = int(np.searchsorted(sorted_keys, key, side="right"))
+            found.update(self._ids[b][lo:hi].tolist())
+            found.update(self._added_keys[b].get(int(key), ()))
+        return found
+
+    def fork(self) -> "LSHIndex":
+        """A copy sharing the stored signatures' tables, without the signatures added since."""
+        forked = copy.copy(self)
+        forked._added = []
+        forked._added_keys = [{} for _ in range(self.bands)]
+        return forked
+
+    def add(self, signature: np.ndarray) -> int:
+        id = len(self)
+        self._added.append(signature)
+        if not (signature == _EMPTY).all():
+            for b, key in enumerate(_band_keys(signature[None, :], self.bands)[0]):
+                self._added_keys[b].setdefault(int(key), []).append(id)
+        return id
+
+
+class Deduplicator:
+    """
+    Drops near-duplicates from one document's chunk stream before they are embedded.
+
+    ``kb_signatures`` are the signatures of the KB's chunks (row = chunk ID). After
+    the stream is consumed, ``signatures`` holds those of the kept chunks, in order,
+    and ``aliases`` a (span, canonical) pair per dropped one. The span is its
+    (page_start, page_end, char_start, char_end) as a chunker.Chunk carries them (-1
+    where unknown); canonical is the KB chunk ID it duplicates, or ``-(1 + i)`` for
+    the i-th kept chunk of this document (its chunk ID is only known once the
+    document is appended).
+    """
+
+    def __init__(self, kb_signatures: Optional[np.ndarray] = None, threshold: float = THRESHOLD, hasher: Optional[MinHasher] = None, bands: int = BANDS, index: Optional[LSHIndex] = None):
+        self.hasher = hasher or MinHasher()
+        self.threshold = threshold
+        if index is None:
+            base = kb_signatures if kb_signatures is not None else np.zeros((0, self.hasher.num_perm), dtype=np.uint32)
+            index = LSHIndex(base, bands)
+        self.kb_chunks = len(index.base)
+        self.index = index
+        self.signatures: List[np.ndarray] = []
+        self.aliases: List[Tuple[Tuple[int, int, int, int], int]] = []
+        self.totals = {"chunks": 0, "within_document": 0, "across_kb": 0, "tokens_saved": 0}
+        self.seconds = 0.0
+
+    @classmethod
+    def for_kb(cls, kb_dir: Optional[str], chunk_count: int = 0, kb_path: Optional[str] = None) -> "Deduplicator":
+        """
+        A deduplicator checking against the KB in ``kb_dir`` (a directory holding its
+        files). Given the KB's ``kb_path``, the LSH table comes from the process's
+        LSHCache rather than being built afresh. A KB whose signatures are missing or
+        out of step with its chunks is only checked within the document until its next
+        append backfills them.
+        """
+        if kb_dir and kb_path:
+            return cls(index=get_lsh_cache().get(kb_path, kb_dir, chunk_count))
+        stored = open_signatures(kb_dir) if kb_dir else None
+        return cls(stored if stored is not None and len(stored) == chunk_count else None)
+
+    def _match(self, signature: np.ndarray) -> Optional[int]:
+        best, best_similarity = None, self.threshold
+        for id in self.index.candidates(signature):
+            similarity = float(np.mean(self.index.signature(id) == signature))
+            if similarity > best_similarity or (similarity == best_similarity and (best is None or id < best)):
+                best, best_similarity = id, similarity
+        return best
+
+    def filter(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Yield the chunks that are not near-duplicates of the KB's or of an earlier one in this stream."""
+        counter = default_token_counter()
+        for chunk in chunks:
+            started = time.perf_counter()
+            self.totals["chunks"] += 1
+            signature = self.hasher.signature(chunk)
+            match = self._match(signature)
+            if match is None:
+                self.index.add(signature)
+                self.signatures.append(signature)
+                self.seconds += time.perf_counter() - started
+                yield chunk
+                continue
+            span = cast(Tuple[int, int, int, int], tuple(int(getattr(chunk, name, -1)) for name in SPAN_FIELDS))
+            if match < self.kb_chunks:
+                self.totals["across_kb"] += 1
+                self.aliases.append((span, match))
+            else:
+                self.totals["within_document"] += 1
+                self.aliases.append((span, -(1 + match - self.kb_chunks)))
+            self.totals["tokens_saved"] += counter.count(chunk)
+            self.seconds += time.perf_counter() - started
+        observe_stage("dedup", self.seconds)
+        INGEST_CHUNKS.inc(self.totals["chunks"] - len(self.aliases), outcome="kept")
+        INGEST_CHUNKS.inc(len(self.aliases), outcome="duplicate")
+        DEDUP_TOKENS_SAVED.inc(self.totals["tokens_saved"])
+
+    def stats(self) -> Dict[str, Any]:
+        chunks = self.totals["chunks"]
+        duplicates = len(self.aliases)
+        return {
+            "chunks": chunks,
+            "kept": chunks - duplicates,
+            "duplicates": duplicates,
+            "within_document": self.totals["within_document"],
+            "across_kb": self.totals["across_kb"],
+            "duplicate_ratio": round(duplicates / chunks, 4) if chunks else 0.0,
+            # Chunks and tokens not sent to the embedding provider
+            "embeddings_saved": duplicates,
+            "tokens_saved": self.totals["tokens_saved"],
+            "seconds": round(self.seconds, 3),
+        }
+
+
+class LSHCache:
+    """
+    LSH tables over KBs' stored signatures, one per KB for its current generation.
+
+    Building one sorts every band of the KB's signatures, O(KB log KB); since a
+    published generation never changes, the table is built once and every job
+    appending to that generation gets a fork of it (the stored tables are shared,
+    each job adds its own document's signatures). Entries are validated against
+    the generation and its signatures file like KBCache's, so a newly published
+    generation replaces its KB's entry; least recently used KBs are dropped
+    beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = LSH_CACHE_ENTRIES, bands: int = BANDS):
+        self.max_entries = max(1, max_entries)
+        self.bands = bands
+        self._entries: "OrderedDict[str, Tuple[Tuple, LSHIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(kb_dir: str, chunk_count: int) -> Tuple:
+        try:
+            st = os.stat(signatures_path(kb_dir))
+        except FileNotFoundError:
+            return (kb_dir, chunk_count, None)
+        return (kb_dir, chunk_count, st.st_ino, st.st_mtime_ns)
+
+    def get(self, kb_path: str, kb_dir: str, chunk_count: int) -> LSHIndex:
+        """A fresh fork of the LSH table over the signatures of ``kb_dir``, the current generation of ``kb_path``."""
+        key = os.path.abspath(kb_path)
+        signature = self._signature(kb_dir, chunk_count)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1].fork()
+            self.misses += 1
+
+        # Built outside the lock; two jobs missing at once both build, and the later one is kept.
+        stored = open_signatures(kb_dir)
+        if stored is None or len(stored) != chunk_count:
+            stored = np.zeros((0, NUM_PERM), dtype=np.uint32)
+        index = LSHIndex(stored, self.bands)
+        with self._lock:
+            self._entries[key] = (signature, index)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index.fork()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+_shared_lsh_cache: Optional[LSHCache] = None
+_shared_lsh_lock = threading.Lock()
+
+
+def get_lsh_cache() -> LSHCache:
+    """The process-wide LSHCache."""
+    global _shared_lsh_cache
+    with _shared_lsh_lock:
+        if _shared_lsh_cache is None:
+            _shared_lsh_cache = LSHCache()
+        return _shared_lsh_cache
+
+
+def signatures_path(kb_path: str) -> str:
+    return os.path.join(kb_path, DEDUP_DIR, SIGNATURES_FILE)
+
+
+def open_signatures(kb_path: str, num_perm: int = NUM_PERM) -> Optional[np.ndarray]:
+    """Memory-map a KB's chunk signatures, or None if it has none (or they were made with another num_perm)."""
+    path = signatures_path(kb_path)
+    if not os.path.exists(path) or segmented_file.size(path) % (4 * num_perm):
+        return None
+    return segmented_file.open_array(path, np.uint32, (num_perm,))
+
+
+def signature_count(kb_path: str, num_perm: int = NUM_PERM) -> int:
+    return segmented_file.size(signatures_path(kb_path)) // (4 * num_perm)
+
+
+def append_signatures(kb_path: str, signatures: np.ndarray) -> None:
+    os.makedirs(os.path.join(kb_path, DEDUP_DIR), exist_ok=True)
+    segmented_file.append(signatures_path(kb_path), np.ascontiguousarray(signatures, dtype=np.uint32).tobytes())
+
+
+def truncate_signatures(kb_path: str, count: int, num_perm: int = NUM_PERM) -> None:
+    segmented_file.truncate(signatures_path(kb_path), count * 4 * num_perm)
+
+
+def backfill_signatures(kb_path: str, chunks_path: str, count: int, hasher: Optional[MinHasher] = None) -> None:
+    """Sign the first ``count`` chunks of a KB whose signatures are missing or out of step (once, O(KB))."""
+    if signature_count(kb_path) == count and open_signatures(kb_path) is not None:
+        return
+    os.makedirs(os.path.join(kb_path, DEDUP_DIR), exist_ok=True)
+    segmented_file.write(signatures_path(kb_path), b"")
+    if count and chunks_exist(chunks_path):
+        hasher = hasher or MinHasher()
+        store = open_chunks(chunks_path)
+        for start in range(0, count, 1024):
+            append_signatures(kb_path, hasher.signatures(store[i] for i in range(start, min(start + 1024, count))))
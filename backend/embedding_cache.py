@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_SETTINGS
+from embedding_providers import get_provider
+
+
+# SQLite caps the number of bound parameters per statement; stay well below it.
+_LOOKUP_BATCH = 500
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embedding vectors.
+
+    Vectors are keyed by (namespace, sha256(text)), where the namespace names the
+    embedding provider and model (see EmbeddingProvider.cache_namespace), so
+    switching models never serves a stale vector. Vectors are stored as raw float32 blobs in SQLite. Once the
+    stored payload exceeds ``max_bytes`` the least-recently-used rows are evicted.
+
+    The payload size is kept in the database by triggers, so every process
+    sharing the file (e.g. several API workers) evicts against the same total.
+    Lookups do not write: hits are buffered and their ``last_used`` times are
+    written with the next store, or at most every ``touch_flush_s`` seconds.
+    """
+
+    def __init__(self, path: str, namespace: str, max_bytes: int, touch_flush_s: float = 30.0):
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.touch_flush_s = touch_flush_s
+        self._lock = threading.Lock()
+        self._touched: Dict[bytes, float] = {}
+        self._touches_flushed_at = time.time()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "BEGIN IMMEDIATE;"
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " namespace TEXT NOT NULL,"
+            " text_hash BLOB NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (namespace, text_hash));"
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);"
+            "CREATE TABLE IF NOT EXISTS payload (id INTEGER PRIMARY KEY CHECK (id = 0), stored_bytes INTEGER NOT NULL);"
+            # Caches created before the total was kept start from their current size.
+            "INSERT OR IGNORE INTO payload VALUES (0, (SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings));"
+            "CREATE TRIGGER IF NOT EXISTS payload_insert AFTER INSERT ON embeddings BEGIN"
+            " UPDATE payload SET stored_bytes = stored_bytes + LENGTH(NEW.vector); END;"
+            "CREATE TRIGGER IF NOT EXISTS payload_update AFTER UPDATE OF vector ON embeddings BEGIN"
+            " UPDATE payload SET stored_bytes = stored_bytes + LENGTH(NEW.vector) - LENGTH(OLD.vector); END;"
+            "CREATE TRIGGER IF NOT EXISTS payload_delete AFTER DELETE ON embeddings BEGIN"
+            " UPDATE payload SET stored_bytes = stored_bytes - LENGTH(OLD.vector); END;"
+            "COMMIT;"
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up vectors for texts in bulk; missing entries come back as None."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE namespace = ? AND text_hash IN ({placeholders})",
+                    (self.namespace, *batch),
+                ).fetchall()
+                for h, blob in rows:
+                    found[bytes(h)] = np.frombuffer(blob, dtype=np.float32)
+            self._touched.update(dict.fromkeys(found, now))
+            if self._touched and now - self._touches_flushed_at >= self.touch_flush_s:
+                self._flush_touches()
+                self._conn.commit()
+            result = [found.get(h) for h in hashes]
+            hit_count = sum(1 for v in result if v is not None)
+            self.hits += hit_count
+            self.misses += len(result) - hit_count
+        return result
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store vectors for texts, then evict least-recently-used rows if over budget."""
+        if not texts:
+            return
+        now = time.time()
+        rows = []
+        for t, v in zip(texts, vectors):
+            arr = np.ascontiguousarray(v, dtype=np.float32)
+            rows.append((self.namespace, text_hash(t), arr.shape[0], arr.tobytes(), now))
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT INTO embeddings (namespace, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (namespace, text_hash) DO UPDATE SET dim = excluded.dim, vector = excluded.vector, last_used = excluded.last_used",
+                    rows,
+                )
+                self._flush_touches()
+                self._evict_to_budget()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _stored_bytes(self) -> int:
+        return int(self._conn.execute("SELECT stored_bytes FROM payload").fetchone()[0])
+
+    def _flush_touches(self) -> None:
+        """Write buffered last-used times of hits (rows evicted meanwhile are skipped)."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = MAX(last_used, ?) WHERE namespace = ? AND text_hash = ?",
+                [(used, self.namespace, h) for h, used in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touches_flushed_at = time.time()
+
+    def _evict_to_budget(self) -> None:
+        # Runs in the storing transaction, which holds the database's write lock.
+        excess = self._stored_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        freed = 0
+        for rowid, size in self._conn.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            victims.append((rowid,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", victims)
+        self.evictions += len(victims)
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Return embeddings for texts in order, calling embed_fn only for cache misses.
+        Repeated texts within one call are embedded once.
+        """
+        if not texts:
+            return []
+        cached = self.get_many(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        fresh: Dict[str, List[float]] = {}
+        if missing:
+            vectors = embed_fn(missing)
+            if len(vectors) != len(missing):
+                raise RuntimeError("Mismatch between number of inputs and embeddings returned.")
+            self.put_many(missing, vectors)
+            fresh = dict(zip(missing, vectors))
+        return [v.tolist() if v is not None else list(fresh[t]) for t, v in zip(texts, cached)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "path": self.path,
+                "namespace": self.namespace,
+                "entries": entries,
+                "stored_bytes": self._stored_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache, or None when disabled in config."""
+    global _shared_cache
+    if not EMBEDDING_CACHE_SETTINGS.get("enabled", True):
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache(
+                EMBEDDING_CACHE_SETTINGS.get("path", "data/embedding_cache.sqlite"),
+                namespace=get_provider().cache_namespace(),
+                max_bytes=int(EMBEDDING_CACHE_SETTINGS.get("max_size_mb", 512)) * 1024 * 1024,
+                touch_flush_s=float(EMBEDDING_CACHE_SETTINGS.get("touch_flush_s", 30)),
+            )
+        return _shared_cache
+
+
+def cached_embed(texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+    """Embed texts through the shared cache when enabled, otherwise call embed_fn directly."""
+    cache = get_embedding_cache()
+    if cache is None:
+        return embed_fn(texts)
+    return cache.embed(texts, embed_fn)
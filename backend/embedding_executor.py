@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_FAILURES, UPSTREAM_REQUESTS, UPSTREAM_RETRIES
+
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken, falling back to a ~4 chars/token estimate when unavailable."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            self._encoding = None
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return max(1, -(-len(text) // 4))
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        """Cut text into consecutive pieces of at most max_tokens tokens."""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            return [self._encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+        step = max(1, max_tokens * 4)
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+_default_counter: Optional[TokenCounter] = None
+
+
+def default_token_counter() -> TokenCounter:
+    """A process-wide TokenCounter (loading the tokenizer is not free)."""
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+
+def _retry_after_seconds(resp: requests.Response) -> Optional[float]:
+    """Parse Azure's retry-after-ms or the standard Retry-After header."""
+    ms = resp.headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingExecutor:
+    """
+    Runs embedding requests for ingestion with several batches in flight.
+
+    Texts are packed into contiguous batches bounded by a token budget (and an
+    item cap), each batch is posted over a pooled keep-alive session, and
+    results are reassembled in input order. 429s, 5xx responses, timeouts and
+    connection errors are retried with exponential backoff and jitter; a
+    server-provided Retry-After always takes precedence over the computed delay.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        max_concurrency: int = 4,
+        max_batch_tokens: int = 16000,
+        max_batch_items: int = 256,
+        max_retries: int = 6,
+        backoff_base_s: float = 1.0,
+        backoff_max_s: float = 60.0,
+        timeout_s: float = 30.0,
+    ):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.timeout_s = timeout_s
+        self.tokens = TokenCounter()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed")
+
+        self._lock = threading.Lock()
+        self.last_run: Dict[str, Any] = {}
+        self.totals = {"texts": 0, "tokens": 0, "batches": 0, "retries": 0, "failures": 0, "seconds": 0.0}
+
+    def make_batches(self, token_counts: List[int], max_batch_items: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Split texts into contiguous [start, end) ranges within the token and item budgets."""
+        max_items = max_batch_items or self.max_batch_items
+        batches: List[Tuple[int, int]] = []
+        start, batch_tokens = 0, 0
+        for i, n in enumerate(token_counts):
+            if i > start and (batch_tokens + n > self.max_batch_tokens or i - start >= max_items):
+                batches.append((start, i))
+                start, batch_tokens = i, 0
+            batch_tokens += n
+        if start < len(token_counts):
+            batches.append((start, len(token_counts)))
+        return batches
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max_s)
+        delay = self.backoff_base_s * (2 ** attempt)
+        return min(delay, self.backoff_max_s) * random.uniform(0.5, 1.0)
+
+    def _post_batch(self, batch: List[str], timeout: float) -> Tuple[List[List[float]], int]:
+        """Post one batch, retrying transient failures. Returns (embeddings, retries used)."""
+        headers = {"Content-Type": "application/json", "api-key": self.api_key}
+        attempt = 0
+        UPSTREAM_REQUESTS.inc(service="embeddings")
+        while True:
+            retry_after = None
+            try:
+                resp = self._session.post(self.endpoint, headers=headers, json={"input": batch}, timeout=timeout)
+                if resp.status_code not in RETRY_STATUS:
+                    if resp.status_code >= 400:
+                        UPSTREAM_FAILURES.inc(service="embeddings")
+                    resp.raise_for_status()
+                    data_items = sorted(resp.json().get("data", []), key=lambda x: x.get("index", 0))
+                    embeddings = [item["embedding"] for item in data_items]
+                    if len(embeddings) != len(batch):
+                        UPSTREAM_FAILURES.inc(service="embeddings")
+                        raise RuntimeError("Mismatch between number of inputs and embeddings returned.")
+                    return embeddings, attempt
+                retry_after = _retry_after_seconds(resp)
+                error: Exception = requests.HTTPError(f"{resp.status_code} from embeddings endpoint", response=resp)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+            if attempt >= self.max_retries:
+                UPSTREAM_FAILURES.inc(service="embeddings")
+                raise error
+            delay = self._backoff(attempt, retry_after)
+            print(f"Embedding batch of {len(batch)} failed ({error}); retrying in {delay:.1f}s")
+            UPSTREAM_RETRIES.inc(service="embeddings")
+            time.sleep(delay)
+            attempt += 1
+
+    def embed(self, texts: List[str], max_batch_items: Optional[int] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        """Embed texts concurrently, preserving input order."""
+        if not texts:
+            return []
+        started = time.perf_counter()
+        token_counts = [self.tokens.count(t) for t in texts]
+        batches = self.make_batches(token_counts, max_batch_items)
+        futures = [
+            self._pool.submit(self._post_batch, texts[s:e], timeout or self.timeout_s)
+            for s, e in batches
+        ]
+
+        embeddings: List[List[float]] = []
+        retries = 0
+        try:
+            for future in futures:
+                batch_embeddings, batch_retries = future.result()
+                embeddings.extend(batch_embeddings)
+                retries += batch_retries
+        except Exception:
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self.totals["failures"] += 1
+            raise
+
+        elapsed = time.perf_counter() - started
+        total_tokens = sum(token_counts)
+        run = {
+            "texts": len(texts),
+            "tokens": total_tokens,
+            "batches": len(batches),
+            "retries": retries,
+            "seconds": round(elapsed, 3),
+            "texts_per_s": round(len(texts) / elapsed, 2) if elapsed else 0.0,
+            "tokens_per_s": round(total_tokens / elapsed, 2) if elapsed else 0.0,
+            "concurrency": self.max_concurrency,
+        }
+        with self._lock:
+            self.last_run = run
+            for key in ("texts", "tokens", "batches", "retries"):
+                self.totals[key] += run[key]
+            self.totals["seconds"] += elapsed
+        print(
+            f"Embedded {run['texts']} texts ({run['tokens']} tokens) in {run['batches']} batches: "
+            f"{run['texts_per_s']} texts/s, {run['tokens_per_s']} tokens/s, {retries} retries"
+        )
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            seconds = self.totals["seconds"]
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_batch_tokens": self.max_batch_tokens,
+                "max_batch_items": self.max_batch_items,
+                "totals": {
+                    **self.totals,
+                    "seconds": round(seconds, 3),
+                    "texts_per_s": round(self.totals["texts"] / seconds, 2) if seconds else 0.0,
+                    "tokens_per_s": round(self.totals["tokens"] / seconds, 2) if seconds else 0.0,
+                },
+                "last_run": dict(self.last_run),
+            }
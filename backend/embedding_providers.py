@@ -0,0 +1,229 @@
+"""
+Embedding providers.
+
+Ingestion and search both embed through the one provider named by
+azure.openai.embedding.provider:
+
+  azure    the Azure OpenAI embeddings deployment. Ingestion batches go through the
+           concurrent EmbeddingExecutor (REST); queries go through the shared SDK client.
+  hashing  local CPU feature hashing of word n-grams: signed, log-scaled counts folded
+           into ``dim`` buckets and L2-normalised, computed for a whole batch at once.
+           No network and no model files, so it also runs air-gapped.
+
+A KB records the provider, model and dimension that built it (metadata["embedding"]);
+check_compatible() rejects appending to or searching such a KB with another one,
+since vectors from different models are not comparable.
+"""
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from clients import API_BASE, API_KEY, API_VERSION, azure_openai_client
+from config import EMBEDDING_EXECUTOR_SETTINGS, EMBEDDING_SETTINGS
+from embedding_executor import EmbeddingExecutor
+from metrics import UPSTREAM_FAILURES, UPSTREAM_REQUESTS, UPSTREAM_RETRIES
+
+
+PROVIDERS = ("azure", "hashing")
+
+
+class EmbeddingMismatchError(ValueError):
+    """A KB's vectors were built by a different embedding provider, model or dimension."""
+
+
+class EmbeddingProvider:
+    name = ""
+
+    def identity(self) -> Dict[str, Any]:
+        """What a KB records about the embeddings it was built with (dim None when only known after a call)."""
+        raise NotImplementedError
+
+    def cache_namespace(self) -> str:
+        """Embedding-cache namespace: vectors are only shared between identical providers."""
+        identity = self.identity()
+        return f"{identity['provider']}:{identity['model']}:{identity['dim']}"
+
+    def embed_documents(self, texts: List[str], max_batch_items: Optional[int] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        """Embed chunks for ingestion (throughput-oriented)."""
+        raise NotImplementedError
+
+    def embed_queries(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        """Embed search queries (latency-oriented)."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    name = "azure"
+
+    def __init__(self):
+        self.deployment = EMBEDDING_SETTINGS["deployment_name"]
+        self.api_version = EMBEDDING_SETTINGS.get("api_version") or API_VERSION
+        self.executor = EmbeddingExecutor(
+            f"{API_BASE}/openai/deployments/{self.deployment}/embeddings?api-version={self.api_version}",
+            API_KEY,
+            max_concurrency=int(EMBEDDING_EXECUTOR_SETTINGS.get("max_concurrency", 4)),
+            max_batch_tokens=int(EMBEDDING_EXECUTOR_SETTINGS.get("max_batch_tokens", 16000)),
+            max_batch_items=int(EMBEDDING_EXECUTOR_SETTINGS.get("max_batch_items", 256)),
+            max_retries=int(EMBEDDING_EXECUTOR_SETTINGS.get("max_retries", 6)),
+            backoff_base_s=float(EMBEDDING_EXECUTOR_SETTINGS.get("backoff_base_s", 1.0)),
+            backoff_max_s=float(EMBEDDING_EXECUTOR_SETTINGS.get("backoff_max_s", 60.0)),
+            timeout_s=float(EMBEDDING_EXECUTOR_SETTINGS.get("timeout_s", 30.0)),
+        )
+
+    def identity(self) -> Dict[str, Any]:
+        return {"provider": self.name, "model": EMBEDDING_SETTINGS.get("model") or self.deployment, "dim": None}
+
+    def cache_namespace(self) -> str:
+        # Unchanged from before providers existed, so existing cache entries stay valid.
+        return f"{self.deployment or ''}:{EMBEDDING_SETTINGS.get('model') or ''}"
+
+    def embed_documents(self, texts: List[str], max_batch_items: Optional[int] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        return self.executor.embed(texts, max_batch_items=max_batch_items, timeout=timeout)
+
+    def embed_queries(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            UPSTREAM_REQUESTS.inc(service="embeddings")
+            try:
+                raw = azure_openai_client(self.api_version).embeddings.with_raw_response.create(model=self.deployment, input=batch)
+            except Exception:
+                UPSTREAM_FAILURES.inc(service="embeddings")
+                raise
+            # The SDK retries transient errors itself; count them alongside the ingestion executor's.
+            if raw.retries_taken:
+                UPSTREAM_RETRIES.inc(raw.retries_taken, service="embeddings")
+            vectors.extend(d.embedding for d in raw.parse().data)
+        return vectors
+
+    def stats(self) -> Dict[str, Any]:
+        return self.executor.stats()
+
+
+_WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1 << 18)
+def _feature_hash(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Feature hashing over lowercased word n-grams (``ngram_range``, default unigrams and
+    bigrams). Each feature adds +-1 to bucket crc32(feature) % dim, the sign taken
+    from the hash's top bit so collisions tend to cancel; counts are log-scaled
+    (sublinear term frequency) and rows L2-normalised, so L2 distance ranks like
+    cosine similarity. Whole batches are accumulated with one bincount.
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024, ngram_range: Sequence[int] = (1, 2)):
+        self.dim = int(dim)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self._lock = threading.Lock()
+        self.totals = {"texts": 0, "seconds": 0.0}
+
+    def identity(self) -> Dict[str, Any]:
+        low, high = self.ngram_range
+        return {"provider": self.name, "model": f"hashing-{low}-{high}gram", "dim": self.dim}
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        low, high = self.ngram_range
+        features = []
+        for n in range(low, high + 1):
+            features.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        started = time.perf_counter()
+        rows: List[int] = []
+        hashes: List[int] = []
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            rows.extend([row] * len(features))
+            hashes.extend(_feature_hash(f) for f in features)
+        h = np.asarray(hashes, dtype=np.uint32)
+        signs = np.where(h >> 31, -1.0, 1.0)
+        slots = np.asarray(rows, dtype=np.int64) * self.dim + (h % self.dim).astype(np.int64)
+        counts = np.bincount(slots, weights=signs, minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        vectors = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+        with self._lock:
+            self.totals["texts"] += len(texts)
+            self.totals["seconds"] += time.perf_counter() - started
+        return vectors
+
+    def embed_documents(self, texts: List[str], max_batch_items: Optional[int] = None, timeout: Optional[float] = None) -> List[List[float]]:
+        return self.embed(texts).tolist()
+
+    def embed_queries(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
+        return self.embed(texts).tolist()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            seconds = self.totals["seconds"]
+            return {
+                "dim": self.dim,
+                "totals": {
+                    "texts": self.totals["texts"],
+                    "seconds": round(seconds, 3),
+                    "texts_per_s": round(self.totals["texts"] / seconds, 2) if seconds else 0.0,
+                },
+            }
+
+
+_provider: Optional[EmbeddingProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> EmbeddingProvider:
+    """The process-wide provider selected by azure.openai.embedding.provider."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            name = EMBEDDING_SETTINGS.get("provider") or "azure"
+            if name == "azure":
+                _provider = AzureEmbeddingProvider()
+            elif name == "hashing":
+                hashing = EMBEDDING_SETTINGS.get("hashing") or {}
+                _provider = HashingEmbeddingProvider(int(hashing.get("dim", 1024)), hashing.get("ngram_range") or (1, 2))
+            else:
+                raise ValueError(f"Unknown embedding provider '{name}'; expected one of {PROVIDERS}.")
+        return _provider
+
+
+def kb_embedding(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """The embeddings a KB was built with. KBs from before this was recorded were all built on Azure."""
+    return metadata.get("embedding") or {"provider": "azure", "model": None, "dim": None}
+
+
+def check_compatible(metadata: Dict[str, Any], dim: Optional[int] = None) -> None:
+    """
+    Raise EmbeddingMismatchError unless the current provider produces vectors comparable
+    with the KB's: same provider and model, and the same dimension as the KB (``dim``,
+    e.g. its index's) where both are known. Unrecorded details are not held against it.
+    """
+    built = kb_embedding(metadata)
+    current = get_provider().identity()
+    kb_dim = built.get("dim") or dim
+    mismatched = (
+        built.get("provider") != current["provider"]
+        or (built.get("model") is not None and built.get("model") != current["model"])
+        or (kb_dim is not None and current["dim"] is not None and int(kb_dim) != int(current["dim"]))
+    )
+    if mismatched:
+        raise EmbeddingMismatchError(
+            f"KB was embedded with {built.get('provider')} ({built.get('model') or 'unknown model'}, dim {kb_dim or 'unknown'}) "
+            f"but this server embeds with {current['provider']} ({current['model']}, dim {current['dim'] or 'unknown'})."
+        )
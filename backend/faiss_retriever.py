@@ -1,43 +1,47 @@
 import argparse
 import json
 import os
-from typing import List, Tuple, Any, cast
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple, Any, cast
 
 import faiss
+import httpx
 import numpy as np
 import requests
-from openai import AzureOpenAI
 
-from config import CONFIG, LLM_SETTINGS, EMBEDDING_SETTINGS
+from config import LLM_SETTINGS, BM25_SETTINGS, RETRIEVAL_SETTINGS
+from clients import API_BASE, API_KEY, API_VERSION
+from embedding_providers import get_provider
+from embedding_cache import cached_embed
+from query_batcher import get_query_batcher
+from chunk_store import chunks_exist, open_chunks
+from ann_index import open_vectors, read_index, search_params, vectors_path
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from context_assembly import assemble_context
+from metrics import UPSTREAM_FAILURES, UPSTREAM_REQUESTS, UPSTREAM_RETRIES, stage
 
 
-API_BASE = CONFIG["azure"]["openai"]["api_base"].rstrip("/")
-API_KEY = os.getenv("AZURE_OPENAI_API_KEY", CONFIG["azure"]["openai"]["api_key"])  
-API_VERSION = CONFIG["azure"]["openai"]["api_version"]
 CHAT_API_VERSION = LLM_SETTINGS.get("api_version", API_VERSION)
 
 LLM_DEPLOYMENT = LLM_SETTINGS["deployment_name"]
 LLM_TEMPERATURE = LLM_SETTINGS.get("temperature", 0.2)
 LLM_MAX_TOKENS = LLM_SETTINGS.get("max_tokens", 1024)
+LLM_TIMEOUT = float(LLM_SETTINGS.get("request_timeout_s", 60))
+LLM_MAX_CONNECTIONS = int(LLM_SETTINGS.get("max_connections", 100))
+LLM_MAX_KEEPALIVE = int(LLM_SETTINGS.get("max_keepalive_connections", 20))
 
-EMBED_DEPLOYMENT = EMBEDDING_SETTINGS["deployment_name"]
-EMBED_API_VERSION = EMBEDDING_SETTINGS.get("api_version", API_VERSION)
 
-client = AzureOpenAI(
-    azure_endpoint=API_BASE,
-    api_key=API_KEY,
-    api_version=EMBED_API_VERSION,
-)
-
-
-def load_index_and_chunks(index_path: str, chunks_path: str) -> Tuple[faiss.Index, List[str]]:
-    if not os.path.exists(index_path) or not os.path.exists(chunks_path):
+def load_index_and_chunks(index_path: str, chunks_path: str) -> Tuple[faiss.Index, Sequence[str]]:
+    if not os.path.exists(index_path) or not chunks_exist(chunks_path):
         raise FileNotFoundError(
             f"Missing index or chunks file. Expected: {index_path} and {chunks_path}."
         )
-    index = faiss.read_index(index_path)
-    with open(chunks_path, "r", encoding="utf-8") as f:
-        chunks: List[str] = json.load(f)
+    index = read_index(index_path)
+    chunks = open_chunks(chunks_path)
     return index, chunks
 
 
@@ -50,52 +54,155 @@ def load_metadata(metadata_path: str) -> dict:
         return {}
 
 
-def list_all_indices(base_dir: str = "indices") -> List[dict]:
-    """List all available indices in the base directory."""
-    indices = []
-    if not os.path.exists(base_dir):
-        return indices
-    
-    for name in os.listdir(base_dir):
-        path = os.path.join(base_dir, name)
-        if os.path.isdir(path):
-            metadata_file = os.path.join(path, "metadata.json")
-            
-            # Accept indices with metadata.json (even if index files not yet created)
-            if os.path.exists(metadata_file):
-                metadata = load_metadata(metadata_file)
-                indices.append({
-                    "name": name,
-                    "ntotal": metadata.get("ntotal", 0),
-                    "chunk_count": metadata.get("chunk_count", 0),
-                    "files": metadata.get("files", []),
-                    "created_at": metadata.get("created_at", "unknown")
-                })
-    
-    return sorted(indices, key=lambda x: x["name"])
+def _embed_queries(texts: List[str], batch_size: int) -> List[List[float]]:
+    batcher = get_query_batcher()
+    if batcher is None:
+        return get_provider().embed_queries(texts, batch_size=batch_size)
+    # Concurrent requests' queries share one embeddings call.
+    return batcher.embed(texts)
 
 
 def embed_texts(texts: List[str], batch_size: int = 32) -> List[List[float]]:
-    if not texts:
-        return []
-    all_vecs: List[List[float]] = []
-    for start in range(0, len(texts), batch_size):
-        batch = texts[start : start + batch_size]
-        resp = client.embeddings.create(model=EMBED_DEPLOYMENT, input=batch)
-        all_vecs.extend([d.embedding for d in resp.data])
-    return all_vecs
+    with stage("embed"):
+        return cached_embed(texts, lambda missing: _embed_queries(missing, batch_size))
+
+
+def embed_query(query: str) -> np.ndarray:
+    """Embed a single query as a (1, dim) float32 array ready for FAISS."""
+    return np.ascontiguousarray([embed_texts([query])[0]], dtype=np.float32)
 
 
-def search_faiss(index: faiss.Index, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
-    if index.ntotal == 0:
+def search_faiss(index: faiss.Index, query: str, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, query_vector: Optional[np.ndarray] = None, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embed the query and search the index; nprobe/ef_search override the configured IVF/HNSW knobs.
+    Pass ``query_vector`` (from embed_query) to reuse an embedding across several indices, and
+    ``allowed`` (a boolean mask by chunk ID, see provenance) to search only those chunks.
+    """
+    if index.ntotal == 0 or (allowed is not None and not allowed.any()):
         return np.array([]), np.array([[]], dtype=int)
-    q_vec = embed_texts([query])[0]
-    q_np = np.ascontiguousarray([q_vec], dtype=np.float32)
+    q_np = query_vector if query_vector is not None else embed_query(query)
     k = max(1, min(k, index.ntotal))
-    D, I = cast(Any, index).search(q_np, k)
+    with stage("search"):
+        D, I = cast(Any, index).search(q_np, k, params=search_params(index, nprobe=nprobe, ef_search=ef_search, allowed=allowed))
     return D, I
 
 
+def search_faiss_batch(index: faiss.Index, queries: List[str], k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, batch_size: int = 256, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Embed queries in large batches and run one matrix search per batch. Returns (D, I) with one row per query."""
+    if index.ntotal == 0 or not queries or (allowed is not None and not allowed.any()):
+        return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+    k = max(1, min(k, index.ntotal))
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search, allowed=allowed)
+    D_parts, I_parts = [], []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        q_np = np.ascontiguousarray(embed_texts(batch, batch_size=batch_size), dtype=np.float32)
+        with stage("search"):
+            D, I = cast(Any, index).search(q_np, k, params=params)
+        D_parts.append(D)
+        I_parts.append(I)
+    return np.vstack(D_parts), np.vstack(I_parts)
+
+
+def _hybrid_enabled(lexical: Optional[BM25Index]) -> bool:
+    return RETRIEVAL_SETTINGS.get("mode") == "hybrid" and lexical is not None and BM25_SETTINGS.get("enabled", True)
+
+
+def _fuse(vector_ids: np.ndarray, lexical: BM25Index, query: str, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    candidates = max(k, int(BM25_SETTINGS.get("candidates", 50)))
+    weights = RETRIEVAL_SETTINGS.get("weights") or {}
+    with stage("lexical"):
+        _, lexical_ids = lexical.search(query, candidates, allowed=allowed)
+        return reciprocal_rank_fusion(
+            [vector_ids, lexical_ids],
+            [float(weights.get("dense", 0.5)), float(weights.get("sparse", 0.5))],
+            k,
+            rrf_k=int(BM25_SETTINGS.get("rrf_k", 60)),
+        )
+
+
+def hybrid_search(index: faiss.Index, lexical: Optional[BM25Index], query: str, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, query_vector: Optional[np.ndarray] = None, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse vector and BM25 candidates with weighted reciprocal-rank fusion.
+    Falls back to vector-only search when retrieval.mode is not 'hybrid' or the KB has no lexical index.
+    Both retrievers honour ``allowed`` (see search_faiss).
+    Returns (scores, ids) shaped like a single-query FAISS search; scores are distances when vector-only.
+    """
+    if not _hybrid_enabled(lexical):
+        return search_faiss(index, query, k, nprobe=nprobe, ef_search=ef_search, query_vector=query_vector, allowed=allowed)
+    candidates = max(k, int(BM25_SETTINGS.get("candidates", 50)))
+    _, I = search_faiss(index, query, candidates, nprobe=nprobe, ef_search=ef_search, query_vector=query_vector, allowed=allowed)
+    scores, ids = _fuse(I[0] if I.size else np.zeros(0, dtype=np.int64), cast(BM25Index, lexical), query, k, allowed)
+    return scores[None, :], ids[None, :]
+
+
+def hybrid_search_batch(index: faiss.Index, lexical: Optional[BM25Index], queries: List[str], k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, batch_size: int = 256, allowed: Optional[np.ndarray] = None) -> Tuple[List[np.ndarray], List[np.ndarray], str]:
+    """
+    Batched counterpart of hybrid_search: one matrix FAISS search per embedding batch,
+    then per-query fusion with BM25 when hybrid retrieval is on.
+    Returns (scores per query, ids per query, score type: 'l2_distance' or 'rrf').
+    """
+    if not _hybrid_enabled(lexical):
+        D, I = search_faiss_batch(index, queries, k, nprobe=nprobe, ef_search=ef_search, batch_size=batch_size, allowed=allowed)
+        return list(D), list(I), "l2_distance"
+    candidates = max(k, int(BM25_SETTINGS.get("candidates", 50)))
+    _, I = search_faiss_batch(index, queries, candidates, nprobe=nprobe, ef_search=ef_search, batch_size=batch_size, allowed=allowed)
+    fused = [_fuse(row, cast(BM25Index, lexical), q, k, allowed) for q, row in zip(queries, I)]
+    return [s for s, _ in fused], [i for _, i in fused], "rrf"
+
+
+def normalize_scores(scores: np.ndarray, score_type: str) -> np.ndarray:
+    """
+    Map one KB's result scores onto a shared (0, 1] scale, higher is better.
+    RRF scores are divided by the best possible fused score (rank 1 in both lists),
+    so a KB whose top hit only matched one retriever stays below one that matched both;
+    L2 distances become 1 / (1 + d). Unlike min-max scaling, a KB with nothing relevant
+    does not get a perfect top hit.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    if score_type == "rrf":
+        weights = RETRIEVAL_SETTINGS.get("weights") or {}
+        best = (float(weights.get("dense", 0.5)) + float(weights.get("sparse", 0.5))) / (int(BM25_SETTINGS.get("rrf_k", 60)) + 1)
+        return scores / best
+    return 1.0 / (1.0 + np.maximum(scores, 0.0))
+
+
+def federated_search(sources: Sequence[Tuple[str, faiss.Index, Optional[BM25Index]]], query: str, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, max_workers: int = 8, query_vector: Optional[np.ndarray] = None, allowed: Optional[Dict[str, np.ndarray]] = None) -> List[Tuple[str, int, float]]:
+    """
+    Search several KBs for one query. The query is embedded once and every
+    (kb_id, index, lexical) source is searched in parallel, restricted to
+    ``allowed[kb_id]`` when given; each KB's scores are normalized with
+    normalize_scores (a KB may be vector-only or hybrid) and the union is cut to
+    a global top-k.
+    Returns (kb_id, chunk_id, normalized score) tuples, best first.
+    """
+    if not sources:
+        return []
+    if query_vector is None:
+        query_vector = embed_query(query)
+
+    def search_one(source: Tuple[str, faiss.Index, Optional[BM25Index]]) -> List[Tuple[str, int, float]]:
+        kb_id, index, lexical = source
+        D, I = hybrid_search(index, lexical, query, k, nprobe=nprobe, ef_search=ef_search, query_vector=query_vector,
+                             allowed=(allowed or {}).get(kb_id))
+        if not I.size or not len(I[0]):
+            return []
+        keep = I[0] >= 0
+        scores = normalize_scores(D[0][keep], "rrf" if _hybrid_enabled(lexical) else "l2_distance")
+        return [(kb_id, int(i), float(s)) for i, s in zip(I[0][keep], scores)]
+
+    # Each search runs in a copy of the caller's context so its stage timings reach the request's breakdown.
+    contexts = [copy_context() for _ in sources]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as pool:
+        per_kb = list(pool.map(lambda ctx, source: ctx.run(search_one, source), contexts, sources))
+    # Ties keep each KB's own rank order, then the order KBs were requested in.
+    merged = sorted(
+        (hit + (rank,) for hits in per_kb for rank, hit in enumerate(hits)),
+        key=lambda h: (-h[2], h[3]),
+    )
+    return [(kb_id, chunk_id, score) for kb_id, chunk_id, score, _ in merged[:k]]
+
+
 def build_prompt(query: str, contexts: List[str]) -> list:
     context_text = "\n\n---\n\n".join(contexts)
     system_msg = (
@@ -112,17 +219,22 @@ def build_prompt(query: str, contexts: List[str]) -> list:
     ]
 
 
-def generate_answer(query: str, retrieved_chunks: List[str]) -> str:
-    context_text = "\n\n---\n\n".join(retrieved_chunks)
-    user_content = f"Context:\n{context_text}\n\nQuestion: {query}"
+def _chat_url() -> str:
+    return f"{API_BASE}/openai/deployments/{LLM_DEPLOYMENT}/chat/completions?api-version={CHAT_API_VERSION}"
+
 
-    url = f"{API_BASE}/openai/deployments/{LLM_DEPLOYMENT}/chat/completions?api-version={CHAT_API_VERSION}"
-    headers = {
+def _chat_headers() -> dict:
+    return {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {API_KEY}",
         "api-key": API_KEY,
     }
-    payload = {
+
+
+def _answer_payload(query: str, retrieved_chunks: List[str]) -> dict:
+    context_text = "\n\n---\n\n".join(retrieved_chunks)
+    user_content = f"Context:\n{context_text}\n\nQuestion: {query}"
+    return {
         "messages": [
             {
                 "role": "user",
@@ -132,38 +244,187 @@ def generate_answer(query: str, retrieved_chunks: List[str]) -> str:
         "max_completion_tokens": LLM_MAX_TOKENS,
         "model": LLM_SETTINGS.get("model", LLM_DEPLOYMENT),
     }
-    resp = requests.post(url, headers=headers, json=payload, timeout=60)
-    if resp.status_code == 404:
-        print(
-            f"Chat deployment '{LLM_DEPLOYMENT}' not found at {API_BASE}. "
-            "Verify the exact deployment name in Azure Portal > OpenAI > Deployments and update config.yaml."
+
+
+def _fallback_payload(query: str, retrieved_chunks: List[str]) -> dict:
+    return {
+        "messages": build_prompt(query, retrieved_chunks),
+        "max_tokens": LLM_MAX_TOKENS,
+        "model": LLM_SETTINGS.get("model", LLM_DEPLOYMENT),
+        "temperature": LLM_TEMPERATURE,
+    }
+
+
+@contextmanager
+def _chat_call() -> Iterator[None]:
+    """Count one chat call, and a failure if it raises; a fallback-payload retry is counted where it is made."""
+    UPSTREAM_REQUESTS.inc(service="chat")
+    try:
+        yield
+    except Exception:
+        UPSTREAM_FAILURES.inc(service="chat")
+        raise
+
+
+def _report_missing_deployment() -> None:
+    print(
+        f"Chat deployment '{LLM_DEPLOYMENT}' not found at {API_BASE}. "
+        "Verify the exact deployment name in Azure Portal > OpenAI > Deployments and update config.yaml."
+    )
+
+
+def generate_answer(query: str, retrieved_chunks: List[str]) -> str:
+    with stage("generate"), _chat_call():
+        url = _chat_url()
+        headers = _chat_headers()
+        payload = _answer_payload(query, retrieved_chunks)
+        resp = requests.post(url, headers=headers, json=payload, timeout=60)
+        if resp.status_code == 404:
+            _report_missing_deployment()
+            resp.raise_for_status()
+        if resp.status_code >= 400:
+            UPSTREAM_RETRIES.inc(service="chat")
+            fallback_payload = _fallback_payload(query, retrieved_chunks)
+            resp = requests.post(url, headers=headers, json=fallback_payload, timeout=60)
+            if resp.status_code >= 400:
+                try:
+                    print(f"LLM request failed: {resp.status_code} {resp.text}")
+                except Exception:
+                    pass
+                resp.raise_for_status()
+        data = resp.json()
+    return (data.get("choices", [{}])[0].get("message", {}).get("content") or "").strip()
+
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive client used by the async chat path."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
         )
-        resp.raise_for_status()
-    if resp.status_code >= 400:
-        fallback_messages = build_prompt(query, retrieved_chunks)
-        fallback_payload = {
-            "messages": fallback_messages,
-            "max_tokens": LLM_MAX_TOKENS,
-            "model": LLM_SETTINGS.get("model", LLM_DEPLOYMENT),
-            "temperature": LLM_TEMPERATURE,
-        }
-        resp = requests.post(url, headers=headers, json=fallback_payload, timeout=60)
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def agenerate_answer(query: str, retrieved_chunks: List[str]) -> str:
+    """Async variant of generate_answer on the shared client."""
+    client = get_async_client()
+    url = _chat_url()
+    headers = _chat_headers()
+    with stage("generate"), _chat_call():
+        resp = await client.post(url, headers=headers, json=_answer_payload(query, retrieved_chunks))
+        if resp.status_code == 404:
+            _report_missing_deployment()
+            resp.raise_for_status()
         if resp.status_code >= 400:
-            try:
+            UPSTREAM_RETRIES.inc(service="chat")
+            resp = await client.post(url, headers=headers, json=_fallback_payload(query, retrieved_chunks))
+            if resp.status_code >= 400:
                 print(f"LLM request failed: {resp.status_code} {resp.text}")
-            except Exception:
-                pass
-            resp.raise_for_status()
-    data = resp.json()
+                resp.raise_for_status()
+        data = resp.json()
     return (data.get("choices", [{}])[0].get("message", {}).get("content") or "").strip()
 
 
+async def astream_answer(query: str, retrieved_chunks: List[str]) -> AsyncIterator[str]:
+    """Stream answer tokens from the chat deployment as they arrive."""
+    client = get_async_client()
+    url = _chat_url()
+    headers = _chat_headers()
+    attempts = [_answer_payload(query, retrieved_chunks), _fallback_payload(query, retrieved_chunks)]
+    # The generate stage spans the whole stream, including time the consumer spends between tokens.
+    with stage("generate"), _chat_call():
+        for attempt, payload in enumerate(attempts):
+            if attempt:
+                UPSTREAM_RETRIES.inc(service="chat")
+            async with client.stream("POST", url, headers=headers, json={**payload, "stream": True}) as resp:
+                if resp.status_code >= 400:
+                    await resp.aread()
+                    if resp.status_code == 404:
+                        _report_missing_deployment()
+                        resp.raise_for_status()
+                    if attempt == len(attempts) - 1:
+                        print(f"LLM request failed: {resp.status_code} {resp.text}")
+                        resp.raise_for_status()
+                    continue
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    choices = json.loads(data).get("choices") or []
+                    if not choices:
+                        continue
+                    token = (choices[0].get("delta") or {}).get("content")
+                    if token:
+                        yield token
+                return
+
+
+def run_batch(index: faiss.Index, chunks: Sequence[str], args: argparse.Namespace) -> None:
+    """Retrieve (and optionally answer) every query in a JSONL file."""
+    with open(args.queries_file, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    queries = [r.get("query") or r.get("question") or "" for r in records]
+    lexical = BM25Index.load(os.path.dirname(args.index) or ".")
+    started = time.perf_counter()
+    scores, ids, score_type = hybrid_search_batch(index, lexical, queries, args.top_k, batch_size=args.batch_size)
+    search_s = time.perf_counter() - started
+
+    answers: List[Optional[str]] = [None] * len(queries)
+    if args.generate:
+        def answer(i: int) -> str:
+            retrieved = [chunks[int(j)] for j in ids[i] if 0 <= j < len(chunks)]
+            return generate_answer(queries[i], retrieved) if retrieved else ""
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+            answers = list(pool.map(answer, range(len(queries))))
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for i, record in enumerate(records):
+            result = {
+                "id": record.get("id", i),
+                "query": queries[i],
+                "ids": [int(j) for j in ids[i] if j >= 0],
+                "scores": [float(s) for s, j in zip(scores[i], ids[i]) if j >= 0],
+                "score_type": score_type,
+                "previews": [chunks[int(j)][:80].replace("\n", " ") for j in ids[i] if 0 <= j < len(chunks)],
+            }
+            if args.generate:
+                result["answer"] = answers[i]
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Searched {len(queries)} queries in {search_s:.2f}s ({len(queries) / max(search_s, 1e-9):.1f} queries/s)", file=sys.stderr)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="FAISS RAG retriever using Azure OpenAI")
     parser.add_argument("--index", default="index.faiss", help="Path to FAISS index file")
-    parser.add_argument("--chunks", default="chunks.json", help="Path to chunks JSON file")
+    parser.add_argument("--chunks", default="chunks.bin", help="Path to chunk store (or legacy chunks JSON file)")
     parser.add_argument("--top-k", type=int, default=3, help="Number of chunks to retrieve")
     parser.add_argument("--query", type=str, default=None, help="Single query to run. If omitted, enters REPL mode.")
+    parser.add_argument("--queries-file", type=str, default=None, help="JSONL file of queries ({\"query\": ..., optional \"id\"}) to run as a batch")
+    parser.add_argument("--output", type=str, default=None, help="Write batch results as JSONL here instead of stdout")
+    parser.add_argument("--batch-size", type=int, default=256, help="Queries embedded and searched per batch")
+    parser.add_argument("--generate", action="store_true", help="Also generate an answer per query in batch mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent answer generations in batch mode")
     args = parser.parse_args()
 
     try:
@@ -173,16 +434,26 @@ def main() -> None:
         print("Ingest a document first (see md_rag.py) to create the index and chunks files.")
         return
 
+    vectors: Optional[np.ndarray] = open_vectors(vectors_path(args.index), index.d)
+    if vectors is not None and len(vectors) != index.ntotal:
+        vectors = None
+    lexical = BM25Index.load(os.path.dirname(args.index) or ".")
+
     def run_query(q: str):
-        _, I = search_faiss(index, q, args.top_k)
+        query_vector = embed_query(q)
+        _, I = hybrid_search(index, lexical, q, args.top_k, query_vector=query_vector)
         if I.size == 0:
             print("No results in index.")
             return
-        retrieved = [chunks[i] for i in I[0] if i >= 0 and i < len(chunks)]
-        answer = generate_answer(q, retrieved)
+        ids = [int(i) for i in I[0] if i >= 0 and i < len(chunks)]
+        context = assemble_context([chunks[i] for i in ids], vectors[ids] if vectors is not None and ids else None, query_vector)
+        answer = generate_answer(q, context.texts)
         print("\nAnswer:\n" + answer.strip())
+        print(f"(context: {context.tokens_used} tokens, {context.tokens_saved} saved)")
 
-    if args.query:
+    if args.queries_file:
+        run_batch(index, chunks, args)
+    elif args.query:
         run_query(args.query)
     else:
         print("Entering interactive mode. Type 'exit' to quit.")
@@ -0,0 +1,263 @@
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import chunker
+import dedup
+import md_rag
+import metrics
+from chunk_store import CHUNKS_FILE
+from snapshots import INDEX_FILE, METADATA_FILE, write_generation
+
+
+STAGES = ("convert", "chunk", "embed", "persist")
+
+
+@dataclass
+class StageProgress:
+    status: str = "pending"  # pending | running | done | failed
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    items: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        seconds = None
+        if self.started_at is not None:
+            seconds = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {"status": self.status, "seconds": seconds, "items": self.items}
+
+
+@dataclass
+class IngestJob:
+    """One document moving through convert -> chunk -> embed -> persist."""
+    id: str
+    kb_id: str
+    file_name: str
+    pdf_path: str
+    content_hash: Optional[str] = None  # SHA-256 of the upload, keys the conversion cache
+    status: str = "queued"  # queued | running | completed | failed
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    dedup: Optional[Dict[str, Any]] = None  # near-duplicate chunks dropped before embedding (Deduplicator.stats)
+    stages: Dict[str, StageProgress] = field(default_factory=lambda: {s: StageProgress() for s in STAGES})
+
+    def to_dict(self) -> Dict[str, Any]:
+        done = sum(1 for s in self.stages.values() if s.status == "done")
+        return {
+            "id": self.id,
+            "kb_id": self.kb_id,
+            "file": self.file_name,
+            "status": self.status,
+            "progress": round(done / len(STAGES), 2),
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            "created_at": self.created_at,
+            "elapsed": round((self.finished_at or time.time()) - self.created_at, 3),
+            "error": self.error,
+            "dedup": self.dedup,
+            "kb": self.result,
+        }
+
+
+class IngestJobManager:
+    """
+    Runs uploads as background ingestion jobs.
+
+    Docling conversion is CPU-heavy and runs in a bounded process pool (a long PDF
+    as several page ranges at once), unless the conversion cache already holds the
+    upload's Markdown; chunking, embedding and persistence follow on a thread pool
+    so several documents are in flight at once. Chunking and embedding run as one
+    stream (chunks are embedded batch by batch as they are cut) into a scratch
+    spool of the job's own, so memory stays flat however large the document is.
+    Chunks that near-duplicate the KB's or the document's own earlier ones are
+    dropped from the stream before embedding and recorded as aliases when the
+    document is appended. The append from the spool writes a new generation of
+    the KB (see snapshots), published only once it is complete, so chat keeps
+    serving the previous one meanwhile; appends to the same KB are serialized,
+    and only the append runs under that lock. Job state lives in this process
+    only; finished jobs beyond ``max_finished_jobs`` are forgotten oldest first.
+    """
+
+    def __init__(self, convert_workers: int = 2, pipeline_workers: int = 4, max_finished_jobs: int = 500, chunk_tokens: Optional[int] = None, spool_dir: str = os.path.join("data", "spool"), prewarm_converters: bool = False):
+        self.chunk_tokens = chunk_tokens
+        self.spool_dir = spool_dir
+        self.max_finished_jobs = max_finished_jobs
+        self.convert_workers = convert_workers
+        self.prewarm_converters = prewarm_converters
+        self.converter_warmups: Dict[int, Dict[str, Any]] = {}
+        self._convert_pool = self._new_convert_pool()
+        self._pipeline_pool = ThreadPoolExecutor(max_workers=pipeline_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._kb_locks: Dict[str, threading.Lock] = {}
+
+    def _new_convert_pool(self) -> ProcessPoolExecutor:
+        # spawn: the API process is multi-threaded, and forking it is unsafe. Each worker
+        # keeps its docling converters (md_rag.converter_pool) across the documents it converts.
+        return ProcessPoolExecutor(max_workers=self.convert_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def prewarm(self) -> List[Dict[str, Any]]:
+        """
+        Start the convert workers and load their docling models ahead of the first
+        upload. Blocks until they are warm; returns each worker's pid and load time.
+        (A pool replaced after a worker crash warms up lazily, on its first documents.)
+        """
+        pool = self._convert_pool
+        futures = [pool.submit(md_rag.prewarm_converters) for _ in range(self.convert_workers)]
+        warmups = {w["pid"]: w for w in (f.result() for f in futures)}
+        with self._lock:
+            self.converter_warmups.update(warmups)
+        return list(warmups.values())
+
+    def converter_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"workers": self.convert_workers, "prewarm": self.prewarm_converters, "warmed": list(self.converter_warmups.values())}
+
+    def _convert(self, pdf_path: str, content_hash: Optional[str]) -> str:
+        pool = self._convert_pool
+        try:
+            # Timed here: the worker processes record into their own, unexported, metrics.
+            # Cached conversions skip the pool; long PDFs spread across it by page range.
+            with metrics.stage("convert"):
+                return md_rag.convert_pdf(pdf_path, content_hash, pool=pool)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM in docling); replace the pool so later jobs still run.
+            with self._lock:
+                if self._convert_pool is pool:
+                    self._convert_pool = self._new_convert_pool()
+            raise
+
+    def _kb_lock(self, kb_id: str) -> threading.Lock:
+        with self._lock:
+            return self._kb_locks.setdefault(kb_id, threading.Lock())
+
+    @staticmethod
+    def new_job_id() -> str:
+        """An id for a job about to be submitted, e.g. to name its upload directory first."""
+        return uuid.uuid4().hex
+
+    def submit(self, kb_id: str, kb_path: str, pdf_path: str, file_name: str, on_complete: Optional[Callable[[str], None]] = None, content_hash: Optional[str] = None, job_id: Optional[str] = None) -> IngestJob:
+        """Queue a document for ingestion into a KB and return its job immediately."""
+        job = IngestJob(id=job_id or self.new_job_id(), kb_id=kb_id, file_name=file_name, pdf_path=pdf_path, content_hash=content_hash)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._pipeline_pool.submit(self._run, job, kb_path, on_complete)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kb_id: Optional[str] = None) -> List[IngestJob]:
+        with self._lock:
+            return [j for j in self._jobs.values() if kb_id is None or j.kb_id == kb_id]
+
+    def _prune(self) -> None:
+        finished = [j.id for j in self._jobs.values() if j.status in ("completed", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _start(stage: StageProgress) -> None:
+        stage.status = "running"
+        stage.started_at = time.time()
+
+    @staticmethod
+    def _finish(stage: StageProgress, status: str = "done") -> None:
+        stage.status = status
+        stage.finished_at = time.time()
+
+    def _stage(self, job: IngestJob, name: str, fn: Callable[[], Any]) -> Any:
+        stage = job.stages[name]
+        self._start(stage)
+        try:
+            result = fn()
+        except Exception:
+            self._finish(stage, "failed")
+            raise
+        self._finish(stage)
+        return result
+
+    def _chunk_and_embed(self, job: IngestJob, markdown_text: str, spool_dir: str, deduplicator: Optional[dedup.Deduplicator]) -> int:
+        """Stream chunks past the near-duplicate filter and through embedding into the spool; the chunk and embed stages overlap."""
+        chunk_stage, embed_stage = job.stages["chunk"], job.stages["embed"]
+        for stage in (chunk_stage, embed_stage):
+            self._start(stage)
+            stage.items = 0
+
+        def chunks() -> Iterator[str]:
+            for chunk in chunker.iter_chunks(markdown_text, max_tokens=self.chunk_tokens):
+                chunk_stage.items = (chunk_stage.items or 0) + 1
+                yield chunk
+            self._finish(chunk_stage)
+
+        def embedded() -> Iterator[Tuple[List[str], Any]]:
+            kept = deduplicator.filter(chunks()) if deduplicator is not None else chunks()
+            for batch, vectors in md_rag.embed_chunk_stream(kept):
+                embed_stage.items = (embed_stage.items or 0) + len(batch)
+                yield batch, vectors
+
+        try:
+            count = md_rag.spool_embedded_batches(embedded(), spool_dir)
+        except Exception:
+            for stage in (chunk_stage, embed_stage):
+                if stage.status == "running":
+                    self._finish(stage, "failed")
+            raise
+        self._finish(embed_stage)
+        if deduplicator is not None:
+            job.dedup = deduplicator.stats()
+        return count
+
+    def _run(self, job: IngestJob, kb_path: str, on_complete: Optional[Callable[[str], None]]) -> None:
+        job.status = "running"
+        # Keyed by job, not file name: the same file may be in flight for several KBs.
+        spool_dir = os.path.join(self.spool_dir, job.id)
+        try:
+            markdown_text = self._stage(job, "convert", lambda: self._convert(job.pdf_path, job.content_hash))
+            # Checked against the KB as it is now; a document appended meanwhile is not seen.
+            deduplicator = md_rag.open_deduplicator(kb_path)
+            if not self._chunk_and_embed(job, markdown_text, spool_dir, deduplicator) and not (deduplicator and deduplicator.aliases):
+                raise ValueError("No chunks produced from the document.")
+            del markdown_text
+
+            def persist() -> Dict[str, Any]:
+                with self._kb_lock(job.kb_id):
+                    if not os.path.isdir(kb_path):
+                        raise FileNotFoundError(f"KB '{job.kb_id}' was deleted during ingestion.")
+                    with write_generation(kb_path) as staging:
+                        return md_rag.append_chunk_batches_to_index(
+                            md_rag.iter_spooled_batches(spool_dir),
+                            index_path=os.path.join(staging, INDEX_FILE),
+                            chunks_path=os.path.join(staging, CHUNKS_FILE),
+                            metadata_path=os.path.join(staging, METADATA_FILE),
+                            file_name=job.file_name,
+                            deduplicator=deduplicator,
+                        )
+
+            metadata = self._stage(job, "persist", persist)
+            if on_complete is not None:
+                on_complete(job.kb_id)
+            job.result = {"name": job.kb_id, **metadata}
+            job.status = "completed"
+        except Exception as e:
+            print(f"Ingestion job {job.id} ({job.file_name}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            job.finished_at = time.time()
+
+    def shutdown(self) -> None:
+        self._pipeline_pool.shutdown(wait=False, cancel_futures=True)
+        self._convert_pool.shutdown(wait=False, cancel_futures=True)
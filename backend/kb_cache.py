@@ -0,0 +1,208 @@
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import IO, Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from chunk_store import CHUNKS_FILE, LEGACY_CHUNKS_FILE, ChunkStore, offsets_path
+from bm25_index import BM25Index
+from ann_index import open_vectors, resident_nbytes, vectors_path
+from faiss_retriever import load_index_and_chunks, load_metadata
+from metrics import stage
+from provenance import Provenance, open_provenance, provenance_paths
+from snapshots import INDEX_FILE, METADATA_FILE, acquire_lease, current_dir
+
+
+@dataclass
+class CachedKB:
+    """A loaded KB held resident in memory."""
+    name: str
+    index: faiss.Index
+    chunks: Sequence[str]
+    metadata: Dict[str, Any]
+    lexical: Optional[BM25Index]
+    vectors: Optional[np.ndarray]  # memory-mapped raw vectors by chunk ID, when the KB has them
+    provenance: Provenance         # file / pages / offsets by chunk ID
+    signature: Tuple
+    nbytes: int
+    lease: IO                      # keeps the generation from being collected (see snapshots)
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (0, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _estimate_nbytes(index: faiss.Index, index_path: str, chunks: Sequence[str]) -> int:
+    # Memory-mapped vector codes and chunk stores are shared page cache rather
+    # than heap, so only the rest counts; legacy JSON chunks are measured as the
+    # Python objects we keep around.
+    index_bytes = resident_nbytes(index, index_path)
+    if isinstance(chunks, ChunkStore):
+        return index_bytes + chunks.nbytes_resident
+    chunk_bytes = sys.getsizeof(chunks) + sum(sys.getsizeof(c) for c in chunks)
+    return index_bytes + chunk_bytes
+
+
+class KBCache:
+    """
+    Process-wide LRU cache of KB indices, chunks and metadata.
+
+    Entries are keyed by KB name and validated on every lookup against the KB's
+    current generation (see snapshots) and the mtime/size of its files, so an
+    upload that publishes a new generation, or a delete, transparently forces a
+    reload. A load reads a single generation, which writers never modify, and
+    leases it until the entry is dropped and the last request using it is done.
+    Least-recently-used KBs are evicted once the estimated resident size exceeds
+    ``max_bytes``; a single KB larger than the budget is still served, it just
+    becomes the only resident entry.
+    """
+
+    def __init__(self, base_dir: str, max_bytes: int):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedKB]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _paths(kb_dir: str) -> Tuple[str, str, str]:
+        return (
+            os.path.join(kb_dir, INDEX_FILE),
+            os.path.join(kb_dir, CHUNKS_FILE),
+            os.path.join(kb_dir, METADATA_FILE),
+        )
+
+    def _signature(self, kb_dir: str) -> Tuple:
+        index_path, chunks_path, metadata_path = self._paths(kb_dir)
+        watched = (
+            index_path, chunks_path, offsets_path(chunks_path), os.path.join(kb_dir, LEGACY_CHUNKS_FILE),
+            metadata_path, vectors_path(index_path), *provenance_paths(kb_dir),
+        )
+        return (kb_dir, *(_file_signature(p) for p in watched))
+
+    def _drop(self, kb_id: str) -> Optional[CachedKB]:
+        entry = self._entries.pop(kb_id, None)
+        if entry is not None:
+            self._resident_bytes -= entry.nbytes
+        return entry
+
+    def _evict_to_budget(self) -> None:
+        while self._resident_bytes > self.max_bytes and len(self._entries) > 1:
+            name, _ = next(iter(self._entries.items()))
+            self._drop(name)
+            self.evictions += 1
+
+    def _load(self, kb_id: str, kb_dir: str, signature: Tuple) -> CachedKB:
+        index_path, chunks_path, metadata_path = self._paths(kb_dir)
+        lease = acquire_lease(kb_dir)
+        try:
+            with stage("load"):
+                index, chunks = load_index_and_chunks(index_path, chunks_path)
+                metadata = load_metadata(metadata_path)
+                lexical = BM25Index.load(kb_dir)
+                vectors: Optional[np.ndarray] = open_vectors(vectors_path(index_path), index.d)
+                provenance = open_provenance(kb_dir, metadata, len(chunks))
+        except BaseException:
+            lease.close()
+            raise
+        if vectors is not None and len(vectors) != index.ntotal:
+            vectors = None
+        nbytes = _estimate_nbytes(index, index_path, chunks) + provenance.nbytes
+        if lexical is not None:
+            # Postings are memory-mapped; only the per-chunk length arrays live on the heap.
+            nbytes += lexical.doc_len.nbytes * 2
+        entry = CachedKB(
+            name=kb_id,
+            index=index,
+            chunks=chunks,
+            metadata=metadata,
+            lexical=lexical,
+            vectors=vectors,
+            provenance=provenance,
+            signature=signature,
+            nbytes=nbytes,
+            lease=lease,
+        )
+        weakref.finalize(entry, lease.close)
+        return entry
+
+    def get(self, kb_id: str) -> CachedKB:
+        """Return the resident KB, loading it from disk on a miss or when stale.
+
+        Raises FileNotFoundError if the KB has no index or chunks on disk.
+        """
+        kb_path = os.path.join(self.base_dir, kb_id)
+        kb_dir = current_dir(kb_path)
+        signature = self._signature(kb_dir)
+        with self._lock:
+            entry = self._entries.get(kb_id)
+            if entry is not None:
+                if entry.signature == signature:
+                    self._entries.move_to_end(kb_id)
+                    self.hits += 1
+                    return entry
+                self._drop(kb_id)
+                self.invalidations += 1
+            self.misses += 1
+
+        # Load outside the lock so a slow read does not block other KBs.
+        try:
+            entry = self._load(kb_id, kb_dir, signature)
+        except FileNotFoundError:
+            # The generation was collected while we loaded it (only after a newer one
+            # was published); load that one instead.
+            if current_dir(kb_path) == kb_dir:
+                raise
+            kb_dir = current_dir(kb_path)
+            signature = self._signature(kb_dir)
+            entry = self._load(kb_id, kb_dir, signature)
+        with self._lock:
+            self._drop(kb_id)
+            self._entries[kb_id] = entry
+            self._resident_bytes += entry.nbytes
+            self._evict_to_budget()
+        return entry
+
+    def invalidate(self, kb_id: str) -> None:
+        """Forget a KB, e.g. after its files were rewritten or removed."""
+        with self._lock:
+            if self._drop(kb_id) is not None:
+                self.invalidations += 1
+
+    def prewarm(self, kb_ids: Iterable[str]) -> List[str]:
+        """Load the given KBs ahead of the first request. Returns the names loaded."""
+        loaded = []
+        for kb_id in kb_ids:
+            try:
+                self.get(kb_id)
+                loaded.append(kb_id)
+            except FileNotFoundError:
+                print(f"KB cache: skipping prewarm of '{kb_id}' (no index on disk)")
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": list(self._entries.keys()),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from faiss_retriever import load_metadata
+from snapshots import METADATA_FILE, current_dir, current_generation
+
+
+SORT_KEYS = ("name", "created_at", "updated_at", "chunk_count", "ntotal", "file_count", "size_bytes")
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class KBCatalog:
+    """
+    Persistent catalog of the KBs under ``base_dir``, in SQLite.
+
+    One row per KB with what listings show: file names, chunk and vector counts,
+    the on-disk size and timestamps of its current generation. Listing is a single
+    indexed query with paging and sorting instead of a walk over every KB's
+    metadata.json. Rows follow the KBs: refresh() re-reads one KB after it is
+    created, appended to or deleted (each a single-row transaction), and rebuild()
+    rescans the directory on demand. A new catalog file is filled from disk once,
+    so existing KBs show up on first start.
+    """
+
+    def __init__(self, path: str, base_dir: str):
+        self.path = path
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fresh = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kbs ("
+            " name TEXT PRIMARY KEY,"
+            " files TEXT NOT NULL,"
+            " file_count INTEGER NOT NULL,"
+            " chunk_count INTEGER NOT NULL,"
+            " ntotal INTEGER NOT NULL,"
+            " size_bytes INTEGER NOT NULL,"
+            " generation TEXT,"
+            " created_at TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL)"
+        )
+        for key in SORT_KEYS[1:]:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS kbs_{key} ON kbs ({key}, name)")
+        self._conn.commit()
+        if fresh:
+            self.rebuild()
+
+    def _row(self, name: str) -> Optional[Tuple]:
+        kb_path = os.path.join(self.base_dir, name)
+        kb_dir = current_dir(kb_path)
+        metadata_path = os.path.join(kb_dir, METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            return None
+        metadata = load_metadata(metadata_path)
+        files = metadata.get("files", [])
+        created_at = metadata.get("created_at", "unknown")
+        return (
+            name, json.dumps(files, ensure_ascii=False), len(files),
+            int(metadata.get("chunk_count", 0)), int(metadata.get("ntotal", 0)),
+            _dir_size(kb_dir), current_generation(kb_path),
+            created_at, metadata.get("updated_at", created_at),
+        )
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM kbs WHERE name = ?", (name,)).fetchone() is not None
+
+    def refresh(self, name: str) -> None:
+        """Re-read one KB from disk after it changed; a KB no longer on disk is dropped."""
+        row = self._row(name)
+        with self._lock:
+            if row is None:
+                self._conn.execute("DELETE FROM kbs WHERE name = ?", (name,))
+            else:
+                self._conn.execute("INSERT OR REPLACE INTO kbs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._conn.commit()
+
+    def rebuild(self) -> int:
+        """Replace the catalog with a scan of ``base_dir`` (KBs with a metadata.json). Returns the KB count."""
+        names = sorted(n for n in os.listdir(self.base_dir) if os.path.isdir(os.path.join(self.base_dir, n))) if os.path.isdir(self.base_dir) else []
+        rows = [row for row in map(self._row, names) if row is not None]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM kbs")
+                self._conn.executemany("INSERT INTO kbs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def list(self, offset: int = 0, limit: Optional[int] = None, sort: str = "name", descending: bool = False) -> Tuple[List[Dict[str, Any]], int]:
+        """A page of KBs ordered by ``sort`` (one of SORT_KEYS; name breaks ties), and the total count."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Cannot sort KBs by '{sort}'; expected one of {SORT_KEYS}.")
+        direction = "DESC" if descending else "ASC"
+        order = f"name {direction}" if sort == "name" else f"{sort} {direction}, name ASC"
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM kbs").fetchone()[0]
+            cursor = self._conn.execute(
+                "SELECT name, files, file_count, chunk_count, ntotal, size_bytes, generation, created_at, updated_at"
+                f" FROM kbs ORDER BY {order} LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            )
+            rows = cursor.fetchall()
+        kbs = [
+            {
+                "name": name,
+                "ntotal": ntotal,
+                "chunk_count": chunk_count,
+                "files": json.loads(files),
+                "file_count": file_count,
+                "size_bytes": size_bytes,
+                "generation": generation,
+                "created_at": created_at,
+                "updated_at": updated_at,
+            }
+            for name, files, file_count, chunk_count, ntotal, size_bytes, generation, created_at, updated_at in rows
+        ]
+        return kbs, total
@@ -3,43 +3,47 @@
 #   (use faiss-gpu instead of faiss-cpu if you have CUDA)
 
 import numpy as np
+import shutil
 import faiss
-import requests
 import os
-from markitdown import MarkItDown
 import json
-from typing import Any, cast, List, Tuple, Dict, Optional
+import time
+from concurrent.futures import Executor
+from typing import Any, cast, Iterable, Iterator, List, Sequence, Tuple, Dict, Optional
 from datetime import datetime
 
-from openai import AzureOpenAI
-# Ensure you have a config.py file with your Azure OpenAI credentials
-# from config import CONFIG, LLM_SETTINGS, EMBEDDING_SETTINGS
-from docling.document_converter import DocumentConverter
-from config import CONFIG, LLM_SETTINGS, EMBEDDING_SETTINGS
-
-# Placeholder for CONFIG, LLM_SETTINGS, EMBEDDING_SETTINGS if config.py is not available
-# In a real scenario, these would be loaded from a configuration file.
-# Azure OpenAI configuration (env first, then config)
-API_BASE = CONFIG["azure"]["openai"]["api_base"].rstrip("/")
-API_KEY = os.getenv("AZURE_OPENAI_API_KEY", CONFIG["azure"]["openai"]["api_key"])  
-API_VERSION = CONFIG["azure"]["openai"]["api_version"]
-
-# Initialize Azure OpenAI client (LLM for MarkItDown)
-client = AzureOpenAI(  
-    api_key=API_KEY,  
-    api_version=API_VERSION,  
-    azure_endpoint=API_BASE  
-)  
-  
-# Build Azure Embedding REST endpoint (keep model separation)
-EMBED_DEPLOYMENT = EMBEDDING_SETTINGS["deployment_name"]
-AZURE_EMBEDDING_ENDPOINT = f"{API_BASE}/openai/deployments/{EMBED_DEPLOYMENT}/embeddings?api-version={API_VERSION}"  
+# docling and markitdown are imported on first conversion (see converters.py); API
+# workers that only serve chat never load them.
+from config import DOCLING_SETTINGS, EMBEDDING_EXECUTOR_SETTINGS, BM25_SETTINGS
+from clients import azure_openai_client
+from converters import ConverterPool
+from conversion_cache import get_conversion_cache, sha256_file
+from embedding_cache import cached_embed
+from embedding_providers import check_compatible, get_provider
+import bm25_index
+from ann_index import append_vectors, backfill_vectors, build_index, measure_recall, needs_rebuild, open_vectors, vectors_path, write_index
+from chunk_store import CHUNKS_FILE, append_chunks, chunks_exist, ensure_migrated, open_chunks, truncate_chunks, write_chunk_store
+import chunker
+from metrics import observe_stage, stage
+from snapshots import METADATA_FILE, current_dir
+from provenance import alias_count, append_aliases, append_provenance, backfill_provenance, documents_of, open_provenance, truncate_aliases, truncate_provenance
+import dedup
+import segmented_file
+
+# docling converters kept for the life of the process (one per concurrent conversion)
+converter_pool = ConverterPool(size=int(DOCLING_SETTINGS.get("converters_per_process", 1)))
+# Long PDFs are converted as page ranges in parallel (see page_ranges)
+SPLIT_MIN_PAGES = int(DOCLING_SETTINGS.get("split_min_pages", 40))
+PAGES_PER_TASK = max(1, int(DOCLING_SETTINGS.get("pages_per_task", 16)))
 
 
 def pdf_to_markdown_with_markitdown(pdf_path: str) -> str:
     """Convert a PDF to Markdown using markitdown."""
-    md = MarkItDown(llm_client=client, llm_model="gpt-4o", verbose=False)
-    result = md.convert(pdf_path)
+    from markitdown import MarkItDown
+
+    md = MarkItDown(llm_client=azure_openai_client(), llm_model="gpt-4o", verbose=False)
+    with stage("convert"):
+        result = md.convert(pdf_path)
     content = getattr(result, "markdown", None)
     if content is None and isinstance(result, dict):
         content = result.get("content")
@@ -48,94 +52,396 @@ def pdf_to_markdown_with_markitdown(pdf_path: str) -> str:
     return content
 
 
-def pdf_to_markdown_with_docling(pdf_path: str) -> str:
+def pdf_to_markdown_with_docling(pdf_path: str, page_range: Optional[Tuple[int, int]] = None) -> str:
     """
     Convert a PDF to Markdown using docling, preserving structural information.
     Docling is particularly good at recognizing and formatting tables.
+    Converters come from the process's converter_pool and are reused across documents.
+    ``page_range`` (first, last; 1-based, inclusive) converts only those pages, and a
+    range with no extractable text gives an empty string rather than an error.
     """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"The file {pdf_path} was not found.")
 
-    print("Converting PDF to Markdown with docling...")
-    converter = DocumentConverter()
-    result = converter.convert(pdf_path)
-    markdown_content = result.document.export_to_markdown()
-    if not markdown_content:
+    pages = f" (pages {page_range[0]}-{page_range[1]})" if page_range else ""
+    print(f"Converting PDF to Markdown with docling{pages}...")
+    with stage("convert"), converter_pool.converter() as converter:
+        result = converter.convert(pdf_path, page_range=page_range) if page_range else converter.convert(pdf_path)
+        # Page markers let the chunker record each chunk's page range; they never reach chunk text.
+        markdown_content = result.document.export_to_markdown(page_break_placeholder=chunker.PAGE_BREAK)
+    if not markdown_content and page_range is None:
         raise ValueError("No content extracted from PDF using docling.")
-    print("PDF to Markdown conversion with docling complete.")
+    print(f"PDF to Markdown conversion with docling complete{pages}.")
     return markdown_content
 
 
-def chunk_text(text: str, chunk_size: int = 500) -> list[str]:
-    """Simple word-based chunking."""
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i + chunk_size]).strip()
-        if chunk:
-            chunks.append(chunk)
-    return chunks
+def pdf_page_count(pdf_path: str) -> Optional[int]:
+    """Pages in a PDF, read with pypdfium2 (installed with docling); None if it cannot tell."""
+    try:
+        import pypdfium2
+    except ImportError:
+        return None
+    try:
+        pdf = pypdfium2.PdfDocument(pdf_path)
+    except Exception:
+        return None
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
 
 
-def get_azure_embedding(texts: list[str], batch_size: int = 16, timeout: int = 30) -> list[list[float]]:
-    """Get embeddings from Azure OpenAI for a list of texts."""
-    if not texts:
-        return []
+def page_ranges(page_count: Optional[int]) -> List[Optional[Tuple[int, int]]]:
+    """
+    Page ranges (1-based, inclusive) to convert separately: docling.pages_per_task pages
+    each for documents of at least docling.split_min_pages, else [None] (the whole file).
+    """
+    if not page_count or page_count < SPLIT_MIN_PAGES:
+        return [None]
+    return [(first, min(first + PAGES_PER_TASK - 1, page_count)) for first in range(1, page_count + 1, PAGES_PER_TASK)]
+
+
+def convert_pdf(pdf_path: str, content_hash: Optional[str] = None, pool: Optional[Executor] = None, use_cache: bool = True) -> str:
+    """
+    Markdown for a PDF. A file converted before (same SHA-256; pass ``content_hash`` if it
+    is already known) comes from the conversion cache. Otherwise docling converts it, in
+    ``pool`` when given; a long PDF is split into page ranges converted in parallel
+    across the pool and merged in page order. The result is cached.
+    """
+    cache = get_conversion_cache() if use_cache else None
+    if cache is not None:
+        content_hash = content_hash or sha256_file(pdf_path)
+        cached = cache.get(content_hash)
+        if cached is not None:
+            print(f"Reusing cached conversion of {os.path.basename(pdf_path)} ({content_hash[:12]})")
+            return cached
+
+    ranges = page_ranges(pdf_page_count(pdf_path)) if pool is not None else [None]
+    if pool is None:
+        markdown = pdf_to_markdown_with_docling(pdf_path)
+    elif len(ranges) == 1:
+        markdown = pool.submit(pdf_to_markdown_with_docling, pdf_path).result()
+    else:
+        futures = [pool.submit(pdf_to_markdown_with_docling, pdf_path, page_range) for page_range in ranges]
+        try:
+            parts = [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+        if not any(parts):
+            raise ValueError("No content extracted from PDF using docling.")
+        # Each part separates its own pages; the seams between ranges are page breaks too.
+        markdown = f"\n\n{chunker.PAGE_BREAK}\n\n".join(parts)
+
+    if cache is not None:
+        cache.put(cast(str, content_hash), markdown)
+    return markdown
 
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": API_KEY,
-    }
 
-    all_embeddings: list[list[float]] = []
+STREAM_BATCH_ITEMS = int(EMBEDDING_EXECUTOR_SETTINGS.get("stream_batch_items", 1024))
+SPOOL_VECTORS_FILE = "vectors.f32"
 
-    for start in range(0, len(texts), batch_size):
-        batch = texts[start:start + batch_size]
-        data = {"input": batch}
 
-        resp = requests.post(AZURE_EMBEDDING_ENDPOINT, headers=headers, json=data, timeout=timeout)
-        resp.raise_for_status()
-        payload = resp.json()
-        data_items = payload.get("data", [])
-        data_items_sorted = sorted(data_items, key=lambda x: x.get("index", 0))
-        batch_embeddings = [item["embedding"] for item in data_items_sorted]
-        if len(batch_embeddings) != len(batch):
-            raise RuntimeError("Mismatch between number of inputs and embeddings returned.")
-        all_embeddings.extend(batch_embeddings)
+def prewarm_converters() -> Dict[str, Any]:
+    """Build this process's docling converters and load their models ahead of the first upload."""
+    return converter_pool.prewarm()
+
+
+def chunk_text(text: str, chunk_size: Optional[int] = None) -> list[str]:
+    """Section-aware chunks of at most chunk_size tokens (default embedding.chunk_size); see chunker."""
+    with stage("chunk"):
+        return chunker.chunk_text(text, max_tokens=chunk_size)
+
+
+def embed_chunk_stream(chunks: Iterable[str], batch_size: Optional[int] = None) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """
+    Embed a stream of chunks a batch at a time, yielding (chunks, float32 vectors).
+    Only one batch is held in memory; each batch still fans out across the embedding executor.
+    Time spent drawing a batch from ``chunks`` is recorded as the chunk stage.
+    """
+    batches = chunker.batched(chunks, batch_size or STREAM_BATCH_ITEMS)
+    while True:
+        with stage("chunk"):
+            batch = next(batches, None)
+        if batch is None:
+            return
+        yield batch, np.ascontiguousarray(get_embedding(batch), dtype=np.float32)
+
+
+def spool_embedded_batches(batches: Iterable[Tuple[List[str], np.ndarray]], spool_dir: str) -> int:
+    """
+    Write embedded batches to a scratch directory (a chunk store, raw vectors and the
+    chunks' provenance) so they can later be appended to a KB without holding them in
+    memory. Returns the chunk count.
+    """
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    os.makedirs(spool_dir)
+    data_path = os.path.join(spool_dir, CHUNKS_FILE)
+    write_chunk_store(data_path, [])
+    count = 0
+    for batch, vectors in batches:
+        append_vectors(os.path.join(spool_dir, SPOOL_VECTORS_FILE), vectors)
+        append_provenance(spool_dir, batch, file_id=0)
+        count = append_chunks(data_path, batch)
+    return count
+
+
+def iter_spooled_batches(spool_dir: str, batch_size: Optional[int] = None) -> Iterator[Tuple[List[chunker.Chunk], np.ndarray]]:
+    """Read back batches written by spool_embedded_batches, with each chunk's provenance."""
+    chunks = open_chunks(os.path.join(spool_dir, CHUNKS_FILE))
+    if not len(chunks):
+        return
+    vec_file = os.path.join(spool_dir, SPOOL_VECTORS_FILE)
+    dim = segmented_file.size(vec_file) // (4 * len(chunks))
+    vectors = open_vectors(vec_file, dim)
+    spans = open_provenance(spool_dir, {}, len(chunks)).columns
+    batch_size = batch_size or STREAM_BATCH_ITEMS
+    for start in range(0, len(chunks), batch_size):
+        end = min(start + batch_size, len(chunks))
+        batch = [
+            chunker.Chunk(chunks[i], int(spans["page_start"][i]), int(spans["page_end"][i]), int(spans["char_start"][i]), int(spans["char_end"][i]))
+            for i in range(start, end)
+        ]
+        yield batch, np.ascontiguousarray(vectors[start:end])
+
+
+def get_embedding(texts: list[str], batch_size: Optional[int] = None, timeout: Optional[float] = None) -> list[list[float]]:
+    """
+    Embed texts for ingestion with the configured provider (see embedding_providers), served
+    from the embedding cache where possible. On Azure, misses go through the concurrent
+    embedding executor; batch_size caps items per request (batches are otherwise sized by
+    token count from config).
+    """
+    with stage("embed"):
+        return cached_embed(texts, lambda missing: get_provider().embed_documents(missing, max_batch_items=batch_size, timeout=timeout))
+
 
-    return all_embeddings
+# Name from when Azure was the only provider
+get_azure_embedding = get_embedding
 
 
 def build_faiss_index(embeddings: list[list[float]]) -> faiss.Index:
-    """Build a FAISS L2 index from a list of embedding vectors."""
+    """Build a FAISS L2 index of the configured type (vector_db.index_type) from a list of embedding vectors."""
     if not embeddings:
         raise ValueError("No embeddings provided to build the FAISS index.")
     emb_np = np.ascontiguousarray(embeddings, dtype=np.float32)
-    dim = emb_np.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    cast(Any, index).add(emb_np)
+    with stage("index"):
+        index, _ = build_index(emb_np)
     return index
 
 
-def ingest_pdf_to_faiss(pdf_path: str, chunk_size: int = 500) -> tuple[faiss.Index, list[str], list[list[float]]]:
-    """End-to-end ingestion: PDF -> Markdown -> Chunks -> Embeddings -> FAISS index"""
-    # Using the new docling-based conversion
-    markdown_text = pdf_to_markdown_with_docling(pdf_path)
+def to_id_mapped_index(index: faiss.Index) -> faiss.IndexIDMap2:
+    """
+    Return an ID-mapped view of an index whose IDs are chunk positions.
+    Legacy sequential indices are rebuilt from their stored vectors (no re-embedding),
+    keeping the implicit IDs 0..ntotal-1.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return index
+    id_index = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+    if index.ntotal:
+        vectors = index.reconstruct_n(0, index.ntotal)
+        cast(Any, id_index).add_with_ids(vectors, np.arange(index.ntotal, dtype=np.int64))
+    return id_index
+
+
+def add_embeddings_with_ids(index: faiss.IndexIDMap2, embeddings: list[list[float]], start_id: int) -> None:
+    """Add embeddings under consecutive chunk IDs starting at start_id."""
+    emb_np = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if emb_np.shape[1] != index.d:
+        raise ValueError(f"Embedding dimension {emb_np.shape[1]} does not match index dimension {index.d}.")
+    ids = np.arange(start_id, start_id + len(emb_np), dtype=np.int64)
+    cast(Any, index).add_with_ids(emb_np, ids)
+
+
+def open_deduplicator(kb_path: Optional[str] = None) -> Optional[dedup.Deduplicator]:
+    """
+    A near-duplicate filter for one document going into the KB at ``kb_path`` (its
+    current generation), or only checking the document against itself without one.
+    None when dedup is disabled.
+    """
+    if not dedup.ENABLED:
+        return None
+    if kb_path is None:
+        return dedup.Deduplicator()
+    kb_dir = current_dir(kb_path)
+    return dedup.Deduplicator.for_kb(kb_dir, int(load_metadata(os.path.join(kb_dir, METADATA_FILE)).get("chunk_count", 0)), kb_path=kb_path)
+
+
+def ingest_pdf_chunks(pdf_path: str, chunk_size: Optional[int] = None) -> tuple[list[str], list[list[float]]]:
+    """PDF -> Markdown -> Chunks (near-duplicates dropped) -> Embeddings, without building an index."""
+    # docling conversion, reused from the conversion cache when this file was converted before
+    markdown_text = convert_pdf(pdf_path)
     chunks = chunk_text(markdown_text, chunk_size=chunk_size)
+    deduplicator = open_deduplicator()
+    if deduplicator is not None:
+        chunks = list(deduplicator.filter(chunks))
     if not chunks:
         raise ValueError("No chunks produced from the document.")
-    embeddings = get_azure_embedding(chunks)
+    embeddings = get_embedding(chunks)
+    return chunks, embeddings
+
+
+def ingest_pdf_to_faiss(pdf_path: str, chunk_size: Optional[int] = None) -> tuple[faiss.Index, list[str], list[list[float]]]:
+    """End-to-end ingestion: PDF -> Markdown -> Chunks -> Embeddings -> FAISS index"""
+    chunks, embeddings = ingest_pdf_chunks(pdf_path, chunk_size=chunk_size)
     index = build_faiss_index(embeddings)
     return index, chunks, embeddings
 
 
-def persist_index_and_chunks(index: faiss.Index, chunks: list[str], index_path: str = "index.faiss", chunks_path: str = "chunks.json", metadata_path: Optional[str] = None, files: Optional[List[str]] = None) -> None:
+def append_pdf_to_index(pdf_path: str, index_path: str, chunks_path: str, metadata_path: str, file_name: str, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Incrementally ingest a PDF into an existing KB.
+    Chunks stream from the converted document, past the near-duplicate filter, through
+    embedding into the index; see append_chunk_batches_to_index. Returns the updated metadata.
+    """
+    markdown_text = convert_pdf(pdf_path)
+    chunks: Iterable[str] = chunker.iter_chunks(markdown_text, max_tokens=chunk_size)
+    deduplicator = open_deduplicator(os.path.dirname(index_path) or ".")
+    if deduplicator is not None:
+        chunks = deduplicator.filter(chunks)
+    return append_chunk_batches_to_index(embed_chunk_stream(chunks), index_path, chunks_path, metadata_path, file_name, deduplicator)
+
+
+def append_chunks_to_index(new_chunks: list[str], new_embeddings: list[list[float]], index_path: str, chunks_path: str, metadata_path: str, file_name: str) -> Dict[str, Any]:
+    """Add one document's already embedded chunks to a KB. Returns the updated metadata."""
+    batch = (list(new_chunks), np.ascontiguousarray(new_embeddings, dtype=np.float32))
+    return append_chunk_batches_to_index([batch], index_path, chunks_path, metadata_path, file_name)
+
+
+def append_chunk_batches_to_index(batches: Iterable[Tuple[Sequence[str], np.ndarray]], index_path: str, chunks_path: str, metadata_path: str, file_name: str, deduplicator: Optional[dedup.Deduplicator] = None) -> Dict[str, Any]:
+    """
+    Add one document's embedded chunks to a KB, consuming (chunks, vectors) batches as they arrive.
+    Each batch is written to the chunk store and raw vector file and added to the KB's
+    ID-mapped index under chunk IDs that continue from the current chunk count, so memory
+    is bounded by one batch. Each chunk's provenance (this document's file_id, plus the
+    page range and offsets a chunker.Chunk carries) and MinHash signature are appended
+    alongside. When the chunks went through ``deduplicator``, its signatures are reused
+    and the near-duplicates it dropped are recorded as aliases; a document whose chunks
+    were all duplicates adds only aliases. If the stream fails part-way, everything
+    appended is truncated back and the KB is left as it was. Returns the updated metadata.
+    Recorded as the index stage, less the time spent waiting on ``batches``.
+    """
+    started = time.perf_counter()
+    waited = 0.0
+    ensure_migrated(chunks_path)
+    vec_path = vectors_path(index_path)
+    index: Optional[faiss.Index] = None
+    if os.path.exists(index_path) and chunks_exist(chunks_path):
+        index = to_id_mapped_index(faiss.read_index(index_path))
+        chunk_count = len(open_chunks(chunks_path))
+        has_vectors = backfill_vectors(index, vec_path)
+        if index.ntotal != chunk_count:
+            raise RuntimeError(f"Index has {index.ntotal} vectors but chunk store has {chunk_count} chunks.")
+    else:
+        chunk_count = 0
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        write_chunk_store(chunks_path, [])
+        segmented_file.remove(vec_path)
+        has_vectors = True
+
+    metadata = load_metadata(metadata_path)
+    if index is not None:
+        check_compatible(metadata, index.d)
+    index_info = metadata.get("index", {})
+    start_id = chunk_count
+    vec_bytes = segmented_file.size(vec_path)
+    kb_path = os.path.dirname(index_path) or "."
+    documents = documents_of(metadata, start_id)
+    file_id = len(documents)
+    backfill_provenance(kb_path, {"documents": documents}, start_id)
+    aliases_before = alias_count(kb_path)
+    sign = dedup.ENABLED or deduplicator is not None
+    # Chunks that bypassed the filter are signed here, so later documents can be checked against them.
+    hasher = dedup.MinHasher() if sign and deduplicator is None else None
+    if sign:
+        dedup.backfill_signatures(kb_path, chunks_path, start_id, deduplicator.hasher if deduplicator is not None else hasher)
+    duplicates = deduplicator.aliases if deduplicator is not None else []
+    dim = index.d if index is not None else None
+    added = 0
+    stream = iter(batches)
+    try:
+        while True:
+            wait_started = time.perf_counter()
+            item = next(stream, None)
+            waited += time.perf_counter() - wait_started
+            if item is None:
+                break
+            batch, vectors = item
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            if dim is not None and vectors.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {dim}.")
+            dim = vectors.shape[1]
+            if has_vectors:
+                append_vectors(vec_path, vectors)
+            if index is not None:
+                add_embeddings_with_ids(index, vectors, start_id + added)
+            append_provenance(kb_path, batch, file_id)
+            if hasher is not None:
+                dedup.append_signatures(kb_path, hasher.signatures(batch))
+            elif deduplicator is not None:
+                dedup.append_signatures(kb_path, np.stack(deduplicator.signatures[added:added + len(batch)]))
+            append_chunks(chunks_path, batch)
+            added += len(batch)
+        if not added and not duplicates:
+            raise ValueError("No chunks produced from the document.")
+        if duplicates:
+            # Canonical chunks from this document are numbered from its first chunk ID.
+            canonical = [c if c >= 0 else start_id + (-c - 1) for _, c in duplicates]
+            append_aliases(kb_path, [span for span, _ in duplicates], file_id, canonical)
+
+        if index is None or (has_vectors and needs_rebuild(index, index_info, start_id + added)):
+            # New KB, or it outgrew its index type / IVF training: rebuild from the raw vectors (no re-embedding)
+            vectors = open_vectors(vec_path, cast(int, dim))
+            index, index_info = build_index(vectors)
+            index_info.update(measure_recall(index, vectors))
+            print(f"Built {index_info['type']} index over {index.ntotal} vectors (recall@{index_info['k']}={index_info['recall_at_k']})")
+    except BaseException:
+        truncate_chunks(chunks_path, start_id)
+        truncate_provenance(kb_path, start_id)
+        truncate_aliases(kb_path, aliases_before)
+        if sign:
+            dedup.truncate_signatures(kb_path, start_id)
+        if has_vectors:
+            segmented_file.truncate(vec_path, vec_bytes)
+        raise
+
+    documents.append({"file": file_name, "first_chunk": start_id, "chunk_count": added, "duplicate_chunks": len(duplicates)})
+    files = metadata.get("files", [])
+    files.append(file_name)
+
+    chunk_count = start_id + added
+    write_index(index, index_path)
+    if BM25_SETTINGS.get("enabled", True):
+        store = open_chunks(chunks_path)
+        if bm25_index.indexed_count(kb_path) != start_id:
+            # KB predates lexical indexing (or it is out of step): index everything once
+            bm25_index.rebuild(kb_path, store)
+        elif chunk_count > start_id:
+            bm25_index.add_segment(kb_path, (store[i] for i in range(start_id, chunk_count)), start_id)
+
+    metadata.update({
+        "ntotal": index.ntotal,
+        "chunk_count": chunk_count,
+        "updated_at": datetime.now().isoformat(),
+        "files": files,
+        "documents": documents,
+        "index": index_info,
+        "embedding": {**get_provider().identity(), "dim": index.d},
+    })
+    metadata.setdefault("created_at", metadata["updated_at"])
+    persist_metadata(metadata_path, metadata)
+    observe_stage("index", time.perf_counter() - started - waited)
+    return metadata
+
+
+def persist_index_and_chunks(index: faiss.Index, chunks: list[str], index_path: str = "index.faiss", chunks_path: str = "chunks.bin", metadata_path: Optional[str] = None, files: Optional[List[str]] = None) -> None:
     """Persist the FAISS index, chunks, and metadata to disk."""
     os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
     os.makedirs(os.path.dirname(chunks_path) or ".", exist_ok=True)
-    faiss.write_index(index, index_path)
-    with open(chunks_path, "w", encoding="utf-8") as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    write_index(index, index_path)
+    write_chunk_store(chunks_path, chunks)
 
     if metadata_path:
         os.makedirs(os.path.dirname(metadata_path) or ".", exist_ok=True)
@@ -149,11 +455,10 @@ def persist_index_and_chunks(index: faiss.Index, chunks: list[str], index_path:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
 
 
-def load_index_and_chunks(index_path: str = "index.faiss", chunks_path: str = "chunks.json") -> tuple[faiss.Index, list[str]]:
-    """Load a FAISS index and its corresponding chunks from disk."""
+def load_index_and_chunks(index_path: str = "index.faiss", chunks_path: str = "chunks.bin") -> tuple[faiss.Index, Sequence[str]]:
+    """Load a FAISS index and open its memory-mapped chunk store."""
     index = faiss.read_index(index_path)
-    with open(chunks_path, "r", encoding="utf-8") as f:
-        chunks: list[str] = json.load(f)
+    chunks = open_chunks(chunks_path)
     return index, chunks
 
 
@@ -173,44 +478,15 @@ def load_metadata(metadata_path: str) -> Dict[str, Any]:
         return {}
 
 
-def list_indices_in_dir(index_dir: str = "indices") -> List[Dict[str, Any]]:
-    """List all available indices in the indices directory."""
-    indices = []
-    if not os.path.exists(index_dir):
-        return indices
-
-    for item in os.listdir(index_dir):
-        item_path = os.path.join(index_dir, item)
-        if os.path.isdir(item_path):
-            index_file = os.path.join(item_path, "index.faiss")
-            chunks_file = os.path.join(item_path, "chunks.json")
-            metadata_file = os.path.join(item_path, "metadata.json")
-
-            if os.path.exists(index_file) and os.path.exists(chunks_file):
-                try:
-                    metadata = load_metadata(metadata_file)
-                    files_list = metadata.get("files", [])
-                    indices.append({
-                        "name": item,
-                        "ntotal": metadata.get("ntotal", 0),
-                        "chunk_count": metadata.get("chunk_count", 0),
-                        "files": files_list,
-                        "created_at": metadata.get("created_at", "unknown")
-                    })
-                except Exception:
-                    pass
-
-    return sorted(indices, key=lambda x: x["name"])
-
-
-def query_retriever(query: str, index: faiss.Index, chunks: list[str], k: int = 3) -> list[str]:
+def query_retriever(query: str, index: faiss.Index, chunks: Sequence[str], k: int = 3) -> list[str]:
     """Embed the query, search the FAISS index, and return top-k chunk texts."""
     if index.ntotal == 0:
         return []
-    query_embedding = get_azure_embedding([query])[0]
+    # Queries take the retrieval path (query batcher and cache), not the ingestion one.
+    from faiss_retriever import embed_query
+
     k = max(1, min(k, index.ntotal))
-    query_np = np.ascontiguousarray([query_embedding], dtype=np.float32)
-    D, I = cast(Any, index).search(query_np, k)
+    D, I = cast(Any, index).search(embed_query(query), k)
     return [chunks[i] for i in I[0]]
 
 
@@ -218,16 +494,16 @@ if __name__ == "__main__":
     # Make sure to replace this with the actual path to your PDF file
     pdf_path = "/home/athshyam/shyam/rag_project/backend/2024-UPS-GRI-Report.pdf"
     index_path = "index_docling.faiss"
-    chunks_path = "chunks_docling.json"
+    chunks_path = "chunks_docling.bin"
 
     # We will re-index the PDF using docling if the index doesn't already exist.
-    if os.path.exists(index_path) and os.path.exists(chunks_path):
+    if os.path.exists(index_path) and chunks_exist(chunks_path):
         print("Loading existing index and chunks from disk...")
         index, chunks = load_index_and_chunks(index_path=index_path, chunks_path=chunks_path)
         print("Loading complete.")
     else:
         print("No existing index found. Ingesting PDF with docling...")
-        index, chunks, _embeddings = ingest_pdf_to_faiss(pdf_path, chunk_size=500)
+        index, chunks, _embeddings = ingest_pdf_to_faiss(pdf_path)
         persist_index_and_chunks(index, chunks, index_path=index_path, chunks_path=chunks_path)
         print("Ingestion and persistence complete.")
 
@@ -243,4 +519,4 @@ if __name__ == "__main__":
         results = query_retriever(query, index, chunks, k=3)
         for i, res in enumerate(results, start=1):
             preview = res[:300].replace("\n", " ")  # Increased preview length
-            print(f"Result {i}: {preview}...")
\ No newline at end of file
+            print(f"Result {i}: {preview}...")
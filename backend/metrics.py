@@ -0,0 +1,210 @@
+"""
+In-process latency histograms and counters, exported in the Prometheus text format.
+
+Pipeline code wraps each stage (convert, chunk, embed, index, load, search,
+lexical, generate) in ``with stage("search"):``. The elapsed time is observed
+in the ``rag_stage_seconds`` histogram and, when the current request started a
+breakdown with start_timings(), added to that request's per-stage totals as
+well. Stages that run in worker threads see the breakdown through the copied
+context (run_in_threadpool copies it; plain executors need copy_context()).
+
+Metrics are per process: docling conversions in the ingestion process pool are
+timed by the parent around the pool call.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import METRICS_SETTINGS
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+LATENCY_BUCKETS = tuple(sorted(float(b) for b in METRICS_SETTINGS.get("latency_buckets_s") or DEFAULT_BUCKETS))
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in values]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[slot] += 1
+            total[0] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(counts), total[0]) for key, (counts, total) in self._series.items())
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each pipeline stage, per timed call.", ("stage",))
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stage calls that raised.", ("stage",))
+HTTP_REQUEST_SECONDS = Histogram("rag_http_request_seconds", "API request latency until the response starts.", ("method", "route", "status"))
+UPSTREAM_REQUESTS = Counter("rag_upstream_requests_total", "Calls to the model endpoints (embeddings, chat), retries excluded.", ("service",))
+UPSTREAM_RETRIES = Counter("rag_upstream_retries_total", "Retried or fallback requests to the model endpoints.", ("service",))
+COLD_START_SECONDS = Gauge("rag_cold_start_seconds", "This worker's start-up time by phase (import, startup, converter_warmup).", ("phase",))
+UPSTREAM_FAILURES = Counter("rag_upstream_failures_total", "Calls to the model endpoints that failed after retries.", ("service",))
+INGEST_CHUNKS = Counter("rag_ingest_chunks_total", "Chunks cut from uploaded documents, kept or dropped as near-duplicates.", ("outcome",))
+DEDUP_TOKENS_SAVED = Counter("rag_dedup_tokens_saved_total", "Tokens of near-duplicate chunks that were not embedded.")
+QUERY_EMBED_BATCH_SIZE = Histogram("rag_query_embed_batch_size", "Queries per coalesced embeddings call.", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+QUERY_EMBED_WAIT_SECONDS = Histogram("rag_query_embed_wait_seconds", "Time a query waited to be batched before its embeddings call was sent.")
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("rag_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+def start_timings() -> Dict[str, float]:
+    """Collect a per-stage breakdown (seconds) for the current request; returns the dict stages add to."""
+    timings: Dict[str, float] = {}
+    _timings.set(timings)
+    return timings
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        with _timings_lock:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as one call of a pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def process_age() -> Optional[float]:
+    """
+    Seconds since this process started, from /proc (clock-tick resolution); None
+    where /proc is unavailable. Covers interpreter start-up and every import.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesized command name start at field 3; starttime is field 22
+            starttime = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - starttime / os.sysconf("SC_CLK_TCK"))
+
+
+def rounded(timings: Dict[str, float]) -> Dict[str, float]:
+    """A breakdown ready for a response body: milliseconds, rounded."""
+    with _timings_lock:
+        return {name: round(seconds * 1000.0, 2) for name, seconds in timings.items()}
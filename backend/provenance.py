@@ -0,0 +1,221 @@
+"""
+Columnar per-chunk provenance.
+
+A KB's ``provenance/`` directory holds one raw little-endian array per column,
+each with one row per chunk ID (a segmented file, see segmented_file): the chunk's document (``file_id``, its position
+in metadata["documents"]), its 1-based page range and its character offsets in
+the converted Markdown (-1 where unknown). Columns are appended alongside the
+chunk store and memory-mapped on open, so looking up a chunk's source is an
+array read, and a file/page filter is a vectorized mask over the columns that
+search turns into a FAISS ID selector.
+
+Chunks dropped at ingest as near-duplicates (see dedup) are kept as aliases:
+``aliases/`` holds the same columns plus ``canonical``, the chunk each one
+duplicates, so a filter matching an alias selects its canonical chunk and a
+citation can list every place the text occurred.
+"""
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import segmented_file
+
+
+PROVENANCE_DIR = "provenance"
+ALIASES_DIR = "aliases"
+COLUMNS: Dict[str, np.dtype] = {
+    "file_id": np.dtype("<i4"),
+    "page_start": np.dtype("<i4"),
+    "page_end": np.dtype("<i4"),
+    "char_start": np.dtype("<i8"),
+    "char_end": np.dtype("<i8"),
+}
+ALIAS_COLUMNS: Dict[str, np.dtype] = {**COLUMNS, "canonical": np.dtype("<i8")}
+
+
+def _column_path(kb_path: str, name: str, directory: str = PROVENANCE_DIR) -> str:
+    return os.path.join(kb_path, directory, f"{name}.bin")
+
+
+def documents_of(metadata: Dict[str, Any], chunk_count: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    A KB's per-document records; a chunk's file_id is its document's position here.
+    KBs from before these records get one per file, with a chunk range only when
+    there is a single file (then every chunk is from it).
+    """
+    documents = metadata.get("documents")
+    if documents is not None:
+        return list(documents)
+    files = metadata.get("files", [])
+    if len(files) == 1 and chunk_count is not None:
+        return [{"file": files[0], "first_chunk": 0, "chunk_count": chunk_count}]
+    return [{"file": name} for name in files]
+
+
+class Provenance:
+    """Memory-mapped provenance columns of one KB."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], files: Sequence[str], aliases: Optional[Dict[str, np.ndarray]] = None):
+        self.columns = columns
+        self.files = list(files)
+        self.aliases = aliases
+
+    def __len__(self) -> int:
+        return len(self.columns["file_id"])
+
+    @property
+    def nbytes(self) -> int:
+        columns = list(self.columns.values()) + list((self.aliases or {}).values())
+        return sum(c.nbytes for c in columns if not segmented_file.is_mapped(c))
+
+    def file_name(self, chunk_id: int) -> Optional[str]:
+        file_id = int(self.columns["file_id"][chunk_id])
+        return self.files[file_id] if 0 <= file_id < len(self.files) else None
+
+    def _row(self, columns: Dict[str, np.ndarray], i: int) -> Dict[str, Any]:
+        values = {name: int(columns[name][i]) for name in COLUMNS}
+        file_id = values["file_id"]
+        return {
+            "file": self.files[file_id] if 0 <= file_id < len(self.files) else None,
+            "page_start": values["page_start"] if values["page_start"] >= 0 else None,
+            "page_end": values["page_end"] if values["page_end"] >= 0 else None,
+            "char_start": values["char_start"] if values["char_start"] >= 0 else None,
+            "char_end": values["char_end"] if values["char_end"] >= 0 else None,
+        }
+
+    def row(self, chunk_id: int) -> Dict[str, Any]:
+        """Where a chunk came from: file name, page range and character offsets (None where unknown)."""
+        return self._row(self.columns, chunk_id)
+
+    def duplicates(self, chunk_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Other places the chunk's text occurred (its aliases), as row() does for the chunk itself."""
+        if not self.aliases:
+            return []
+        found = np.flatnonzero(self.aliases["canonical"] == chunk_id)[:limit]
+        return [self._row(self.aliases, int(i)) for i in found]
+
+    def _matching(self, columns: Dict[str, np.ndarray], files: Optional[Sequence[str]], pages: Optional[Tuple[int, int]]) -> np.ndarray:
+        allowed = np.ones(len(columns["file_id"]), dtype=bool)
+        if files is not None:
+            names = set(files)
+            wanted = [i for i, name in enumerate(self.files) if name in names]
+            allowed &= np.isin(columns["file_id"], wanted)
+        if pages is not None:
+            first, last = pages
+            page_start, page_end = columns["page_start"], columns["page_end"]
+            allowed &= (page_start >= 0) & (page_start <= last) & (page_end >= first)
+        return allowed
+
+    def mask(self, files: Optional[Sequence[str]] = None, pages: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Boolean mask over chunk IDs of the chunks in any of ``files`` whose page range
+        overlaps ``pages`` (first, last; inclusive), or with an alias that is. Chunks
+        with no page information never match a page filter.
+        """
+        allowed = self._matching(self.columns, files, pages)
+        if self.aliases and (files is not None or pages is not None):
+            canonical = self.aliases["canonical"][self._matching(self.aliases, files, pages)]
+            allowed[canonical[canonical < len(allowed)]] = True
+        return allowed
+
+
+def _rows(chunks: Sequence[str], file_id: int) -> Dict[str, np.ndarray]:
+    # Chunks cut by chunker.iter_chunks carry their spans; anything else is unknown (-1).
+    rows = {
+        name: np.fromiter((getattr(c, name, -1) for c in chunks), dtype=dtype, count=len(chunks))
+        for name, dtype in COLUMNS.items() if name != "file_id"
+    }
+    rows["file_id"] = np.full(len(chunks), file_id, dtype=COLUMNS["file_id"])
+    return rows
+
+
+def append_provenance(kb_path: str, chunks: Sequence[str], file_id: int) -> None:
+    """Append the provenance rows of newly stored chunks, all from document ``file_id``."""
+    os.makedirs(os.path.join(kb_path, PROVENANCE_DIR), exist_ok=True)
+    for name, values in _rows(chunks, file_id).items():
+        segmented_file.append(_column_path(kb_path, name), values.tobytes())
+
+
+def append_aliases(kb_path: str, spans: Sequence[Tuple[int, int, int, int]], file_id: int, canonical: Sequence[int]) -> None:
+    """Record near-duplicate chunks of document ``file_id``: their (page_start, page_end, char_start, char_end) and the chunk each duplicates."""
+    os.makedirs(os.path.join(kb_path, ALIASES_DIR), exist_ok=True)
+    table = np.asarray(spans, dtype=np.int64).reshape(-1, 4)
+    rows = {name: table[:, i] for i, name in enumerate(("page_start", "page_end", "char_start", "char_end"))}
+    rows["file_id"] = np.full(len(table), file_id)
+    rows["canonical"] = np.asarray(canonical, dtype=np.int64)
+    for name, dtype in ALIAS_COLUMNS.items():
+        segmented_file.append(_column_path(kb_path, name, ALIASES_DIR), rows[name].astype(dtype).tobytes())
+
+
+def alias_count(kb_path: str) -> int:
+    return segmented_file.size(_column_path(kb_path, "canonical", ALIASES_DIR)) // ALIAS_COLUMNS["canonical"].itemsize
+
+
+def truncate_aliases(kb_path: str, count: int) -> None:
+    """Drop alias rows past ``count`` (rolls back a failed append)."""
+    for name, dtype in ALIAS_COLUMNS.items():
+        segmented_file.truncate(_column_path(kb_path, name, ALIASES_DIR), count * dtype.itemsize)
+
+
+def _open_aliases(kb_path: str) -> Optional[Dict[str, np.ndarray]]:
+    count = alias_count(kb_path)
+    if not count:
+        return None
+    columns = {}
+    for name, dtype in ALIAS_COLUMNS.items():
+        path = _column_path(kb_path, name, ALIASES_DIR)
+        if segmented_file.size(path) // dtype.itemsize != count:
+            return None
+        columns[name] = segmented_file.open_array(path, dtype)
+    return columns
+
+
+def provenance_count(kb_path: str) -> int:
+    """Rows stored: 0 if the KB has none, -1 if its columns disagree."""
+    sizes = set()
+    for name, dtype in COLUMNS.items():
+        sizes.add(segmented_file.size(_column_path(kb_path, name)) // dtype.itemsize)
+    return sizes.pop() if len(sizes) == 1 else -1
+
+
+def truncate_provenance(kb_path: str, count: int) -> None:
+    """Drop rows past ``count`` (rolls back a failed append)."""
+    for name, dtype in COLUMNS.items():
+        segmented_file.truncate(_column_path(kb_path, name), count * dtype.itemsize)
+
+
+def _from_documents(metadata: Dict[str, Any], count: int) -> Dict[str, np.ndarray]:
+    """File IDs recovered from per-document chunk ranges; pages and offsets are unknown."""
+    columns = {name: np.full(count, -1, dtype=dtype) for name, dtype in COLUMNS.items()}
+    for file_id, doc in enumerate(documents_of(metadata, count)):
+        first = int(doc.get("first_chunk", 0))
+        columns["file_id"][first:first + int(doc.get("chunk_count", 0))] = file_id
+    return columns
+
+
+def backfill_provenance(kb_path: str, metadata: Dict[str, Any], count: int) -> None:
+    """Write provenance for the first ``count`` chunks of a KB built before it was recorded."""
+    if provenance_count(kb_path) == count:
+        return
+    os.makedirs(os.path.join(kb_path, PROVENANCE_DIR), exist_ok=True)
+    for name, values in _from_documents(metadata, count).items():
+        segmented_file.write(_column_path(kb_path, name), values.tobytes())
+
+
+def open_provenance(kb_path: str, metadata: Dict[str, Any], count: int) -> Provenance:
+    """
+    Memory-map a KB's provenance for its ``count`` chunks. A KB without stored
+    provenance (or out of step with its chunks) gets columns derived in memory from
+    its metadata, so citations and file filters still work until its next upload.
+    """
+    files = [doc["file"] for doc in documents_of(metadata, count)]
+    if provenance_count(kb_path) != count or count == 0:
+        return Provenance(_from_documents(metadata, count), files)
+    columns = {name: segmented_file.open_array(_column_path(kb_path, name), dtype) for name, dtype in COLUMNS.items()}
+    return Provenance(columns, files, _open_aliases(kb_path))
+
+
+def provenance_paths(kb_path: str) -> List[str]:
+    """Segmented files holding a KB's provenance, its aliases included."""
+    return [_column_path(kb_path, name) for name in COLUMNS] + [_column_path(kb_path, name, ALIASES_DIR) for name in ALIAS_COLUMNS]
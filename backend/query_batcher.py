@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import QUERY_BATCHING_SETTINGS
+from embedding_providers import get_provider
+from metrics import QUERY_EMBED_BATCH_SIZE, QUERY_EMBED_WAIT_SECONDS
+
+
+class _Request:
+    __slots__ = ("texts", "enqueued", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.enqueued = time.monotonic()
+        self.future: Future = Future()
+
+
+class QueryBatcher:
+    """
+    Coalesces concurrent query embeddings into batched calls.
+
+    Each chat request embeds one query; under load those become many single-input
+    round trips. A caller's texts are queued instead, and a dispatcher thread
+    gathers queued requests until ``window_s`` has passed since the first of them
+    or ``max_batch_size`` texts are collected, then sends them as one embed_fn call
+    on a small pool (``max_concurrency`` batches in flight) and hands each caller
+    its vectors. A request that alone fills a batch is sent straight away; a
+    failed batch fails every request in it.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], window_s: float = 0.005, max_batch_size: int = 32, max_concurrency: int = 4):
+        self.embed_fn = embed_fn
+        self.window_s = window_s
+        self.max_batch_size = max_batch_size
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="query-embed")
+        self._lock = threading.Lock()
+        self.totals = {"requests": 0, "texts": 0, "batches": 0, "wait_s": 0.0}
+        threading.Thread(target=self._dispatch, name="query-embed-dispatcher", daemon=True).start()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch_size:
+            self._observe([_Request(texts)])
+            return self.embed_fn(texts)
+        request = _Request(texts)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _dispatch(self) -> None:
+        carry: Optional[_Request] = None
+        while True:
+            first = carry or self._queue.get()
+            carry = None
+            batch, size = [first], len(first.texts)
+            deadline = first.enqueued + self.window_s
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + len(request.texts) > self.max_batch_size:
+                    carry = request
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._observe(batch)
+            self._pool.submit(self._send, batch)
+
+    def _observe(self, batch: List[_Request]) -> None:
+        now = time.monotonic()
+        waits = [now - r.enqueued for r in batch]
+        QUERY_EMBED_BATCH_SIZE.observe(sum(len(r.texts) for r in batch))
+        for wait in waits:
+            QUERY_EMBED_WAIT_SECONDS.observe(wait)
+        with self._lock:
+            self.totals["requests"] += len(batch)
+            self.totals["texts"] += sum(len(r.texts) for r in batch)
+            self.totals["batches"] += 1
+            self.totals["wait_s"] += sum(waits)
+
+    def _send(self, batch: List[_Request]) -> None:
+        try:
+            vectors = self.embed_fn([text for r in batch for text in r.texts])
+        except BaseException as e:
+            for r in batch:
+                r.future.set_exception(e)
+            return
+        start = 0
+        for r in batch:
+            r.future.set_result(vectors[start:start + len(r.texts)])
+            start += len(r.texts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests, batches = self.totals["requests"], self.totals["batches"]
+            return {
+                "window_ms": round(self.window_s * 1000, 3),
+                "max_batch_size": self.max_batch_size,
+                "requests": requests,
+                "batches": batches,
+                "mean_batch_size": round(self.totals["texts"] / batches, 2) if batches else 0.0,
+                "mean_wait_ms": round(self.totals["wait_s"] * 1000 / requests, 3) if requests else 0.0,
+            }
+
+
+_batcher: Optional[QueryBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_query_batcher() -> Optional[QueryBatcher]:
+    """The process-wide query batcher in front of the embedding provider, or None when disabled in config."""
+    global _batcher
+    if not QUERY_BATCHING_SETTINGS.get("enabled", True):
+        return None
+    with _batcher_lock:
+        if _batcher is None:
+            max_batch_size = int(QUERY_BATCHING_SETTINGS.get("max_batch_size", 32))
+            _batcher = QueryBatcher(
+                lambda texts: get_provider().embed_queries(texts, batch_size=max_batch_size),
+                window_s=float(QUERY_BATCHING_SETTINGS.get("window_ms", 5)) / 1000,
+                max_batch_size=max_batch_size,
+                max_concurrency=int(QUERY_BATCHING_SETTINGS.get("max_concurrency", 4)),
+            )
+        return _batcher
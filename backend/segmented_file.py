@@ -0,0 +1,225 @@
+"""
+Append-only files stored as immutable parts.
+
+A KB's per-chunk stores (chunk store, raw vectors, provenance and alias columns,
+MinHash signatures) only ever grow at the end or are cut back to an earlier
+length. Each is kept as a directory of part files, each named by the byte offset
+it starts at:
+
+  vectors.f32/0000000000000000
+  vectors.f32/0000000000786432
+
+An append writes a new part and leaves existing parts untouched, so a KB
+generation (see snapshots) hard-links the parts it inherits and an upload only
+writes its own bytes. The newest two parts are merged while the newer is at least
+as large as the one before it, which keeps O(log n) parts per file at an
+amortized O(log n) rewrites per byte. A truncate deletes whole parts and rewrites
+the one it cuts into as a new file, so an inode shared with another generation
+is never changed.
+
+Readers memory-map every part: a file of one part opens as a plain np.memmap,
+several as a SegmentedArray over their maps, without copying. A plain file at the
+path (written before parts existed) reads as a single part and is moved into a
+part directory, by rename, on its first change.
+"""
+import os
+import shutil
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+
+_COPY_BLOCK = 1 << 20
+
+
+def _part_name(offset: int) -> str:
+    return f"{offset:016d}"
+
+
+def parts(path: str) -> List[Tuple[int, str]]:
+    """(start offset, file) of each part of ``path``, in order; a plain file is one part at 0."""
+    if os.path.isdir(path):
+        return [(int(n), os.path.join(path, n)) for n in sorted(os.listdir(path)) if n.isdigit()]
+    if os.path.isfile(path):
+        return [(0, path)]
+    return []
+
+
+def size(path: str) -> int:
+    """Logical size in bytes; 0 if the file does not exist."""
+    found = parts(path)
+    if not found:
+        return 0
+    offset, last = found[-1]
+    return offset + os.path.getsize(last)
+
+
+def remove(path: str) -> None:
+    """Delete the file and all its parts, if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _to_parts(path: str) -> None:
+    # A plain file becomes part 0 of a directory at the same path: renames only, no copy.
+    if not os.path.isfile(path):
+        return
+    tmp = f"{path}.parts.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    os.rename(path, os.path.join(tmp, _part_name(0)))
+    os.rename(tmp, path)
+
+
+def _write_part(path: str, offset: int, sources: Sequence[Union[bytes, Tuple[str, int]]]) -> None:
+    # Written under a temporary name and renamed into place, so a part is never seen half-written.
+    name = _part_name(offset)
+    tmp = os.path.join(path, f".{name}.tmp")
+    with open(tmp, "wb") as out:
+        for source in sources:
+            if isinstance(source, bytes):
+                out.write(source)
+                continue
+            part, nbytes = source
+            with open(part, "rb") as f:
+                while nbytes > 0:
+                    block = f.read(min(nbytes, _COPY_BLOCK))
+                    if not block:
+                        break
+                    out.write(block)
+                    nbytes -= len(block)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def _compact(path: str) -> None:
+    found = parts(path)
+    while len(found) >= 2:
+        (offset, previous), (_, last) = found[-2], found[-1]
+        previous_size, last_size = os.path.getsize(previous), os.path.getsize(last)
+        if last_size < previous_size:
+            return
+        _write_part(path, offset, [(previous, previous_size), (last, last_size)])
+        os.remove(last)
+        found.pop()
+
+
+def write(path: str, data: bytes) -> None:
+    """Replace the file with ``data`` as a single part."""
+    remove(path)
+    os.makedirs(path)
+    if data:
+        _write_part(path, 0, [data])
+
+
+def append(path: str, data: bytes) -> None:
+    """Append ``data`` as a new part (creating the file if needed)."""
+    _to_parts(path)
+    os.makedirs(path, exist_ok=True)
+    if data:
+        _write_part(path, size(path), [data])
+        _compact(path)
+
+
+def truncate(path: str, nbytes: int) -> None:
+    """Cut the file back to its first ``nbytes`` bytes."""
+    if size(path) <= nbytes:
+        return
+    _to_parts(path)
+    for offset, part in reversed(parts(path)):
+        if offset >= nbytes:
+            os.remove(part)
+            continue
+        # The part may be shared with another generation: write its kept prefix as a new file.
+        _write_part(path, offset, [(part, nbytes - offset)])
+        return
+
+
+class SegmentedArray(NDArrayOperatorsMixin):
+    """
+    Read-only rows of several memory-mapped parts, indexed as one array. Integer,
+    slice and integer-array indexing read only the parts they touch (a slice within
+    one part is a view of its map); anything else goes through a concatenated copy.
+    """
+
+    def __init__(self, arrays: Sequence[np.ndarray]):
+        self.arrays = list(arrays)
+        self._starts = np.cumsum([0] + [len(a) for a in self.arrays])
+        self.dtype = self.arrays[0].dtype
+        self.shape: Tuple[int, ...] = (int(self._starts[-1]), *self.arrays[0].shape[1:])
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = np.concatenate(self.arrays)
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def _part_of(self, i):
+        return np.searchsorted(self._starts, i, side="right") - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            i = int(key) + (len(self) if key < 0 else 0)
+            if not 0 <= i < len(self):
+                raise IndexError("index out of range")
+            p = int(self._part_of(i))
+            return self.arrays[p][i - self._starts[p]]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            if stop <= start:
+                return np.empty((0, *self.shape[1:]), dtype=self.dtype)
+            first, last = int(self._part_of(start)), int(self._part_of(stop - 1))
+            pieces = [
+                self.arrays[p][max(start - self._starts[p], 0):stop - self._starts[p]]
+                for p in range(first, last + 1)
+            ]
+            return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+        if isinstance(key, (list, np.ndarray)):
+            ids = np.asarray(key)
+            if ids.dtype.kind in "iu" or ids.size == 0:
+                ids = ids.astype(np.int64)
+                ids = np.where(ids < 0, ids + len(self), ids)
+                if ids.size and (ids.min() < 0 or ids.max() >= len(self)):
+                    raise IndexError("index out of range")
+                which = self._part_of(ids)
+                out = np.empty(ids.shape + self.shape[1:], dtype=self.dtype)
+                for p in np.unique(which):
+                    selected = which == p
+                    out[selected] = self.arrays[p][ids[selected] - self._starts[p]]
+                return out
+        return np.asarray(self)[key]
+
+
+def is_mapped(array) -> bool:
+    """True for arrays opened by open_array from disk, whose pages live in the page cache rather than the heap."""
+    return isinstance(array, (np.memmap, SegmentedArray))
+
+
+def open_array(path: str, dtype, row_shape: Tuple[int, ...] = ()) -> np.ndarray:
+    """
+    Memory-map the file as an array of ``dtype`` rows of ``row_shape``. Callers check
+    that size() is a whole number of rows. A missing or empty file gives an empty array.
+    """
+    dtype = np.dtype(dtype)
+    row_bytes = dtype.itemsize * int(np.prod(row_shape, dtype=np.int64))
+    arrays = []
+    for _, part in parts(path):
+        nbytes = os.path.getsize(part)
+        if nbytes:
+            arrays.append(np.memmap(part, dtype=dtype, mode="r", shape=(nbytes // row_bytes, *row_shape)))
+    if not arrays:
+        return np.empty((0, *row_shape), dtype=dtype)
+    return arrays[0] if len(arrays) == 1 else SegmentedArray(arrays)  # type: ignore[return-value]
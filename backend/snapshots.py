@@ -0,0 +1,265 @@
+"""
+Copy-on-write KB generations.
+
+A KB directory holds numbered generations under ``generations/`` and a
+``CURRENT`` file naming the one to serve:
+
+  indices/<kb>/CURRENT                  "g00000003"
+  indices/<kb>/generations/g00000003/   index.faiss, chunks.bin, metadata.json, bm25/, ...
+
+Published generations are never modified. A writer takes the KB's lock, clones
+the current generation into a staging directory, changes the clone, and
+publishes it by renaming it into place and atomically replacing CURRENT. The
+clone hard-links every file that is never changed in place (the append-only
+stores are segmented files, see segmented_file): it copies only metadata.json,
+and an upload writes its own chunks and the new index rather than the whole KB.
+A reader resolves CURRENT once and loads everything from that generation, so it
+never sees a new index with old chunks or a half-written file, and never waits
+on the writers' lock. It holds a lease on the generation it loaded (a shared
+flock on its ``.lease`` file, see acquire_lease) for as long as it serves from
+it. After a publish, generations more than ``keep_generations`` back are
+deleted once no reader holds their lease and they were superseded at least
+``gc_grace_s`` ago (covering short reads, such as a metadata lookup, that take
+no lease); one still leased is collected by a later publish.
+
+KBs written before generations existed keep their files directly in the KB
+directory and are served from there until their first write, which clones them
+into generation 1.
+"""
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import IO, Iterator, List, Optional
+
+from ann_index import VECTORS_FILE
+from bm25_index import BM25_DIR
+from chunk_store import CHUNKS_FILE, offsets_path
+from config import SNAPSHOT_SETTINGS
+from dedup import DEDUP_DIR
+from provenance import ALIASES_DIR, PROVENANCE_DIR
+
+
+INDEX_FILE = "index.faiss"
+METADATA_FILE = "metadata.json"
+CURRENT_FILE = "CURRENT"
+GENERATIONS_DIR = "generations"
+LOCK_FILE = ".lock"
+LEASE_FILE = ".lease"
+_RESERVED = {CURRENT_FILE, GENERATIONS_DIR, LOCK_FILE}
+_STAGING_PREFIX = ".staging-"
+_TRASH_PREFIX = ".trash-"
+
+# Never modified in place -- replaced whole (write_index, BM25 segment saves) or made of
+# immutable parts (segmented_file) -- so a staging clone shares them by hard link and an
+# upload writes only what it adds. Anything else (metadata.json) is rewritten in place and copied.
+_LINKED = {
+    INDEX_FILE, BM25_DIR, CHUNKS_FILE, os.path.basename(offsets_path(CHUNKS_FILE)),
+    VECTORS_FILE, PROVENANCE_DIR, ALIASES_DIR, DEDUP_DIR,
+}
+
+KEEP_GENERATIONS = max(1, int(SNAPSHOT_SETTINGS.get("keep_generations", 2)))
+GC_GRACE_S = float(SNAPSHOT_SETTINGS.get("gc_grace_s", 60))
+
+
+def _generation_name(number: int) -> str:
+    return f"g{number:08d}"
+
+
+def _generation_number(name: str) -> Optional[int]:
+    return int(name[1:]) if name.startswith("g") and name[1:].isdigit() else None
+
+
+def current_generation(kb_path: str) -> Optional[str]:
+    """Name of the KB's published generation, or None if it has none yet."""
+    try:
+        with open(os.path.join(kb_path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_dir(kb_path: str) -> str:
+    """Directory holding the files a reader should load: the current generation, or the KB directory itself before its first one."""
+    generation = current_generation(kb_path)
+    return os.path.join(kb_path, GENERATIONS_DIR, generation) if generation else kb_path
+
+
+def current_path(kb_path: str, name: str) -> str:
+    return os.path.join(current_dir(kb_path), name)
+
+
+def _legacy_entries(kb_path: str) -> List[str]:
+    return [n for n in os.listdir(kb_path) if n not in _RESERVED and not n.startswith(".")]
+
+
+def _clone(src: str, dest: str, names: List[str]) -> None:
+    os.makedirs(dest)
+    for name in names:
+        if name.startswith("."):
+            continue
+        source, target = os.path.join(src, name), os.path.join(dest, name)
+        if name in _LINKED:
+            if os.path.isdir(source):
+                shutil.copytree(source, target, copy_function=os.link)
+            else:
+                os.link(source, target)
+        elif os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy2(source, target)
+
+
+def _generations(kb_path: str) -> List[int]:
+    generations_dir = os.path.join(kb_path, GENERATIONS_DIR)
+    if not os.path.isdir(generations_dir):
+        return []
+    return sorted(n for n in map(_generation_number, os.listdir(generations_dir)) if n is not None)
+
+
+@contextmanager
+def _locked(kb_path: str) -> Iterator[None]:
+    # flock excludes writers in other processes (API workers) as well as other threads here.
+    with open(os.path.join(kb_path, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def acquire_lease(kb_dir: str) -> IO:
+    """
+    Register a reader of a generation (or of a KB directory from before generations):
+    collect_garbage leaves it in place until the returned file is closed. Raises
+    FileNotFoundError if the generation has been, or is being, collected.
+    """
+    path = os.path.join(kb_dir, LEASE_FILE)
+    lease = open(path, "a")
+    try:
+        fcntl.flock(lease.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        # Collection holds the lease exclusively until the generation is renamed away,
+        # so a lease taken after that is on a file no longer at this path.
+        if os.stat(path).st_ino != os.fstat(lease.fileno()).st_ino:
+            raise FileNotFoundError(f"Generation {kb_dir} was collected.")
+    except BlockingIOError:
+        lease.close()
+        raise FileNotFoundError(f"Generation {kb_dir} is being collected.")
+    except BaseException:
+        lease.close()
+        raise
+    return lease
+
+
+@contextmanager
+def _unleased(directory: str) -> Iterator[bool]:
+    # Yields True while holding the directory's lease exclusively, False if a reader holds it.
+    try:
+        lease = open(os.path.join(directory, LEASE_FILE), "a")
+    except FileNotFoundError:
+        yield False
+        return
+    with lease:
+        try:
+            fcntl.flock(lease.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+@contextmanager
+def write_generation(kb_path: str) -> Iterator[str]:
+    """
+    Open the next generation of a KB for writing: yields a staging directory holding a
+    copy of the current generation. If the block completes, the staging directory is
+    published as the new current generation; if it raises, it is discarded and the KB
+    is unchanged. Writers to one KB are serialized, across processes too.
+    """
+    if not os.path.isdir(kb_path):
+        raise FileNotFoundError(f"KB directory {kb_path} does not exist.")
+    with _locked(kb_path):
+        generations_dir = os.path.join(kb_path, GENERATIONS_DIR)
+        os.makedirs(generations_dir, exist_ok=True)
+        # Anything still staging or half-deleted belongs to a writer that died: we hold the lock.
+        for name in os.listdir(generations_dir):
+            if name.startswith((_STAGING_PREFIX, _TRASH_PREFIX)):
+                shutil.rmtree(os.path.join(generations_dir, name), ignore_errors=True)
+
+        base = current_generation(kb_path)
+        staging = os.path.join(generations_dir, f"{_STAGING_PREFIX}{uuid.uuid4().hex}")
+        if base:
+            base_dir = os.path.join(generations_dir, base)
+            _clone(base_dir, staging, os.listdir(base_dir))
+        else:
+            _clone(kb_path, staging, _legacy_entries(kb_path))
+        try:
+            yield staging
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        open(os.path.join(staging, LEASE_FILE), "a").close()
+        numbers = _generations(kb_path)
+        name = _generation_name((numbers[-1] if numbers else 0) + 1)
+        published = os.path.join(generations_dir, name)
+        os.rename(staging, published)
+        os.utime(published)  # its mtime marks when the previous generation was superseded
+        tmp_path = os.path.join(kb_path, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp_path, os.path.join(kb_path, CURRENT_FILE))
+        collect_garbage(kb_path)
+
+
+def collect_garbage(kb_path: str, keep: Optional[int] = None, grace_s: Optional[float] = None) -> List[str]:
+    """
+    Delete generations (and pre-generation files) that are more than ``keep`` behind the
+    current one, were superseded over ``grace_s`` seconds ago and are not leased by a
+    reader. Returns what was removed. Call with the KB's write lock held (write_generation does).
+    """
+    keep = KEEP_GENERATIONS if keep is None else keep
+    grace_s = GC_GRACE_S if grace_s is None else grace_s
+    generations_dir = os.path.join(kb_path, GENERATIONS_DIR)
+    current = current_generation(kb_path)
+    numbers = _generations(kb_path)
+    if not current or _generation_number(current) not in numbers:
+        return []
+    now = time.time()
+
+    def superseded_long_ago(successor: int) -> bool:
+        try:
+            return now - os.path.getmtime(os.path.join(generations_dir, _generation_name(successor))) > grace_s
+        except FileNotFoundError:
+            return False
+
+    # Files from before the KB had generations are superseded by its oldest one (checked
+    # before that one is collected below).
+    legacy_superseded = len(numbers) >= keep and superseded_long_ago(numbers[0])
+    removed = []
+    retained = set(numbers[-keep:])
+    for i, number in enumerate(numbers):
+        if number in retained or not superseded_long_ago(numbers[i + 1]):
+            continue
+        name = _generation_name(number)
+        path = os.path.join(generations_dir, name)
+        trash = os.path.join(generations_dir, f"{_TRASH_PREFIX}{name}")
+        with _unleased(path) as unused:
+            if not unused:
+                continue
+            # Moved aside under the exclusive lease, so no reader can lease it from here on.
+            os.rename(path, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+        removed.append(name)
+    if legacy_superseded:
+        with _unleased(kb_path) as unused:
+            for name in _legacy_entries(kb_path) if unused else []:
+                path = os.path.join(kb_path, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed.append(name)
+    return removed
@@ -0,0 +1,91 @@
+"""
+Shared test setup.
+
+The backend runs against the bench stub model server (bench/stub_server.py).
+It reads its config and resolves its data paths (indices/, data/) relative to
+the working directory at import time, so before any test module imports it the
+endpoint settings, which the committed config.yaml leaves blank, are pointed at
+the stub and the tests move to a scratch directory.
+
+    cd backend && python -m pytest -q
+"""
+import os
+import shutil
+import sys
+import tempfile
+from typing import Iterator, Optional
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "bench"))
+
+import stub_server  # noqa: E402
+
+STUB_DIM = 16
+
+_stub = stub_server.StubConfig(dim=STUB_DIM)
+_server = None
+_workdir: Optional[str] = None
+
+
+def pytest_configure(config):
+    global _server, _workdir
+    from config import CONFIG
+
+    _server = stub_server.start(_stub)
+    openai = CONFIG["azure"]["openai"]
+    openai.update({"api_base": f"http://127.0.0.1:{_server.server_port}", "api_key": "tests", "api_version": "2024-06-01"})
+    openai["llm"].update({"deployment_name": "tests-chat", "model": "tests-chat"})
+    openai["embedding"].update({"deployment_name": "tests-embed", "model": "tests-embed", "api_version": "2024-06-01"})
+    CONFIG["embedding_cache"]["enabled"] = False  # tests count what reaches the stub
+    CONFIG["conversion_cache"]["enabled"] = False  # tests stand in converters of their own
+    CONFIG["kb_cache"]["prewarm"] = []
+    _workdir = tempfile.mkdtemp(prefix="rag-tests-")
+    os.chdir(_workdir)
+
+
+def pytest_unconfigure(config):
+    if _server is not None:
+        _server.shutdown()
+    if _workdir is not None:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def stub() -> Iterator[stub_server.StubConfig]:
+    """The stub server's settings and request counters; throttling is cleared after each test."""
+    yield _stub
+    _stub.throttle_embeddings = 0
+
+
+@pytest.fixture
+def embeddings_url() -> str:
+    return f"http://127.0.0.1:{_server.server_port}/openai/deployments/tests-embed/embeddings?api-version=2024-06-01"
+
+
+@pytest.fixture
+def ingest():
+    """Append one document's chunks to a KB as an upload does: deduplicated, embedded by the stub, in a new generation."""
+    import md_rag
+    from chunk_store import CHUNKS_FILE
+    from snapshots import INDEX_FILE, METADATA_FILE, write_generation
+
+    def run(kb_path, file_name, chunks):
+        os.makedirs(kb_path, exist_ok=True)
+        deduplicator = md_rag.open_deduplicator(kb_path)
+        if deduplicator is not None:
+            chunks = deduplicator.filter(chunks)
+        with write_generation(kb_path) as staging:
+            return md_rag.append_chunk_batches_to_index(
+                md_rag.embed_chunk_stream(chunks),
+                index_path=os.path.join(staging, INDEX_FILE),
+                chunks_path=os.path.join(staging, CHUNKS_FILE),
+                metadata_path=os.path.join(staging, METADATA_FILE),
+                file_name=file_name,
+                deduplicator=deduplicator,
+            )
+
+    return run
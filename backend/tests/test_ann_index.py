@@ -0,0 +1,100 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+import ann_index
+from ann_index import backfill_vectors, build_index, index_type_of, measure_recall, needs_rebuild, open_vectors, search_params
+
+
+DIM = 16
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_built_indices_map_ids_to_rows_and_report_recall(index_type):
+    vectors = _vectors(2000)
+    index, info = build_index(vectors, index_type)
+
+    assert isinstance(index, faiss.IndexIDMap2) and index.ntotal == 2000
+    assert info["type"] == index_type_of(index) == index_type
+    _, ids = index.search(vectors[[5, 1234]], 1, params=search_params(index))
+    assert ids[:, 0].tolist() == [5, 1234]
+    assert measure_recall(index, vectors, k=10, n_queries=50)["recall_at_k"] >= 0.8
+
+
+def test_too_few_vectors_to_train_steps_down_to_a_simpler_type():
+    index, info = build_index(_vectors(50), "ivf_pq")
+    assert info["type"] == "flat"
+    index, info = build_index(_vectors(500), "ivf_pq")
+    assert info["type"] == "ivf_flat"
+    assert info["params"]["nlist"] <= 500 // 39
+
+
+def test_auto_rebuilds_when_the_kb_outgrows_its_index_type(monkeypatch):
+    monkeypatch.setitem(ann_index.VECTOR_DB_SETTINGS, "index_type", "auto")
+    monkeypatch.setitem(ann_index._AUTO, "flat_max", 100)
+    index, info = build_index(_vectors(80))
+    assert info["type"] == "flat"
+    assert not needs_rebuild(index, info, 100)
+    assert needs_rebuild(index, info, 101)
+
+
+def test_search_params_apply_per_request_overrides():
+    index, _ = build_index(_vectors(2000), "ivf_flat")
+    assert search_params(index, nprobe=3).nprobe == 3
+    index, _ = build_index(_vectors(200), "hnsw")
+    assert search_params(index, ef_search=7).efSearch == 7
+    index, _ = build_index(_vectors(20), "flat")
+    assert search_params(index) is None
+
+
+def test_backfill_writes_vectors_in_chunk_id_order(tmp_path):
+    vectors = _vectors(4)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    index.add_with_ids(vectors[[2, 0, 3, 1]], np.array([2, 0, 3, 1], dtype=np.int64))
+    path = str(tmp_path / ann_index.VECTORS_FILE)
+
+    assert backfill_vectors(index, path)
+    np.testing.assert_array_equal(open_vectors(path, DIM), vectors)
+    hnsw, _ = build_index(_vectors(200), "hnsw")
+    assert not backfill_vectors(hnsw, str(tmp_path / "other.f32"))
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+@pytest.mark.parametrize("quantization", ["sq8", "fp16"])
+def test_quantized_indices_are_smaller_and_keep_recall(tmp_path, index_type, quantization):
+    vectors = _vectors(2000)
+    plain, _ = build_index(vectors, index_type, "none")
+    index, info = build_index(vectors, index_type, quantization)
+
+    assert info["quantization"] == ann_index.quantization_of(index) == quantization
+    assert not ann_index.is_exact(index)
+    plain_path, path = str(tmp_path / "plain.faiss"), str(tmp_path / "quantized.faiss")
+    ann_index.write_index(plain, plain_path)
+    ann_index.write_index(index, path)
+    assert os.path.getsize(path) < os.path.getsize(plain_path)
+    assert measure_recall(index, vectors, k=10, n_queries=50)["recall_at_k"] >= 0.8
+
+
+def test_memory_mapped_indices_search_like_the_original_and_count_less_heap(tmp_path):
+    vectors = _vectors(2000)
+    index, _ = build_index(vectors, "flat", "sq8")
+    path = str(tmp_path / "index.faiss")
+    ann_index.write_index(index, path)
+
+    mapped = ann_index.read_index(path, mmap=True)
+    np.testing.assert_array_equal(mapped.search(vectors[:5], 3)[1], index.search(vectors[:5], 3)[1])
+    assert ann_index.resident_nbytes(mapped, path, mmap=True) == os.path.getsize(path) - 2000 * DIM  # sq8 codes: a byte per dim
+    assert ann_index.resident_nbytes(mapped, path, mmap=False) == os.path.getsize(path)
+
+
+def test_changing_the_quantization_setting_asks_for_a_rebuild(monkeypatch):
+    index, info = build_index(_vectors(200), "flat", "none")
+    assert not needs_rebuild(index, info, 200)
+    monkeypatch.setitem(ann_index.VECTOR_DB_SETTINGS, "quantization", "sq8")
+    assert needs_rebuild(index, info, 200)
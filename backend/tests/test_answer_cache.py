@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import md_rag
+from answer_cache import AnswerCache, CachedAnswer
+from stub_server import stub_vector
+
+from conftest import STUB_DIM
+
+
+def _entry(query, top_k=3, search_params=()):
+    return CachedAnswer(query=query, answer=f"answer to {query}", citations=[], top_k=top_k, response_time=1.5, search_params=search_params)
+
+
+def _near(vector, seed, noise=0.05):
+    return vector + noise * np.random.default_rng(seed).standard_normal(len(vector)).astype(np.float32)
+
+
+def test_lookup_needs_the_threshold_and_matching_retrieval_settings():
+    cache = AnswerCache(threshold=0.9)
+    v = np.array(stub_vector("q", STUB_DIM), dtype=np.float32)
+    cache.store("kb", ("sig",), v, _entry("q", search_params=(None, None)))
+
+    entry, similarity = cache.lookup("kb", ("sig",), _near(v, 0), 3, (None, None))
+    assert entry.query == "q" and similarity >= 0.9
+    assert cache.lookup("kb", ("sig",), np.array(stub_vector("other", STUB_DIM)), 3, (None, None)) is None
+    assert cache.lookup("kb", ("sig",), v, 5, (None, None)) is None
+    assert cache.lookup("kb", ("sig",), v, 3, (32, None)) is None
+    assert cache.lookup("other-kb", ("sig",), v, 3, (None, None)) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["llm_seconds_saved"] == 1.5
+
+
+def test_entries_are_dropped_when_the_kb_changes_or_expire():
+    cache = AnswerCache(threshold=0.9, ttl_s=60)
+    v = np.array(stub_vector("q", STUB_DIM), dtype=np.float32)
+    cache.store("kb", ("v1",), v, _entry("q"))
+    assert cache.lookup("kb", ("v2",), v, 3) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+
+    cache.store("kb", ("v2",), v, _entry("q"))
+    cache._kbs["kb"].entries[0].created_at -= 61
+    assert cache.lookup("kb", ("v2",), v, 3) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_answers_are_evicted_beyond_the_limits():
+    cache = AnswerCache(threshold=0.99, max_entries_per_kb=2, max_entries=3)
+    vectors = {q: np.array(stub_vector(q, STUB_DIM), dtype=np.float32) for q in "abcd"}
+    cache.store("kb1", (), vectors["a"], _entry("a"))
+    cache.store("kb1", (), vectors["b"], _entry("b"))
+    cache.lookup("kb1", (), vectors["a"], 3)
+    cache.store("kb1", (), vectors["c"], _entry("c"))  # over the per-KB limit: b is least recent
+    assert [e.query for e in cache._kbs["kb1"].entries] == ["a", "c"]
+
+    cache.store("kb2", (), vectors["d"], _entry("d"))
+    cache.store("kb2", (), vectors["a"], _entry("a2"))  # over the global limit
+    assert cache.stats()["entries"] == 3 and cache.stats()["evictions"] == 2
+
+
+@pytest.fixture
+def client():
+    chunks = ["Invoices are due in 30 days.", "Late fees are 2% per month."]
+    kb_path = os.path.join(app_module.INDICES_DIR, "answers-kb")
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in chunks]), chunks,
+        index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+        metadata_path=os.path.join(kb_path, "metadata.json"), files=["billing.pdf"],
+    )
+    with TestClient(app_module.app) as client:
+        yield client
+    app_module._kb_changed("answers-kb")
+
+
+def test_a_repeated_question_is_answered_from_the_cache_until_the_kb_changes(client):
+    def ask():
+        return client.post("/api/kbs/answers-kb/chat", json={"message": "When are invoices due?", "top_k": 1}).json()
+
+    first, second = ask(), ask()
+    assert first["cache_hit"] is False
+    assert second["cache_hit"] is True and second["answer"] == first["answer"]
+    assert second["citations"] == first["citations"]
+
+    app_module._kb_changed("answers-kb")
+    assert ask()["cache_hit"] is False
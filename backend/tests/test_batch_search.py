@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import bm25_index
+import md_rag
+from bm25_index import BM25Index
+from faiss_retriever import hybrid_search, hybrid_search_batch
+from stub_server import ANSWER, stub_vector
+
+from conftest import STUB_DIM
+
+
+CHUNKS = [f"Section {i}: report item {i} covers topic T-{i % 5}." for i in range(30)]
+QUERIES = [CHUNKS[3], "topic T-2", CHUNKS[17], "report item 25", "unrelated words"]
+
+
+@pytest.fixture
+def kb():
+    kb_path = os.path.join(app_module.INDICES_DIR, "batch-kb")
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in CHUNKS]), CHUNKS,
+        index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+        metadata_path=os.path.join(kb_path, "metadata.json"), files=["report.pdf"],
+    )
+    bm25_index.rebuild(kb_path, CHUNKS)
+    yield kb_path
+    app_module.kb_cache.invalidate("batch-kb")
+
+
+@pytest.mark.parametrize("mode", ["hybrid", "similarity"])
+def test_batch_results_match_single_query_search(kb, stub, monkeypatch, mode):
+    monkeypatch.setitem(app_module.RETRIEVAL_SETTINGS, "mode", mode)
+    index, _ = md_rag.load_index_and_chunks(os.path.join(kb, "index.faiss"), os.path.join(kb, "chunks.bin"))
+    lexical = BM25Index.load(kb)
+
+    requests_before = stub.embed_requests
+    scores, ids, score_type = hybrid_search_batch(index, lexical, QUERIES, 4, batch_size=2)
+    assert stub.embed_requests - requests_before == 3  # ceil(5 / 2) embedding calls
+    assert score_type == ("rrf" if mode == "hybrid" else "l2_distance")
+
+    for query, row_scores, row_ids in zip(QUERIES, scores, ids):
+        single_scores, single_ids = hybrid_search(index, lexical, query, 4)
+        assert row_ids.tolist() == single_ids[0].tolist()
+        np.testing.assert_allclose(row_scores, single_scores[0], rtol=1e-5)
+
+
+def test_batch_endpoint_returns_ranked_results_and_answers(kb):
+    with TestClient(app_module.app) as client:
+        resp = client.post("/api/kbs/batch-kb/search/batch", json={"queries": QUERIES[:3], "top_k": 2, "generate": True, "concurrency": 2})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [r["query"] for r in results] == QUERIES[:3]
+    assert results[0]["ids"][0] == 3 and results[2]["ids"][0] == 17
+    assert all(r["answer"] == ANSWER and len(r["previews"]) == len(r["ids"]) for r in results)
@@ -0,0 +1,30 @@
+import pytest
+
+import run
+from config import load_config
+
+
+def test_summarize_reports_percentiles_in_ms_and_throughput():
+    summary = run.summarize([0.01] * 98 + [0.1, 1.0], wall_s=2.0, errors=1)
+    assert summary["count"] == 100 and summary["errors"] == 1
+    assert summary["p50_ms"] == pytest.approx(10.0)
+    assert summary["p99_ms"] > summary["p95_ms"] >= 10.0
+    assert summary["max_ms"] == pytest.approx(1000.0)
+    assert summary["throughput_per_s"] == 50.0
+    assert run.summarize([], errors=3) == {"count": 0, "errors": 3}
+
+
+def test_compare_flags_slower_latency_and_lower_throughput(capsys):
+    old = {"suites": {"search": {"1000": {"p95_ms": 10.0, "throughput_per_s": 100.0}, "nested": {"p50_ms": 5.0}}}}
+    new = {"suites": {"search": {"1000": {"p95_ms": 12.0, "throughput_per_s": 80.0}, "nested": {"p50_ms": 5.2}}}}
+    regressions = run.compare(old, new, threshold=0.10)
+    assert sorted(regressions) == sorted(p for p in run._flatten(new["suites"]) if not p.endswith("p50_ms"))
+    assert "regression" in capsys.readouterr().out
+
+
+def test_write_config_points_the_backend_at_the_stub(tmp_path):
+    path = run.write_config(str(tmp_path), "http://127.0.0.1:18999", with_caches=False)
+    config = load_config(path)
+    assert config["azure"]["openai"]["api_base"] == "http://127.0.0.1:18999"
+    assert config["embedding_cache"]["enabled"] is False and config["answer_cache"]["enabled"] is False
+    assert config["vector_db"] == load_config()["vector_db"]  # everything else is the committed config
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import bm25_index
+from bm25_index import BM25Index, add_segment, indexed_count, reciprocal_rank_fusion, tokenize
+
+
+CHUNKS = [
+    "Scope 3 emissions fell in 2023 across the ground fleet.",
+    "Part ABC-123 replaces the v2.1 controller.",
+    "The ground fleet added electric vehicles.",
+    "Annual report of the board.",
+]
+
+
+def test_tokenizer_keeps_codes_whole_and_drops_stopwords():
+    assert tokenize("The part ABC-123 and v2.1 of scope_3") == ["part", "abc-123", "v2.1", "scope_3"]
+
+
+def test_segments_score_like_one_index_and_merge_past_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setitem(bm25_index.BM25_SETTINGS, "max_segments", 2)
+    kb_path = str(tmp_path)
+    for i, chunk in enumerate(CHUNKS):
+        add_segment(kb_path, [chunk], i)
+    segmented = BM25Index.load(kb_path)
+
+    assert indexed_count(kb_path) == 4
+    assert len(segmented.segments) <= 2
+    assert segmented.search("abc-123", 3)[1].tolist() == [1]
+    scores, ids = segmented.search("ground fleet electric", 3)
+    assert ids.tolist() == [2, 0] and scores[0] > scores[1] > 0
+
+    whole = BM25Index([bm25_index.Segment.build(CHUNKS, 0)])
+    np.testing.assert_allclose(whole.search("ground fleet electric", 3)[0], scores, rtol=1e-6)
+
+
+def test_a_gap_between_segments_disables_lexical_search(tmp_path):
+    add_segment(str(tmp_path), CHUNKS[:2], 0)
+    add_segment(str(tmp_path), CHUNKS[3:], 3)
+    assert BM25Index.load(str(tmp_path)) is None
+
+
+def test_rank_fusion_rewards_agreement_between_retrievers():
+    scores, ids = reciprocal_rank_fusion(
+        [np.array([7, 3, -1]), np.array([3, 9])], [0.6, 0.4], k=3, rrf_k=60,
+    )
+    assert ids.tolist() == [3, 7, 9]
+    assert scores[0] == pytest.approx(0.6 / 62 + 0.4 / 61)
@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import md_rag
+from stub_server import ANSWER, stub_vector
+
+from conftest import STUB_DIM
+
+
+CHUNKS = ["The warranty covers parts for two years.", "Returns are accepted within thirty days."]
+
+
+@pytest.fixture
+def client():
+    kb_path = os.path.join(app_module.INDICES_DIR, "chat-kb")
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in CHUNKS]), CHUNKS,
+        index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+        metadata_path=os.path.join(kb_path, "metadata.json"), files=["policy.pdf"],
+    )
+    with TestClient(app_module.app) as client:
+        yield client
+    app_module.kb_cache.invalidate("chat-kb")
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_json_answer_with_citations(client):
+    resp = client.post("/api/kbs/chat-kb/chat", json={"message": CHUNKS[0], "top_k": 1})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["answer"] == ANSWER
+    assert [c["chunk"] for c in body["citations"]] == [0]
+
+
+def test_streamed_answer_sends_citations_then_tokens_then_done(client):
+    resp = client.post("/api/kbs/chat-kb/chat", json={"message": CHUNKS[1], "top_k": 1, "stream": True})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+
+    events = _events(resp.text)
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "citations" and kinds[-1] == "done"
+    assert set(kinds[1:-1]) == {"token"}
+    assert [c["chunk"] for c in events[0][1]] == [1]
+    assert "".join(data for kind, data in events if kind == "token").strip() == ANSWER
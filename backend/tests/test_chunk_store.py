@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import segmented_file
+from chunk_store import ChunkStore, append_chunks, ensure_migrated, offsets_path, open_chunks, truncate_chunks, write_chunk_store
+
+
+def test_append_extends_the_store_without_touching_earlier_chunks(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    write_chunk_store(path, ["zero", "één"])
+    assert append_chunks(path, ["two", ""]) == 4
+    assert append_chunks(path, ["four"]) == 5
+
+    store = open_chunks(path)
+    assert isinstance(store, ChunkStore)
+    assert list(store) == ["zero", "één", "two", "", "four"]
+    assert store[-1] == "four" and store[1:3] == ["één", "two"]
+    with pytest.raises(IndexError):
+        store[5]
+
+
+def test_truncate_rolls_back_a_failed_append(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    write_chunk_store(path, ["a", "b"])
+    append_chunks(path, ["c", "d", "e"])
+    truncate_chunks(path, 2)
+
+    assert list(open_chunks(path)) == ["a", "b"]
+    assert segmented_file.size(path) == 2
+    assert append_chunks(path, ["f"]) == 3
+    assert list(open_chunks(path)) == ["a", "b", "f"]
+    with pytest.raises(ValueError):
+        truncate_chunks(path, 10)
+
+
+def test_a_view_keeps_its_chunks_while_the_store_is_appended_to(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    write_chunk_store(path, ["old"])
+    view = open_chunks(path)
+    append_chunks(path, ["new"])
+    assert list(view) == ["old"]
+    assert list(open_chunks(path)) == ["old", "new"]
+
+
+def test_truncating_a_hard_linked_clone_leaves_the_original_intact(tmp_path):
+    original = str(tmp_path / "g1" / "chunks.bin")
+    write_chunk_store(original, ["a", "b"])
+    for i in range(6):
+        append_chunks(original, [f"chunk {i}"])
+    clone = str(tmp_path / "g2" / "chunks.bin")
+    os.makedirs(os.path.dirname(clone))
+    for name in (original, offsets_path(original)):
+        shutil.copytree(name, os.path.join(os.path.dirname(clone), os.path.basename(name)), copy_function=os.link)
+
+    truncate_chunks(clone, 3)
+    append_chunks(clone, ["replaced"])
+
+    assert list(open_chunks(clone)) == ["a", "b", "chunk 0", "replaced"]
+    assert list(open_chunks(original)) == ["a", "b"] + [f"chunk {i}" for i in range(6)]
+
+
+def test_stores_written_as_plain_files_are_read_and_appended_to(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    with open(path, "wb") as f:
+        f.write(b"ab")
+    np.array([0, 1, 2], dtype="<u8").tofile(offsets_path(path))
+    assert list(open_chunks(path)) == ["a", "b"]
+
+    append_chunks(path, ["c"])
+    assert os.path.isdir(path)
+    assert list(open_chunks(path)) == ["a", "b", "c"]
+
+
+def test_legacy_json_chunks_are_migrated_before_a_write(tmp_path):
+    with open(tmp_path / "chunks.json", "w", encoding="utf-8") as f:
+        json.dump(["x", "y"], f)
+    path = str(tmp_path / "chunks.bin")
+    assert open_chunks(path) == ["x", "y"]
+
+    ensure_migrated(path)
+    append_chunks(path, ["z"])
+    assert not os.path.exists(tmp_path / "chunks.json")
+    assert list(open_chunks(path)) == ["x", "y", "z"]
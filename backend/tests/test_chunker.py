@@ -0,0 +1,56 @@
+from chunker import batched, chunk_text, iter_blocks
+from embedding_executor import default_token_counter
+
+
+def _tokens(text):
+    return default_token_counter().count(text)
+
+
+def _section(heading, sentences):
+    return f"## {heading}\n\n" + "\n\n".join(sentences)
+
+
+def test_chunks_stay_within_the_token_budget_and_repeat_their_heading():
+    sentences = [f"Paragraph {i} describes the maintenance schedule of depot {i} in detail." for i in range(40)]
+    chunks = chunk_text(_section("Maintenance", sentences), max_tokens=64, overlap_tokens=0)
+
+    assert len(chunks) > 1
+    assert all(_tokens(c) <= 64 for c in chunks)
+    assert all(c.startswith("## Maintenance\n\n") for c in chunks)
+    body = [c[len("## Maintenance\n\n"):] for c in chunks]
+    assert "\n\n".join(body).split("\n\n") == sentences
+
+
+def test_consecutive_chunks_of_a_section_overlap():
+    sentences = [f"Step {i} of the procedure." for i in range(30)]
+    chunks = chunk_text(_section("Procedure", sentences), max_tokens=48, overlap_tokens=16)
+
+    for previous, current in zip(chunks, chunks[1:]):
+        carried = current.split("\n\n")[1]
+        assert carried in previous.split("\n\n")
+
+
+def test_an_oversized_table_is_cut_at_row_boundaries():
+    table = "\n".join(["| id | value |", "|----|-------|"] + [f"| {i} | value {i} |" for i in range(60)])
+    chunks = chunk_text(table, max_tokens=40, overlap_tokens=0)
+
+    assert len(chunks) > 1
+    assert all(_tokens(c) <= 40 for c in chunks)
+    assert "\n".join(chunks).split("\n") == table.split("\n")
+
+
+def test_headings_inside_code_fences_are_not_section_breaks():
+    text = "# Setup\n\n```\n# not a heading\n\nstill code\n```\n\nAfter."
+    blocks = list(iter_blocks(text))
+    assert [(is_heading, block) for is_heading, block, _ in blocks] == [
+        (True, "# Setup"), (False, "```\n# not a heading\n\nstill code\n```"), (False, "After."),
+    ]
+
+
+def test_short_sections_are_packed_together():
+    text = "\n\n".join(_section(f"Part {i}", [f"Short note {i}."]) for i in range(4))
+    assert chunk_text(text, max_tokens=512) == [text]
+
+
+def test_batched_groups_a_stream():
+    assert list(batched(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import threading
+
+from fastapi.testclient import TestClient
+
+import app as app_module
+from converters import ConverterPool
+from run import write_config
+
+from conftest import BACKEND_DIR
+
+
+def test_importing_the_app_loads_no_converter_or_sdk(tmp_path):
+    # A fresh interpreter: this one has long since imported whatever the other tests used
+    script = (
+        f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import app; "
+        "print('loaded:', [m for m in ('docling', 'markitdown', 'openai') if m in sys.modules])"
+    )
+    # The model endpoints are never called, only configured
+    env = dict(os.environ, RAG_CONFIG=write_config(str(tmp_path), "http://127.0.0.1:9", with_caches=False))
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines()[-1] == "loaded: []"
+
+
+def test_converters_are_built_once_and_reused(monkeypatch):
+    built = []
+    monkeypatch.setattr(ConverterPool, "_new", staticmethod(lambda: built.append(object()) or built[-1]))
+    pool = ConverterPool(size=2)
+
+    with pool.converter() as first:
+        with pool.converter() as second:
+            assert first is not second
+        seen = []
+        waiter = threading.Thread(target=lambda: seen.append(pool.converter().__enter__()))
+        waiter.start()  # the pool is full: borrows wait for a returned converter
+        waiter.join(timeout=5)
+        assert seen == [second]
+    assert len(built) == 2
+    assert pool.prewarm()["converters"] == 2 and len(built) == 2
+
+
+def test_worker_stats_report_the_cold_start():
+    with TestClient(app_module.app) as client:
+        cold_start = client.get("/api/worker/stats").json()["cold_start"]
+    assert cold_start["startup_s"] >= 0
+    assert cold_start["ready_s"] >= cold_start["import_s"] > 0
@@ -0,0 +1,49 @@
+import numpy as np
+
+from context_assembly import assemble_context
+from embedding_executor import default_token_counter
+
+
+def _tokens(text):
+    return default_token_counter().count(text)
+
+
+def _unit(v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_chunks_are_kept_in_rank_order_within_the_budget():
+    texts = ["short answer one.", "a much longer passage " * 30, "short answer two."]
+    budget = _tokens(texts[0]) + _tokens(texts[2]) + 5
+
+    context = assemble_context(texts, max_tokens=budget, dedup_threshold=0.95)
+    assert context.kept == [0, 2]
+    assert context.dropped_over_budget == [1]
+    assert context.tokens_used <= budget
+    assert context.tokens_saved == _tokens(texts[1])
+    assert context.stats()["candidates"] == 3
+
+
+def test_the_best_chunk_is_truncated_rather_than_dropped():
+    context = assemble_context(["word " * 500, "tail"], max_tokens=50)
+    assert context.kept[0] == 0
+    assert context.truncated and _tokens(context.texts[0]) <= 50
+
+
+def test_near_duplicates_of_a_chosen_chunk_are_dropped():
+    vectors = np.stack([_unit([1, 0, 0]), _unit([0.99, 0.05, 0]), _unit([0, 1, 0])])
+    context = assemble_context(["a", "a again", "b"], vectors=vectors, max_tokens=1000, dedup_threshold=0.95)
+    assert context.kept == [0, 2]
+    assert context.dropped_duplicates == [1]
+
+
+def test_mmr_prefers_a_diverse_chunk_over_a_redundant_one():
+    query = _unit([1, 1, 0])
+    vectors = np.stack([_unit([1, 0.9, 0]), _unit([1, 0.8, 0.1]), _unit([0.3, 1, 0])])
+    texts = ["first", "similar to first", "different angle"]
+
+    by_rank = assemble_context(texts, vectors=vectors, query_vector=query, max_tokens=1000, dedup_threshold=1.1, mmr_lambda=None)
+    by_mmr = assemble_context(texts, vectors=vectors, query_vector=query, max_tokens=1000, dedup_threshold=1.1, mmr_lambda=0.5)
+    assert by_rank.kept[:2] == [0, 1]
+    assert by_mmr.kept[:2] == [0, 2]
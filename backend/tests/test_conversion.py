@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import chunker
+import md_rag
+from conversion_cache import ConversionCache, sha256_file
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = ConversionCache(str(tmp_path / "converted"), max_bytes=1 << 20)
+    monkeypatch.setattr(md_rag, "get_conversion_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    """Calls to the docling converter, which returns the page range it was asked for."""
+    calls = []
+
+    def convert(pdf_path, page_range=None):
+        calls.append(page_range)
+        return f"pages {page_range}" if page_range else "whole document"
+
+    monkeypatch.setattr(md_rag, "pdf_to_markdown_with_docling", convert)
+    return calls
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(b"%PDF-1.7 test document")
+    return str(path)
+
+
+def test_a_document_is_converted_once_and_then_served_from_the_cache(cache, conversions, pdf):
+    assert md_rag.convert_pdf(pdf) == "whole document"
+    assert md_rag.convert_pdf(pdf, sha256_file(pdf)) == "whole document"
+    assert conversions == [None]
+    assert cache.stats()["hits"] == 1 and cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_conversions_are_evicted_beyond_the_budget(tmp_path):
+    cache = ConversionCache(str(tmp_path), max_bytes=25)
+    cache.put("a", "x" * 10)
+    cache.put("b", "y" * 10)
+    os.utime(cache._path("a"), (1, 1))
+    os.utime(cache._path("b"), (2, 2))
+    cache.put("c", "z" * 10)
+    assert cache.get("a") is None and cache.get("c") == "z" * 10
+    assert cache.stats()["evictions"] == 1
+
+
+def test_long_pdfs_are_converted_by_page_range_and_merged_in_page_order(monkeypatch, cache, conversions, pdf):
+    monkeypatch.setattr(md_rag, "SPLIT_MIN_PAGES", 10)
+    monkeypatch.setattr(md_rag, "PAGES_PER_TASK", 4)
+    monkeypatch.setattr(md_rag, "pdf_page_count", lambda path: 10)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        markdown = md_rag.convert_pdf(pdf, pool=pool)
+
+    assert sorted(conversions) == [(1, 4), (5, 8), (9, 10)]
+    assert markdown.split(f"\n\n{chunker.PAGE_BREAK}\n\n") == ["pages (1, 4)", "pages (5, 8)", "pages (9, 10)"]
+    assert md_rag.page_ranges(9) == [None]
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import dedup
+import md_rag
+from chunk_store import CHUNKS_FILE, open_chunks
+from chunker import Chunk
+from dedup import open_signatures
+from faiss_retriever import load_metadata
+from provenance import alias_count, open_provenance
+from snapshots import METADATA_FILE, current_dir
+
+
+def _text(seed: int) -> str:
+    words = np.random.default_rng(seed).integers(0, 5000, size=60)
+    return " ".join(f"w{w}" for w in words)
+
+
+A0, A1, A2, B0 = (_text(i) for i in range(4))
+
+
+def test_duplicates_become_aliases_of_their_canonical_chunks(tmp_path, stub, ingest):
+    kb = str(tmp_path / "kb")
+    before = stub.embed_inputs
+    a = ingest(kb, "a.pdf", [Chunk(A0, 1, 1), Chunk(A1, 2, 2), Chunk(A0, 3, 3), Chunk(A2, 4, 4)])
+    b = ingest(kb, "b.pdf", [Chunk(A1, 1, 1), Chunk(B0, 2, 2), Chunk(B0, 5, 6)])
+    c = ingest(kb, "c.pdf", [Chunk(A2, 9, 9)])
+    assert stub.embed_inputs - before == 4  # duplicates are never embedded
+
+    assert [(d["file"], d["first_chunk"], d["chunk_count"], d["duplicate_chunks"]) for d in c["documents"]] == [
+        ("a.pdf", 0, 3, 1),
+        ("b.pdf", 3, 1, 2),
+        ("c.pdf", 4, 0, 1),
+    ]
+    assert a["chunk_count"] == 3 and b["chunk_count"] == 4 and c["chunk_count"] == 4
+
+    kb_dir = current_dir(kb)
+    assert list(open_chunks(os.path.join(kb_dir, CHUNKS_FILE))) == [A0, A1, A2, B0]
+    assert len(open_signatures(kb_dir)) == 4
+    assert alias_count(kb_dir) == 4
+
+    provenance = open_provenance(kb_dir, load_metadata(os.path.join(kb_dir, METADATA_FILE)), 4)
+
+    def places(chunk_id):
+        return [(d["file"], d["page_start"], d["page_end"]) for d in provenance.duplicates(chunk_id)]
+
+    assert places(0) == [("a.pdf", 3, 3)]  # within the document
+    assert places(1) == [("b.pdf", 1, 1)]  # across the KB
+    assert places(2) == [("c.pdf", 9, 9)]  # a document made only of duplicates
+    assert places(3) == [("b.pdf", 5, 6)]  # within a later document, numbered from its first chunk
+    assert provenance.row(3)["file"] == "b.pdf"
+
+    # A filter matching only an alias selects its canonical chunk.
+    assert np.flatnonzero(provenance.mask(files=["c.pdf"])).tolist() == [2]
+    assert np.flatnonzero(provenance.mask(files=["b.pdf"])).tolist() == [1, 3]
+    assert np.flatnonzero(provenance.mask(files=["a.pdf"], pages=(3, 3))).tolist() == [0]
+
+
+def test_the_lsh_table_is_built_once_per_generation(tmp_path, monkeypatch, ingest):
+    kb = str(tmp_path / "kb")
+    ingest(kb, "a.pdf", [A0, A1])
+    cache = dedup.LSHCache()
+    monkeypatch.setattr(dedup, "get_lsh_cache", lambda: cache)
+
+    first, second = md_rag.open_deduplicator(kb), md_rag.open_deduplicator(kb)
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 1
+    assert first.index._keys is second.index._keys  # the stored table is shared...
+    assert list(first.filter([B0])) == [B0]
+    assert second.index.candidates(first.signatures[0]) == set()  # ...but not a job's own additions
+    assert list(second.filter([A1, A2])) == [A2]
+
+    ingest(kb, "b.pdf", [B0])  # a new generation
+    assert list(md_rag.open_deduplicator(kb).filter([B0])) == []
+    assert cache.stats()["misses"] == 2 and cache.stats()["entries"] == 1
+
+
+
+@pytest.fixture
+def client(ingest):
+    kb = os.path.join(app_module.INDICES_DIR, "dedup-kb")
+    ingest(kb, "a.pdf", [Chunk(A0, 1, 1), Chunk(A1, 2, 2)])
+    ingest(kb, "b.pdf", [Chunk(A1, 7, 7)])
+    with TestClient(app_module.app) as client:
+        yield client
+    app_module._kb_changed("dedup-kb")
+
+
+def test_citations_list_where_else_the_text_occurred(client):
+    resp = client.post("/api/kbs/dedup-kb/chat", json={"message": A1, "top_k": 1, "files": ["b.pdf"]})
+    assert resp.status_code == 200
+    citation = resp.json()["citations"][0]
+    assert (citation["chunk"], citation["file"]) == (1, "a.pdf")
+    assert [(d["file"], d["page_start"]) for d in citation["also_in"]] == [("b.pdf", 7)]
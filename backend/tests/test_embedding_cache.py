@@ -0,0 +1,106 @@
+import sqlite3
+
+import numpy as np
+
+import embedding_cache
+from embedding_cache import EmbeddingCache, text_hash
+from stub_server import stub_vector
+
+from conftest import STUB_DIM
+
+
+class Recorder:
+    """An embed_fn that returns stub vectors and records what it was asked to embed."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [stub_vector(t, STUB_DIM) for t in texts]
+
+
+def _cache(path, namespace="tests:embed", max_bytes=1 << 20, **kwargs):
+    return EmbeddingCache(str(path / "embedding_cache.sqlite"), namespace=namespace, max_bytes=max_bytes, **kwargs)
+
+
+def _last_used(path, text):
+    with sqlite3.connect(str(path / "embedding_cache.sqlite")) as conn:
+        return conn.execute("SELECT last_used FROM embeddings WHERE text_hash = ?", (text_hash(text),)).fetchone()[0]
+
+
+def test_misses_are_embedded_once_and_hits_skip_the_endpoint(tmp_path):
+    cache, embed = _cache(tmp_path), Recorder()
+
+    first = cache.embed(["alpha", "beta", "alpha"], embed)
+    assert embed.calls == [["alpha", "beta"]]  # repeated text in one call is embedded once
+    assert (cache.hits, cache.misses) == (0, 3)
+    np.testing.assert_allclose(first[0], stub_vector("alpha", STUB_DIM), rtol=1e-6)
+    assert first[0] == first[2]
+
+    second = cache.embed(["beta", "gamma", "alpha"], embed)
+    assert embed.calls[1:] == [["gamma"]]
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert second[0] == first[1] and second[2] == first[0]
+
+
+def test_hits_survive_reopening_and_are_scoped_to_the_namespace(tmp_path):
+    _cache(tmp_path).embed(["persisted"], Recorder())
+
+    embed = Recorder()
+    _cache(tmp_path).embed(["persisted"], embed)
+    assert embed.calls == []
+    assert _cache(tmp_path, namespace="other:model").get_many(["persisted"]) == [None]
+
+
+def test_least_recently_used_rows_are_evicted_over_budget(tmp_path):
+    cache, embed = _cache(tmp_path, max_bytes=2 * 4 * STUB_DIM), Recorder()
+    cache.embed(["one"], embed)
+    cache.embed(["two"], embed)
+    cache.get_many(["one"])  # "two" is now least recently used
+    cache.embed(["three"], embed)
+
+    assert cache.evictions == 1
+    assert [v is not None for v in cache.get_many(["one", "two", "three"])] == [True, False, True]
+    assert cache.stats()["stored_bytes"] == 2 * 4 * STUB_DIM
+
+
+def test_processes_sharing_the_file_evict_against_one_total(tmp_path):
+    budget = 2 * 4 * STUB_DIM
+    worker_a, worker_b = _cache(tmp_path, max_bytes=budget), _cache(tmp_path, max_bytes=budget)
+    worker_a.embed(["one"], Recorder())
+    worker_b.embed(["two"], Recorder())
+    worker_a.embed(["three"], Recorder())
+
+    assert worker_a.evictions == 1
+    assert worker_b.stats()["stored_bytes"] == budget
+    assert worker_b.get_many(["one"]) == [None]
+
+
+def test_hits_are_not_written_until_the_next_store_or_flush(tmp_path):
+    cache = _cache(tmp_path, touch_flush_s=3600)
+    cache.embed(["old"], Recorder())
+    stored_at = _last_used(tmp_path, "old")
+
+    cache.get_many(["old"])
+    assert _last_used(tmp_path, "old") == stored_at
+    cache.embed(["new"], Recorder())
+    assert _last_used(tmp_path, "old") > stored_at
+
+    eager = _cache(tmp_path, touch_flush_s=0)
+    eager.get_many(["new"])
+    assert _last_used(tmp_path, "new") > _last_used(tmp_path, "old")
+
+
+def test_query_embeddings_go_through_the_shared_cache(tmp_path, monkeypatch, stub):
+    import faiss_retriever
+
+    monkeypatch.setitem(embedding_cache.EMBEDDING_CACHE_SETTINGS, "enabled", True)
+    monkeypatch.setattr(embedding_cache, "_shared_cache", _cache(tmp_path))
+
+    before = stub.embed_inputs
+    first = faiss_retriever.embed_texts(["what is the scope 1 total?"])
+    second = faiss_retriever.embed_texts(["what is the scope 1 total?"])
+    assert stub.embed_inputs - before == 1
+    assert first == second
+    np.testing.assert_allclose(first[0], stub_vector("what is the scope 1 total?", STUB_DIM), rtol=1e-6)
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+import requests
+
+from embedding_executor import EmbeddingExecutor
+from stub_server import stub_vector
+
+from conftest import STUB_DIM
+
+
+def _executor(url, **kwargs):
+    # A computed backoff this long would time the test out: only Retry-After can be in effect.
+    options = {"max_retries": 3, "backoff_base_s": 30.0, "backoff_max_s": 60.0, "timeout_s": 5.0}
+    return EmbeddingExecutor(url, "tests", **{**options, **kwargs})
+
+
+def test_throttled_batches_wait_for_retry_after_then_succeed(embeddings_url, stub):
+    stub.throttle_embeddings, stub.retry_after_s = 2, 0.2
+    executor = _executor(embeddings_url)
+    requests_before = stub.embed_requests
+
+    started = time.perf_counter()
+    vectors = executor.embed(["first", "second"])
+    elapsed = time.perf_counter() - started
+
+    assert vectors == [pytest.approx(stub_vector(t, STUB_DIM)) for t in ("first", "second")]
+    assert stub.embed_requests - requests_before == 3
+    assert executor.last_run["retries"] == 2
+    assert 0.4 <= elapsed < 5
+
+
+def test_retry_after_is_capped_by_backoff_max(embeddings_url, stub):
+    stub.throttle_embeddings, stub.retry_after_s = 1, 120
+    executor = _executor(embeddings_url, backoff_max_s=0.1)
+
+    started = time.perf_counter()
+    executor.embed(["capped"])
+    assert time.perf_counter() - started < 5
+    assert executor.last_run["retries"] == 1
+
+
+def test_gives_up_after_max_retries(embeddings_url, stub):
+    stub.throttle_embeddings, stub.retry_after_s = 5, 0.05
+    executor = _executor(embeddings_url, max_retries=2)
+    requests_before = stub.embed_requests
+
+    with pytest.raises(requests.HTTPError, match="429"):
+        executor.embed(["never"])
+    assert stub.embed_requests - requests_before == 3
+    assert executor.totals["failures"] == 1
@@ -0,0 +1,66 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import embedding_providers
+import md_rag
+from embedding_providers import AzureEmbeddingProvider, EmbeddingMismatchError, HashingEmbeddingProvider, check_compatible
+from stub_server import stub_vector
+
+from conftest import STUB_DIM
+
+
+def test_hashing_vectors_are_deterministic_normalized_and_rank_related_text_closer():
+    provider = HashingEmbeddingProvider(dim=256)
+    texts = ["refunds are issued within 14 days", "refunds are issued within 30 days", "fleet emissions fell in 2023"]
+    vectors = np.array(provider.embed_documents(texts))
+
+    assert vectors.shape == (3, 256)
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+    np.testing.assert_array_equal(provider.embed_queries(texts[:1])[0], vectors[0])
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    assert provider.identity() == {"provider": "hashing", "model": "hashing-1-2gram", "dim": 256}
+
+
+def test_rest_ingestion_uses_the_embedding_api_version(monkeypatch):
+    monkeypatch.setitem(embedding_providers.EMBEDDING_SETTINGS, "api_version", "2099-01-01")
+    assert AzureEmbeddingProvider().executor.endpoint.endswith("/embeddings?api-version=2099-01-01")
+
+
+def test_kbs_built_by_another_provider_model_or_dim_are_incompatible():
+    check_compatible({}, STUB_DIM)  # KBs from before providers were recorded: Azure
+    check_compatible({"embedding": {"provider": "azure", "model": "tests-embed", "dim": STUB_DIM}})
+    with pytest.raises(EmbeddingMismatchError):
+        check_compatible({"embedding": {"provider": "hashing", "model": "hashing-1-2gram", "dim": 1024}})
+    with pytest.raises(EmbeddingMismatchError):
+        check_compatible({"embedding": {"provider": "azure", "model": "another-model", "dim": STUB_DIM}})
+
+
+@pytest.fixture
+def hashed_kb():
+    chunks = ["Refunds are issued within 14 days."]
+    kb_path = os.path.join(app_module.INDICES_DIR, "hashed-kb")
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in chunks]), chunks,
+        index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+        metadata_path=os.path.join(kb_path, "metadata.json"), files=["refunds.pdf"],
+    )
+    metadata_path = os.path.join(kb_path, "metadata.json")
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    metadata["embedding"] = {"provider": "hashing", "model": "hashing-1-2gram", "dim": STUB_DIM}
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f)
+    yield "hashed-kb"
+    app_module._kb_changed("hashed-kb")
+
+
+def test_chat_rejects_a_kb_built_by_another_provider(hashed_kb):
+    with TestClient(app_module.app) as client:
+        resp = client.post(f"/api/kbs/{hashed_kb}/chat", json={"message": "refunds?"})
+    assert resp.status_code == 409
+    assert "hashing" in resp.json()["detail"]
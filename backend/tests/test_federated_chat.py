@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import bm25_index
+import md_rag
+from faiss_retriever import normalize_scores
+from stub_server import ANSWER, stub_vector
+
+from conftest import STUB_DIM
+
+
+KBS = {
+    "fed-policies": ["Refunds are issued within 14 days.", "Warranty claims need a receipt."],
+    "fed-reports": ["Fleet emissions fell 4% in 2023.", "Refund volume rose in Q3."],
+}
+
+
+def _write_kb(kb_id, chunks, lexical):
+    kb_path = os.path.join(app_module.INDICES_DIR, kb_id)
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in chunks]), chunks,
+        index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+        metadata_path=os.path.join(kb_path, "metadata.json"), files=[f"{kb_id}.pdf"],
+    )
+    if lexical:
+        bm25_index.rebuild(kb_path, chunks)
+
+
+@pytest.fixture
+def client():
+    _write_kb("fed-policies", KBS["fed-policies"], lexical=True)
+    _write_kb("fed-reports", KBS["fed-reports"], lexical=False)
+    with TestClient(app_module.app) as client:
+        yield client
+    for kb_id in KBS:
+        app_module.kb_cache.invalidate(kb_id)
+
+
+def test_normalized_scores_share_one_scale():
+    assert normalize_scores(np.array([0.0, 1.0]), "l2_distance").tolist() == [1.0, 0.5]
+    best = (0.6 + 0.4) / 61
+    np.testing.assert_allclose(normalize_scores(np.array([best, 0.6 / 61]), "rrf"), [1.0, 0.6], rtol=1e-6)
+
+
+def test_federated_chat_merges_kbs_and_reports_skipped_ones(client, stub):
+    requests_before = stub.embed_requests
+    resp = client.post("/api/federated/chat", json={
+        "kb_ids": ["fed-policies", "fed-reports", "fed-missing"], "message": KBS["fed-reports"][0], "top_k": 3,
+    })
+    assert resp.status_code == 200
+    assert stub.embed_requests - requests_before == 1  # one query embedding for every KB
+
+    body = resp.json()
+    assert body["answer"] == ANSWER
+    citations = body["citations"]
+    assert len(citations) == 3
+    assert (citations[0]["kb"], citations[0]["chunk"], citations[0]["score"]) == ("fed-reports", 0, 1.0)
+    assert {c["kb"] for c in citations} == {"fed-policies", "fed-reports"}
+    scores = [c["score"] for c in citations]
+    assert scores == sorted(scores, reverse=True) and all(0 < s <= 1 for s in scores)
+    assert [s["kb"] for s in body["skipped_kbs"]] == ["fed-missing"]
+
+
+def test_federated_chat_fails_only_when_no_kb_loads(client):
+    resp = client.post("/api/federated/chat", json={"kb_ids": ["fed-missing", "fed-gone"], "message": "refunds"})
+    assert resp.status_code == 404
+    assert "fed-missing" in resp.json()["detail"] and "fed-gone" in resp.json()["detail"]
@@ -0,0 +1,69 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+import md_rag
+from stub_server import stub_vector
+
+from conftest import STUB_DIM
+
+
+DOCUMENTS = {
+    "a.pdf": " ".join(f"alpha{i}" for i in range(1200)),  # 3 chunks of at most 1024 tokens
+    "b.pdf": " ".join(f"beta{i}" for i in range(700)),  # 2 chunks
+}
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    """Paths of an empty KB; PDFs are "converted" to the text in DOCUMENTS."""
+    monkeypatch.setattr(md_rag, "pdf_to_markdown_with_docling", lambda path: DOCUMENTS[os.path.basename(path)])
+    return {name: str(tmp_path / "kb" / name) for name in ("index.faiss", "chunks.bin", "metadata.json")}
+
+
+def _append(kb, file_name):
+    return md_rag.append_pdf_to_index(
+        file_name, index_path=kb["index.faiss"], chunks_path=kb["chunks.bin"], metadata_path=kb["metadata.json"], file_name=file_name,
+    )
+
+
+def _nearest(index, text):
+    _, ids = index.search(np.array([stub_vector(text, STUB_DIM)], dtype=np.float32), 1)
+    return int(ids[0][0])
+
+
+def test_an_append_keeps_earlier_chunk_ids_and_embeds_only_the_new_document(kb, stub):
+    _append(kb, "a.pdf")
+    index, first_chunks = md_rag.load_index_and_chunks(kb["index.faiss"], kb["chunks.bin"])
+
+    before = stub.embed_inputs
+    metadata = _append(kb, "b.pdf")
+    assert stub.embed_inputs - before == 2
+
+    index, chunks = md_rag.load_index_and_chunks(kb["index.faiss"], kb["chunks.bin"])
+    assert index.ntotal == len(chunks) == 5 and chunks[:3] == list(first_chunks)
+    assert [_nearest(index, chunk) for chunk in chunks] == [0, 1, 2, 3, 4]
+    assert metadata["files"] == ["a.pdf", "b.pdf"]
+    assert metadata["documents"] == [
+        {"file": "a.pdf", "first_chunk": 0, "chunk_count": 3, "duplicate_chunks": 0},
+        {"file": "b.pdf", "first_chunk": 3, "chunk_count": 2, "duplicate_chunks": 0},
+    ]
+
+
+def test_a_legacy_flat_index_is_converted_without_re_embedding(kb, stub):
+    legacy_chunks = ["legacy one", "legacy two"]
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in legacy_chunks]), legacy_chunks,
+        index_path=kb["index.faiss"], chunks_path=kb["chunks.bin"], metadata_path=kb["metadata.json"], files=["legacy.pdf"],
+    )
+
+    before = stub.embed_inputs
+    _append(kb, "b.pdf")
+    assert stub.embed_inputs - before == 2
+
+    index, chunks = md_rag.load_index_and_chunks(kb["index.faiss"], kb["chunks.bin"])
+    assert isinstance(index, faiss.IndexIDMap2)
+    assert chunks[:2] == legacy_chunks
+    assert [_nearest(index, chunk) for chunk in chunks] == [0, 1, 2, 3]
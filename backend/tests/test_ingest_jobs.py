@@ -0,0 +1,71 @@
+import os
+import time
+
+import pytest
+
+import md_rag
+from ingest_jobs import IngestJobManager
+from snapshots import current_dir
+
+
+DOCUMENTS = {
+    "a.pdf": " ".join(f"alpha{i}" for i in range(1200)),  # 3 chunks of at most 1024 tokens
+    "b.pdf": " ".join(f"beta{i}" for i in range(700)),  # 2 chunks
+    "empty.pdf": "",
+}
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    manager = IngestJobManager(convert_workers=1, pipeline_workers=2, spool_dir=str(tmp_path / "spool"))
+    # Conversion runs in a spawned process pool; the tests only need its output.
+    monkeypatch.setattr(manager, "_convert", lambda pdf_path, content_hash: DOCUMENTS[os.path.basename(pdf_path)])
+    yield manager
+    manager.shutdown()
+
+
+def _wait(manager, job_id, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job.finished_at is not None:  # set once the job has also cleaned up after itself
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_jobs_for_one_kb_complete_with_per_stage_progress(manager, tmp_path):
+    kb_path = str(tmp_path / "kb")
+    os.makedirs(kb_path)
+    completed = []
+
+    jobs = [manager.submit("kb", kb_path, name, name, on_complete=completed.append) for name in ("a.pdf", "b.pdf")]
+    finished = [_wait(manager, job.id).to_dict() for job in jobs]
+
+    assert [job["status"] for job in finished] == ["completed", "completed"]
+    assert completed == ["kb", "kb"]
+    for job, chunk_count in zip(finished, (3, 2)):
+        assert job["progress"] == 1.0
+        assert all(stage["status"] == "done" and stage["seconds"] is not None for stage in job["stages"].values())
+        assert job["stages"]["chunk"]["items"] == job["stages"]["embed"]["items"] == chunk_count
+
+    generation = current_dir(kb_path)
+    index, chunks = md_rag.load_index_and_chunks(os.path.join(generation, "index.faiss"), os.path.join(generation, "chunks.bin"))
+    assert index.ntotal == len(chunks) == 5
+    metadata = md_rag.load_metadata(os.path.join(generation, "metadata.json"))
+    assert sorted(d["file"] for d in metadata["documents"]) == ["a.pdf", "b.pdf"]
+    assert [j.id for j in manager.list("kb")] == [j.id for j in jobs]
+    assert os.listdir(manager.spool_dir) == []  # each job's spool is removed when it finishes
+
+
+def test_a_failing_job_reports_its_stage_and_error(manager, tmp_path):
+    kb_path = str(tmp_path / "kb")
+    os.makedirs(kb_path)
+
+    job = _wait(manager, manager.submit("kb", kb_path, "empty.pdf", "empty.pdf").id).to_dict()
+
+    assert job["status"] == "failed"
+    assert "No chunks" in job["error"]
+    assert job["stages"]["chunk"]["items"] == 0
+    assert job["stages"]["persist"]["status"] == "pending"
+    assert job["kb"] is None
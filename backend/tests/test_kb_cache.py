@@ -0,0 +1,68 @@
+import json
+import os
+
+import faiss
+import numpy as np
+
+from kb_cache import KBCache
+
+DIM = 8
+
+
+def _write_kb(base, name, chunks):
+    kb = os.path.join(base, name)
+    os.makedirs(kb, exist_ok=True)
+    index = faiss.IndexFlatL2(DIM)
+    index.add(np.random.default_rng(len(chunks)).random((len(chunks), DIM), dtype=np.float32))
+    faiss.write_index(index, os.path.join(kb, "index.faiss"))
+    with open(os.path.join(kb, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump(chunks, f)
+    with open(os.path.join(kb, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump({"files": [f"{name}.pdf"], "chunk_count": len(chunks)}, f)
+
+
+def test_hits_until_the_kb_changes_on_disk(tmp_path):
+    base = str(tmp_path)
+    _write_kb(base, "kb", ["one", "two"])
+    cache = KBCache(base, max_bytes=1 << 30)
+
+    first = cache.get("kb")
+    assert cache.get("kb") is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    _write_kb(base, "kb", ["one", "two", "three"])
+    reloaded = cache.get("kb")
+    assert reloaded is not first and reloaded.chunks == ["one", "two", "three"]
+    assert reloaded.index.ntotal == 3
+    assert (cache.misses, cache.invalidations) == (2, 1)
+
+    cache.invalidate("kb")
+    assert cache.get("kb") is not reloaded
+    assert (cache.misses, cache.invalidations) == (3, 2)
+
+
+def test_least_recently_used_kbs_are_evicted_over_budget(tmp_path):
+    base = str(tmp_path)
+    for name in ("a", "b", "c"):
+        _write_kb(base, name, [f"{name} chunk {i}" for i in range(50)])
+    size = KBCache(base, max_bytes=1 << 30).get("a").nbytes
+    cache = KBCache(base, max_bytes=2 * size + size // 2)
+
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")  # "b" is now least recently used
+    cache.get("c")
+    assert cache.stats()["entries"] == ["a", "c"]
+    assert cache.evictions == 1
+    assert cache.stats()["resident_bytes"] <= cache.max_bytes
+
+
+def test_a_kb_over_budget_is_still_served_alone(tmp_path):
+    base = str(tmp_path)
+    _write_kb(base, "small", ["x"])
+    _write_kb(base, "large", [f"chunk {i}" for i in range(500)])
+    cache = KBCache(base, max_bytes=1)
+
+    cache.get("small")
+    assert len(cache.get("large").chunks) == 500
+    assert cache.stats()["entries"] == ["large"]
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from kb_catalog import KBCatalog
+from snapshots import METADATA_FILE, write_generation
+
+
+KBS = {
+    # name: (chunk_count, files, created_at)
+    "delta": (5, ["d.pdf"], "2025-01-04T00:00:00"),
+    "alpha": (20, ["a.pdf", "a2.pdf"], "2025-01-02T00:00:00"),
+    "charlie": (5, [], "2025-01-01T00:00:00"),
+    "bravo": (0, ["b.pdf", "b2.pdf", "b3.pdf"], "2025-01-03T00:00:00"),
+}
+
+
+def _make_kb(base, name, chunk_count, files, created_at):
+    kb = os.path.join(base, name)
+    os.makedirs(kb)
+    with write_generation(kb) as staging:
+        with open(os.path.join(staging, METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump({"chunk_count": chunk_count, "ntotal": chunk_count, "files": files, "created_at": created_at}, f)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    base = str(tmp_path / "indices")
+    for name, kb in KBS.items():
+        _make_kb(base, name, *kb)
+    os.makedirs(os.path.join(base, "not-a-kb"))  # no metadata: not listed
+    return KBCatalog(str(tmp_path / "kb_catalog.sqlite"), base)
+
+
+def _names(page):
+    kbs, _ = page
+    return [kb["name"] for kb in kbs]
+
+
+def test_a_new_catalog_is_filled_from_disk(catalog):
+    kbs, total = catalog.list()
+    assert total == 4
+    alpha = next(kb for kb in kbs if kb["name"] == "alpha")
+    assert alpha["files"] == ["a.pdf", "a2.pdf"] and alpha["file_count"] == 2
+    assert alpha["generation"] == "g00000001" and alpha["size_bytes"] > 0
+
+
+def test_sorting_breaks_ties_by_name(catalog):
+    assert _names(catalog.list()) == ["alpha", "bravo", "charlie", "delta"]
+    assert _names(catalog.list(descending=True)) == ["delta", "charlie", "bravo", "alpha"]
+    assert _names(catalog.list(sort="chunk_count")) == ["bravo", "charlie", "delta", "alpha"]
+    assert _names(catalog.list(sort="chunk_count", descending=True)) == ["alpha", "charlie", "delta", "bravo"]
+    assert _names(catalog.list(sort="file_count")) == ["charlie", "delta", "alpha", "bravo"]
+    assert _names(catalog.list(sort="created_at", descending=True)) == ["delta", "bravo", "alpha", "charlie"]
+    with pytest.raises(ValueError):
+        catalog.list(sort="files; DROP TABLE kbs")
+
+
+def test_paging_returns_slices_of_the_sorted_list_and_the_total(catalog):
+    assert catalog.list(offset=0, limit=3, sort="chunk_count")[1] == 4
+    pages = [_names(catalog.list(offset=offset, limit=3, sort="chunk_count")) for offset in (0, 3, 6)]
+    assert pages == [["bravo", "charlie", "delta"], ["alpha"], []]
+    assert _names(catalog.list(offset=1, limit=2, sort="name", descending=True)) == ["charlie", "bravo"]
+
+
+def test_refresh_follows_changes_and_deletes(catalog):
+    _make_kb(catalog.base_dir, "echo", 1, ["e.pdf"], "2025-01-05T00:00:00")
+    catalog.refresh("echo")
+    assert catalog.exists("echo")
+    assert _names(catalog.list(sort="created_at", descending=True, limit=1)) == ["echo"]
+
+    shutil.rmtree(os.path.join(catalog.base_dir, "alpha"))
+    catalog.refresh("alpha")
+    assert not catalog.exists("alpha")
+    assert catalog.list()[1] == 4
+    assert catalog.rebuild() == 4
+
+
+def test_the_api_pages_and_validates_listing_requests():
+    from fastapi.testclient import TestClient
+
+    import app
+
+    client = TestClient(app.app)
+    for name in ("api-b", "api-a", "api-c"):
+        assert client.post("/api/kbs", json={"name": name}).status_code == 201
+
+    # Other test modules write KBs into the same indices directory without the API, as
+    # by hand: rebuild picks them up, and pages are compared with the full listing.
+    rebuilt = client.post("/api/catalog/rebuild").json()["rebuilt"]
+    listing = client.get("/api/kbs", params={"sort": "name", "order": "desc"}).json()
+    names = [kb["name"] for kb in listing["kbs"]]
+    assert listing["total"] == len(names) == rebuilt
+    assert [n for n in names if n.startswith("api-")] == ["api-c", "api-b", "api-a"]
+    page = client.get("/api/kbs", params={"sort": "name", "order": "desc", "offset": 1, "limit": 1}).json()
+    assert page["total"] == len(names) and [kb["name"] for kb in page["kbs"]] == names[1:2]
+    assert client.get("/api/kbs", params={"sort": "nope"}).status_code == 400
+    assert client.get("/api/kbs", params={"offset": -1}).status_code == 400
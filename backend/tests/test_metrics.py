@@ -0,0 +1,88 @@
+import contextvars
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import md_rag
+import metrics
+from stub_server import stub_vector
+
+from conftest import STUB_DIM
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Metrics created by a test register here rather than in the process-wide registry."""
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+
+def test_histograms_render_cumulative_buckets(registry):
+    histogram = metrics.Histogram("test_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, stage="search")
+
+    assert metrics.render().splitlines() == [
+        "# HELP test_seconds Test latency.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="search",le="0.1"} 1',
+        'test_seconds_bucket{stage="search",le="1"} 3',
+        'test_seconds_bucket{stage="search",le="+Inf"} 4',
+        'test_seconds_sum{stage="search"} 4.05',
+        'test_seconds_count{stage="search"} 4',
+    ]
+
+
+def test_counters_check_and_escape_labels(registry):
+    counter = metrics.Counter("test_total", "Test counter.", ("route",))
+    counter.inc(route='/a "b"\n')
+    counter.inc(2, route='/a "b"\n')
+    assert counter.value(route='/a "b"\n') == 3
+    assert 'test_total{route="/a \\"b\\"\\n"} 3' in metrics.render()
+    with pytest.raises(ValueError):
+        counter.inc(path="/a")
+
+
+def test_stages_feed_the_request_breakdown_and_count_errors():
+    errors_before = metrics.STAGE_ERRORS.value(stage="test-stage")
+
+    def request():
+        timings = metrics.start_timings()
+        with metrics.stage("test-stage"):
+            pass
+        with pytest.raises(RuntimeError):
+            with metrics.stage("test-stage"):
+                raise RuntimeError("boom")
+        return timings
+
+    timings = contextvars.copy_context().run(request)  # as a request would, in a context of its own
+
+    assert set(timings) == {"test-stage"} and timings["test-stage"] >= 0
+    assert metrics.STAGE_ERRORS.value(stage="test-stage") == errors_before + 1
+    assert set(metrics.rounded(timings)) == {"test-stage"}
+
+
+@pytest.fixture
+def client():
+    chunks = ["Deliveries run Monday to Saturday.", "Sunday delivery costs extra."]
+    kb_path = os.path.join(app_module.INDICES_DIR, "metrics-kb")
+    md_rag.persist_index_and_chunks(
+        md_rag.build_faiss_index([stub_vector(c, STUB_DIM) for c in chunks]), chunks,
+        index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+        metadata_path=os.path.join(kb_path, "metadata.json"), files=["delivery.pdf"],
+    )
+    with TestClient(app_module.app) as client:
+        yield client
+    app_module._kb_changed("metrics-kb")
+
+
+def test_chat_reports_its_stage_timings_and_the_metrics_endpoint_sees_the_route(client):
+    resp = client.post("/api/kbs/metrics-kb/chat", json={"message": "Is there Sunday delivery?", "top_k": 1, "timings": True})
+    assert resp.status_code == 200
+    assert {"embed", "search", "generate"} <= set(resp.json()["timings_ms"])
+
+    body = client.get("/metrics").text
+    assert 'rag_http_request_seconds_count{method="POST",route="/api/kbs/{kb_id}/chat",status="200"}' in body
+    assert 'rag_stage_seconds_count{stage="generate"}' in body
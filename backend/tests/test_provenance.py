@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import md_rag
+from ann_index import build_index, search_params
+from bm25_index import BM25Index, Segment
+from chunker import PAGE_BREAK, Chunk, chunk_text
+from provenance import append_provenance, backfill_provenance, open_provenance
+
+
+DIM = 16
+
+
+def _document(name, pages):
+    return f"\n\n{PAGE_BREAK}\n\n".join(
+        f"{name} page {p}: " + " ".join(f"{name}-fact-{p}-{i} is recorded here." for i in range(6)) for p in range(1, pages + 1)
+    )
+
+
+def test_chunks_carry_their_page_range_and_offsets():
+    text = _document("doc", 3)
+    chunks = chunk_text(text, max_tokens=40, overlap_tokens=0)
+
+    assert all(isinstance(c, Chunk) for c in chunks)
+    assert chunks[0].page_start == 1 and chunks[-1].page_end == 3
+    assert all(c.page_start <= c.page_end for c in chunks)
+    for c in chunks:
+        assert str(c).split(" ")[0] in text[c.char_start:c.char_end]
+
+
+def test_masks_select_files_and_overlapping_pages(tmp_path):
+    kb_path = str(tmp_path)
+    append_provenance(kb_path, [Chunk("a1", 1, 1), Chunk("a2", 2, 3)], file_id=0)
+    append_provenance(kb_path, [Chunk("b1", 1, 2), "no pages"], file_id=1)
+    provenance = open_provenance(kb_path, {"documents": [{"file": "a.pdf"}, {"file": "b.pdf"}]}, 4)
+
+    assert provenance.mask(files=["b.pdf"]).tolist() == [False, False, True, True]
+    assert provenance.mask(pages=(2, 2)).tolist() == [False, True, True, False]
+    assert provenance.mask(files=["a.pdf"], pages=(3, 9)).tolist() == [False, True, False, False]
+    assert provenance.row(1) == {"file": "a.pdf", "page_start": 2, "page_end": 3, "char_start": None, "char_end": None}
+
+
+def test_kbs_without_stored_provenance_derive_files_from_their_documents(tmp_path):
+    metadata = {"documents": [{"file": "a.pdf", "first_chunk": 0, "chunk_count": 2}, {"file": "b.pdf", "first_chunk": 2, "chunk_count": 1}]}
+    assert open_provenance(str(tmp_path), metadata, 3).mask(files=["b.pdf"]).tolist() == [False, False, True]
+
+    backfill_provenance(str(tmp_path), metadata, 3)
+    stored = open_provenance(str(tmp_path), metadata, 3)
+    assert isinstance(stored.columns["file_id"], np.memmap)
+    assert [stored.file_name(i) for i in range(3)] == ["a.pdf", "a.pdf", "b.pdf"]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_filtered_vector_search_only_returns_allowed_chunks(index_type):
+    vectors = np.random.default_rng(0).standard_normal((2000, DIM)).astype(np.float32)
+    index, _ = build_index(vectors, index_type)
+    allowed = np.zeros(2000, dtype=bool)
+    allowed[::50] = True  # 2% of the KB
+
+    _, ids = index.search(vectors[:5], 5, params=search_params(index, allowed=allowed))
+    assert (ids >= 0).all() and allowed[ids].all()
+    exact = np.flatnonzero(allowed)[np.argmin(((vectors[allowed][None] - vectors[:5, None]) ** 2).sum(-1), axis=1)]
+    assert (ids[:, 0] == exact).mean() >= 0.8
+
+
+def test_lexical_search_treats_chunks_past_a_short_mask_as_filtered_out():
+    lexical = BM25Index([Segment.build(["alpha beta", "alpha", "alpha gamma"], 0)])
+    assert lexical.search("alpha", 3, allowed=np.array([False, True]))[1].tolist() == [1]
+    assert lexical.search("alpha", 3, allowed=np.ones(5, dtype=bool))[1].size == 3
+
+
+@pytest.fixture
+def client(monkeypatch):
+    documents = {"a.pdf": _document("alpha", 3), "b.pdf": _document("beta", 2)}
+    monkeypatch.setattr(md_rag, "pdf_to_markdown_with_docling", lambda path: documents[os.path.basename(path)])
+    kb_path = os.path.join(app_module.INDICES_DIR, "prov-kb")
+    for name in documents:
+        md_rag.append_pdf_to_index(
+            name, index_path=os.path.join(kb_path, "index.faiss"), chunks_path=os.path.join(kb_path, "chunks.bin"),
+            metadata_path=os.path.join(kb_path, "metadata.json"), file_name=name, chunk_size=40,
+        )
+    with TestClient(app_module.app) as client:
+        yield client
+    app_module._kb_changed("prov-kb")
+
+
+def test_chat_filters_by_file_and_page_and_cites_the_source(client):
+    resp = client.post("/api/kbs/prov-kb/chat", json={"message": "alpha-fact-1-2", "top_k": 5, "files": ["b.pdf"]})
+    assert resp.status_code == 200
+    citations = resp.json()["citations"]
+    assert citations and {c["file"] for c in citations} == {"b.pdf"}
+
+    resp = client.post("/api/kbs/prov-kb/chat", json={"message": "fact", "top_k": 5, "files": ["a.pdf"], "pages": [3, 3]})
+    citations = resp.json()["citations"]
+    assert citations and all(c["file"] == "a.pdf" and c["page_start"] <= 3 <= c["page_end"] for c in citations)
+
+    assert client.post("/api/kbs/prov-kb/chat", json={"message": "fact", "pages": [3, 1]}).status_code == 400
@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from query_batcher import QueryBatcher
+
+
+def _vector(text):
+    return [float(len(text)), float(sum(map(ord, text)))]
+
+
+def _embed_all(batcher, queries):
+    start = threading.Barrier(len(queries))
+
+    def embed(query):
+        start.wait()
+        return batcher.embed([query])
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        futures = [pool.submit(embed, q) for q in queries]
+        return [f.exception() or f.result() for f in futures]
+
+
+def test_concurrent_queries_share_batches_and_get_their_own_vectors():
+    calls = []
+    batcher = QueryBatcher(lambda texts: calls.append(list(texts)) or [_vector(t) for t in texts], window_s=0.2, max_batch_size=4)
+    queries = [f"query {i}" for i in range(6)]
+
+    results = _embed_all(batcher, queries)
+
+    assert results == [[_vector(q)] for q in queries]
+    assert sorted(len(c) for c in calls) == [2, 4]  # a full batch goes at once, the rest after the window
+    assert sorted(t for c in calls for t in c) == queries
+    assert batcher.stats()["batches"] == 2 and batcher.stats()["requests"] == 6
+
+
+def test_a_failed_batch_fails_every_request_in_it():
+    def fail(texts):
+        raise RuntimeError(f"upstream down for {len(texts)} texts")
+
+    batcher = QueryBatcher(fail, window_s=0.2, max_batch_size=8)
+    results = _embed_all(batcher, ["a", "b", "c"])
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert {str(r) for r in results} == {"upstream down for 3 texts"}
+
+
+def test_a_request_filling_a_batch_is_sent_directly():
+    calls = []
+    batcher = QueryBatcher(lambda texts: calls.append(list(texts)) or [_vector(t) for t in texts], window_s=10.0, max_batch_size=2)
+    assert batcher.embed(["x", "yy"]) == [_vector("x"), _vector("yy")]
+    assert calls == [["x", "yy"]] and batcher.embed([]) == []
+    with pytest.raises(ZeroDivisionError):
+        QueryBatcher(lambda texts: [1 / 0], max_batch_size=1).embed(["z"])
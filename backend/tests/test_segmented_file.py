@@ -0,0 +1,47 @@
+import numpy as np
+
+import segmented_file
+
+
+def _grow(path, batches, dim=3):
+    rows = []
+    for i, n in enumerate(batches):
+        batch = np.arange(n * dim, dtype=np.float32).reshape(n, dim) + 1000 * i
+        segmented_file.append(path, batch.tobytes())
+        rows.append(batch)
+    return np.vstack(rows)
+
+
+def test_rows_read_back_across_parts(tmp_path):
+    path = str(tmp_path / "vectors.f32")
+    expected = _grow(path, [7, 1, 2, 5, 1])
+    array = segmented_file.open_array(path, np.float32, (3,))
+
+    assert isinstance(array, segmented_file.SegmentedArray) and array.shape == expected.shape
+    np.testing.assert_array_equal(np.asarray(array), expected)
+    np.testing.assert_array_equal(array[[0, 7, 15, -1, 9]], expected[[0, 7, 15, -1, 9]])
+    np.testing.assert_array_equal(array[5:12], expected[5:12])
+    np.testing.assert_array_equal(array[::4], expected[::4])
+    np.testing.assert_array_equal(array[-3], expected[-3])
+    np.testing.assert_array_equal(array[expected[:, 0] > 1000], expected[expected[:, 0] > 1000])
+    assert (array >= 0).all()
+
+
+def test_parts_stay_logarithmic_in_the_number_of_appends(tmp_path):
+    path = str(tmp_path / "column.bin")
+    for i in range(256):
+        segmented_file.append(path, np.int64(i).tobytes())
+    assert len(segmented_file.parts(path)) <= 9
+    np.testing.assert_array_equal(segmented_file.open_array(path, np.int64), np.arange(256))
+
+
+def test_truncate_and_rewrite(tmp_path):
+    path = str(tmp_path / "column.bin")
+    segmented_file.write(path, np.arange(4, dtype=np.int32).tobytes())
+    segmented_file.append(path, np.arange(4, 6, dtype=np.int32).tobytes())
+    segmented_file.truncate(path, 3 * 4)
+    np.testing.assert_array_equal(segmented_file.open_array(path, np.int32), [0, 1, 2])
+    assert segmented_file.size(path) == 12
+
+    segmented_file.write(path, b"")
+    assert segmented_file.size(path) == 0 and len(segmented_file.open_array(path, np.int32)) == 0
@@ -0,0 +1,128 @@
+import gc
+import json
+import os
+
+import pytest
+
+from chunk_store import CHUNKS_FILE, open_chunks
+from kb_cache import KBCache
+from snapshots import (
+    CURRENT_FILE, GENERATIONS_DIR, METADATA_FILE, acquire_lease, collect_garbage, current_dir,
+    current_generation, write_generation,
+)
+
+
+def _write_metadata(directory, **metadata):
+    with open(os.path.join(directory, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+
+def _metadata(kb_path):
+    with open(os.path.join(current_dir(kb_path), METADATA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _generations(kb_path):
+    return sorted(os.listdir(os.path.join(kb_path, GENERATIONS_DIR)))
+
+
+def _inodes(directory):
+    found = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            st = os.stat(os.path.join(root, name))
+            found[st.st_ino] = st.st_size
+    return found
+
+
+def test_publish_replaces_current_and_a_failed_write_leaves_it(tmp_path):
+    kb = str(tmp_path / "kb")
+    os.makedirs(kb)
+    with write_generation(kb) as staging:
+        _write_metadata(staging, version=1)
+    assert current_generation(kb) == "g00000001"
+
+    with pytest.raises(RuntimeError):
+        with write_generation(kb) as staging:
+            _write_metadata(staging, version=2)
+            raise RuntimeError("upload failed")
+    assert current_generation(kb) == "g00000001"
+    assert _metadata(kb) == {"version": 1}
+    assert _generations(kb) == ["g00000001"]  # the staging copy is gone
+
+    with write_generation(kb) as staging:
+        assert json.load(open(os.path.join(staging, METADATA_FILE))) == {"version": 1}
+        _write_metadata(staging, version=2)
+    assert current_generation(kb) == "g00000002"
+    assert open(os.path.join(kb, CURRENT_FILE)).read() == "g00000002"
+    assert _metadata(kb) == {"version": 2}
+
+
+def test_a_legacy_kb_is_cloned_into_its_first_generation(tmp_path):
+    kb = str(tmp_path / "kb")
+    os.makedirs(kb)
+    _write_metadata(kb, version=0)
+    assert current_dir(kb) == kb
+
+    with write_generation(kb) as staging:
+        _write_metadata(staging, version=1)
+    assert _metadata(kb) == {"version": 1}
+    assert os.path.exists(os.path.join(kb, METADATA_FILE))  # kept until collected
+
+    with write_generation(kb) as staging:
+        pass
+    assert collect_garbage(kb, keep=1, grace_s=0) == ["g00000001", METADATA_FILE]
+
+
+def test_an_upload_shares_the_previous_generation_by_hard_link(tmp_path, ingest):
+    kb = str(tmp_path / "kb")
+    ingest(kb, "a.pdf", [f"first document chunk {i} " * 40 for i in range(200)])
+    previous = current_dir(kb)
+    ingest(kb, "b.pdf", ["second document"])
+
+    shared, total = _inodes(previous), _inodes(current_dir(kb))
+    added = sum(size for inode, size in total.items() if inode not in shared)
+    reused = sum(size for inode, size in total.items() if inode in shared)
+    assert reused > 10 * added
+    assert len(open_chunks(os.path.join(current_dir(kb), CHUNKS_FILE))) == 201
+    assert len(open_chunks(os.path.join(previous, CHUNKS_FILE))) == 200
+
+
+def test_gc_keeps_recent_and_leased_generations(tmp_path):
+    kb = str(tmp_path / "kb")
+    os.makedirs(kb)
+    for version in range(1, 5):
+        with write_generation(kb) as staging:
+            _write_metadata(staging, version=version)
+    leased = acquire_lease(os.path.join(kb, GENERATIONS_DIR, "g00000002"))
+
+    assert collect_garbage(kb, keep=2, grace_s=3600) == []  # too recently superseded
+    assert collect_garbage(kb, keep=2, grace_s=0) == ["g00000001"]
+    assert _generations(kb) == ["g00000002", "g00000003", "g00000004"]
+
+    leased.close()
+    assert collect_garbage(kb, keep=2, grace_s=0) == ["g00000002"]
+    assert _generations(kb) == ["g00000003", "g00000004"]
+    with pytest.raises(FileNotFoundError):
+        acquire_lease(os.path.join(kb, GENERATIONS_DIR, "g00000002"))
+
+
+def test_a_cached_kb_holds_its_generation_until_released(tmp_path, ingest):
+    base = str(tmp_path / "indices")
+    kb = os.path.join(base, "kb")
+    ingest(kb, "a.pdf", ["alpha chunk"])
+    cache = KBCache(base, max_bytes=1 << 30)
+    old = cache.get("kb")
+    old_dir = current_dir(kb)
+
+    ingest(kb, "b.pdf", ["beta chunk"])
+    ingest(kb, "c.pdf", ["gamma chunk"])
+    assert len(cache.get("kb").chunks) == 3
+    assert collect_garbage(kb, keep=1, grace_s=0) == ["g00000002"]
+    assert os.path.isdir(old_dir)
+    assert list(old.chunks) == ["alpha chunk"]
+
+    del old
+    gc.collect()
+    assert collect_garbage(kb, keep=1, grace_s=0) == [os.path.basename(old_dir)]
+    assert _generations(kb) == ["g00000003"]
@@ -115,8 +115,43 @@ export async function uploadFile(kbId: string, file: File): Promise<KnowledgeBas
         method: 'POST',
         body: formData,
     });
-    const data = await handleResponse<{ kb: any }>(response);
-    return transformApiKbToState(data.kb);
+    const data = await handleResponse<{ job_id: string }>(response);
+    return waitForIngestJob(kbId, file.name, data.job_id);
+}
+
+// Ingestion runs as a background job on the server; poll it with backoff for at most this long
+const JOB_POLL_INITIAL_MS = 1000;
+const JOB_POLL_MAX_INTERVAL_MS = 10000;
+const JOB_POLL_TIMEOUT_MS = 30 * 60 * 1000;
+
+async function waitForIngestJob(kbId: string, fileName: string, jobId: string): Promise<KnowledgeBase> {
+    const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+    let interval = JOB_POLL_INITIAL_MS;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, interval));
+        interval = Math.min(interval * 2, JOB_POLL_MAX_INTERVAL_MS);
+        const jobResponse = await fetch(`${API_BASE_URL}/jobs/${encodeURIComponent(jobId)}`, {
+            headers: {
+                'Accept': 'application/json',
+            },
+        });
+        if (jobResponse.status === 404) {
+            // The server forgets finished jobs (or restarted); the KB itself tells whether the file made it in
+            const kb = await getKnowledgeBase(kbId);
+            if (kb.files.includes(fileName)) {
+                return kb;
+            }
+            throw new Error(`Ingestion job for '${fileName}' is no longer tracked by the server and the file is not in the knowledge base`);
+        }
+        const { job } = await handleResponse<{ job: any }>(jobResponse);
+        if (job.status === 'completed') {
+            return transformApiKbToState(job.kb);
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Ingestion failed');
+        }
+    }
+    throw new Error(`Ingestion of '${fileName}' is still running after ${JOB_POLL_TIMEOUT_MS / 60000} minutes; check the knowledge base later`);
 }
 
 interface ChatResponse {